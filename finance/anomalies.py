@@ -0,0 +1,219 @@
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from finance.dataframes import transactions_frame
+from finance.models import Anomaly, Category, CategoryStats, Transaction, User
+
+# Порог модифицированного z-score (Иглевич и Хоаглин): выше — трата необычная
+ANOMALY_THRESHOLD = 3.5
+# Без такой истории по категории трата не оценивается
+MIN_HISTORY = 10
+# Окно, по которому считаются медиана и MAD в ночном расчёте
+BASELINE_DAYS = 365
+# Сколько пользователей обрабатывать за один проход ночного расчёта
+USERS_PER_CHUNK = 1000
+# 0.6745 — квантиль нормального распределения: MAD / 0.6745 оценивает σ
+MAD_SCALE = 0.6745
+
+
+def anomaly_score(stats, amount):
+    """Отклонение суммы от обычной для категории; None, если истории мало"""
+    if stats.count < MIN_HISTORY:
+        return None
+    if stats.mad:
+        return MAD_SCALE * (amount - stats.median) / stats.mad
+    # До первого ночного расчёта — обычный z-score по накопленным среднему и σ
+    if stats.std:
+        return (amount - stats.mean) / stats.std
+    return None
+
+
+def describe(category_name, amount, typical):
+    return (
+        f"Трата {amount:.2f} ₽ в категории «{category_name}» намного больше обычной "
+        f"(обычно около {typical:.2f} ₽)"
+    )
+
+
+def check_transaction(operation):
+    """Оценивает новую операцию по накопленной статистике категории за O(1).
+
+    Статистика обновляется этой же операцией; при аномалии создаётся Anomaly.
+    """
+    category = operation.category
+    if category.is_income:
+        return None
+
+    amount = float(operation.amount)
+    with transaction.atomic():
+        stats, _ = CategoryStats.objects.select_for_update().get_or_create(
+            category_id=category.pk, defaults={'user_id': operation.user_id}
+        )
+        score = anomaly_score(stats, amount)
+        stats.add(amount)
+        stats.save()
+
+    if score is None or score <= ANOMALY_THRESHOLD:
+        return None
+    typical = stats.median if stats.median is not None else stats.mean
+    return Anomaly.objects.create(
+        user_id=operation.user_id,
+        transaction=operation,
+        score=score,
+        description=describe(category.name, amount, typical)
+    )
+
+
+def update_stats(removed=(), added=()):
+    """Переносит изменения операций в CategoryStats без пересчёта по истории.
+
+    removed — пары (category_id, сумма) удалённых операций и прежние значения
+    изменённых, added — новые значения изменённых. Доходные категории пропускаются.
+    """
+    removed, added = list(removed), list(added)
+    category_ids = {category_id for category_id, _ in removed + added}
+    if not category_ids:
+        return
+
+    with transaction.atomic():
+        stats = {
+            row.category_id: row
+            for row in CategoryStats.objects.select_for_update().filter(category_id__in=category_ids)
+        }
+        for category_id, amount in removed:
+            if category_id in stats:
+                stats[category_id].remove(float(amount))
+
+        owners = dict(
+            Category.objects
+            .filter(pk__in={category_id for category_id, _ in added}, is_income=False)
+            .values_list('pk', 'user_id')
+        )
+        for category_id, amount in added:
+            if category_id not in owners:
+                continue
+            if category_id not in stats:
+                stats[category_id], _ = CategoryStats.objects.select_for_update().get_or_create(
+                    category_id=category_id, defaults={'user_id': owners[category_id]}
+                )
+            stats[category_id].add(float(amount))
+
+        for row in stats.values():
+            row.save()
+
+
+def _score_frame(frame):
+    """Добавляет к операциям медиану, MAD, размер группы и оценку — для всех категорий сразу"""
+    keys = [frame['user_id'], frame['category_id']]
+    amounts = frame['amount'].to_numpy() / 100
+    frame = frame.assign(rub=amounts)
+
+    groups = frame.groupby(keys)['rub']
+    median = groups.transform('median').to_numpy()
+    deviation = np.abs(amounts - median)
+    mad = frame.assign(deviation=deviation).groupby(keys)['deviation'].transform('median').to_numpy()
+    count = groups.transform('size').to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where((mad > 0) & (count >= MIN_HISTORY), MAD_SCALE * (amounts - median) / mad, np.nan)
+    return frame.assign(median=median, mad=mad, count=count, score=score)
+
+
+def _save_stats(frame):
+    """Пересобирает CategoryStats по окну расчёта"""
+    stats = frame.groupby(['user_id', 'category_id']).agg(
+        count=('rub', 'size'),
+        mean=('rub', 'mean'),
+        var=('rub', 'var'),
+        median=('median', 'first'),
+        mad=('mad', 'first'),
+    ).reset_index()
+    rows = [
+        CategoryStats(
+            user_id=int(user_id),
+            category_id=int(category_id),
+            count=int(count),
+            mean=float(mean),
+            # var с ddof=1, поэтому m2 = var * (n - 1); у одиночной операции var = NaN
+            m2=float(var * (count - 1)) if count > 1 else 0.0,
+            median=float(median),
+            mad=float(mad),
+        )
+        for user_id, category_id, count, mean, var, median, mad in zip(
+            stats['user_id'], stats['category_id'], stats['count'], stats['mean'],
+            stats['var'], stats['median'], stats['mad']
+        )
+    ]
+    CategoryStats.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['category'],
+        update_fields=['count', 'mean', 'm2', 'median', 'mad', 'updated_at'],
+    )
+
+
+def _save_anomalies(frame, recent_from):
+    """Создаёт Anomaly для недавних операций с высокой оценкой, если их ещё нет"""
+    flagged = frame[(frame['date'] >= np.datetime64(recent_from)) & (frame['score'] > ANOMALY_THRESHOLD)]
+    if flagged.empty:
+        return 0
+
+    known = set(
+        Anomaly.objects
+        .filter(transaction_id__in=flagged['id'].tolist())
+        .values_list('transaction_id', flat=True)
+    )
+    anomalies = [
+        Anomaly(
+            user_id=int(row.user_id),
+            transaction_id=int(row.id),
+            score=float(row.score),
+            description=describe(row.category, row.rub, row.median),
+        )
+        for row in flagged.itertuples()
+        if row.id not in known
+    ]
+    Anomaly.objects.bulk_create(anomalies)
+    return len(anomalies)
+
+
+def detect_anomalies(today=None, recent_days=2, user_ids=None):
+    """Ночной расчёт: медиана и MAD по категориям за BASELINE_DAYS для всех пользователей.
+
+    Оцениваются операции за последние recent_days дней (в том числе пришедшие
+    импортом или через API, минуя проверку при сохранении). Возвращает число новых аномалий.
+    """
+    today = today or timezone.now().date()
+    since = today - timedelta(days=BASELINE_DAYS)
+    recent_from = today - timedelta(days=recent_days - 1)
+
+    users = User.objects.order_by('pk').values_list('pk', flat=True)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    users = iter(list(users))
+
+    created = 0
+    while True:
+        chunk = list(islice(users, USERS_PER_CHUNK))
+        if not chunk:
+            return created
+
+        operations = Transaction.objects.filter(
+            user_id__in=chunk, date__gte=since, date__lte=today, category__is_income=False
+        )
+        frame = transactions_frame(operations, ['id', 'user_id', 'category_id', 'category', 'date', 'amount'])
+        with transaction.atomic():
+            # Категории без расходов в окне больше не оцениваются по старой статистике
+            CategoryStats.objects.filter(user_id__in=chunk).exclude(
+                category_id__in=operations.values('category_id')
+            ).delete()
+            if frame.empty:
+                continue
+
+            frame = _score_frame(frame)
+            _save_stats(frame)
+            created += _save_anomalies(frame, recent_from)
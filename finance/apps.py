@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class FinanceConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'finance'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (сводки по дням и т.п.)
+        from finance import signals  # noqa: F401
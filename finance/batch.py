@@ -0,0 +1,173 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from finance.anomalies import update_stats
+from finance.models import Category, Transaction, bump_data_version
+from finance.rollups import apply_transactions
+from finance.signals import grouped_transaction_deletes
+
+# Сколько операций можно передать в одном запросе
+BATCH_MAX_ITEMS = 500
+# Поля операции, которые можно задавать через API
+EDITABLE_FIELDS = ('amount', 'date', 'category', 'description')
+
+
+class BatchError(Exception):
+    """Пакет не принят. errors — {номер элемента: {поле: [сообщения]}} или общее сообщение"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def serialize(operation):
+    return {
+        'id': operation.pk,
+        'date': operation.date.isoformat(),
+        'amount': str(operation.amount),
+        'category': operation.category_id,
+        'category_name': operation.category.name,
+        'is_income': operation.category.is_income,
+        'description': operation.description,
+    }
+
+
+def _check_size(items):
+    if not isinstance(items, list) or not items:
+        raise BatchError('Ожидается непустой список')
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchError(f'Не больше {BATCH_MAX_ITEMS} элементов за запрос')
+
+
+def _clean_item(item, categories, operation, required):
+    """Проверяет поля элемента и переносит их в operation. Возвращает ошибки по полям"""
+    if not isinstance(item, dict):
+        return {'__all__': ['Ожидается объект']}
+
+    errors = {}
+    for name in EDITABLE_FIELDS:
+        if name not in item:
+            if required and name != 'description':
+                errors[name] = ['Обязательное поле']
+            continue
+
+        value = item[name]
+        if name == 'category':
+            category = categories.get(_as_id(value))
+            if category is None:
+                errors[name] = ['Нет такой категории']
+            else:
+                operation.category = category
+            continue
+
+        try:
+            value = Transaction._meta.get_field(name).clean(value if value is not None else '', operation)
+        except ValidationError as e:
+            errors[name] = e.messages
+            continue
+        if name == 'amount':
+            if value <= 0:
+                errors[name] = ['Сумма должна быть больше нуля']
+                continue
+            # Как сумма вернётся из БД: 250 -> 250.00
+            value = value.quantize(Decimal('0.01'))
+        setattr(operation, name, value)
+    return errors
+
+
+def _user_categories(user):
+    return {category.pk: category for category in Category.objects.filter(user=user)}
+
+
+def _as_id(value):
+    """id из JSON: число или строка из цифр"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def _rollup_rows(operations):
+    return [(op.user_id, op.category_id, op.date, op.amount) for op in operations]
+
+
+def create_transactions(user, items):
+    """Создаёт операции одним bulk_create. Либо все элементы корректны, либо ничего не пишется"""
+    _check_size(items)
+    categories = _user_categories(user)
+
+    operations, errors = [], {}
+    for index, item in enumerate(items):
+        operation = Transaction(user=user, description='')
+        item_errors = _clean_item(item, categories, operation, required=True)
+        if item_errors:
+            errors[index] = item_errors
+        operations.append(operation)
+    if errors:
+        raise BatchError(errors)
+
+    # bulk_create не вызывает сигналы: сводка, статистика категорий и версия данных обновляются здесь
+    with transaction.atomic():
+        Transaction.objects.bulk_create(operations)
+        apply_transactions(_rollup_rows(operations))
+        update_stats(added=[(op.category_id, op.amount) for op in operations])
+        bump_data_version(user.pk)
+    return operations
+
+
+def update_transactions(user, items):
+    """Изменяет операции одним bulk_update; элементы передаются с id"""
+    _check_size(items)
+    ids = [_as_id(item.get('id')) for item in items if isinstance(item, dict)]
+    existing = Transaction.objects.filter(user=user, pk__in=ids).select_related('category').in_bulk()
+    categories = _user_categories(user)
+
+    operations, previous, fields, errors = [], [], set(), {}
+    seen = set()
+    for index, item in enumerate(items):
+        operation = existing.get(_as_id(item.get('id'))) if isinstance(item, dict) else None
+        if operation is None or operation.pk in seen:
+            errors[index] = {'id': ['Нет такой операции или она указана дважды']}
+            continue
+        seen.add(operation.pk)
+        previous.append((operation.user_id, operation.category_id, operation.date, operation.amount))
+
+        item_errors = _clean_item(item, categories, operation, required=False)
+        if item_errors:
+            errors[index] = item_errors
+            continue
+        fields.update(name for name in EDITABLE_FIELDS if name in item)
+        operations.append(operation)
+    if errors:
+        raise BatchError(errors)
+
+    if fields:
+        with transaction.atomic():
+            Transaction.objects.bulk_update(operations, sorted(fields))
+            apply_transactions(previous, sign=-1)
+            apply_transactions(_rollup_rows(operations))
+            update_stats(
+                removed=[(category_id, amount) for _, category_id, _, amount in previous],
+                added=[(op.category_id, op.amount) for op in operations],
+            )
+            bump_data_version(user.pk)
+    return operations
+
+
+def delete_transactions(user, ids):
+    """Удаляет операции пользователя. Возвращает число удалённых"""
+    _check_size(ids)
+    ids = [_as_id(pk) for pk in ids]
+    if None in ids:
+        raise BatchError('ids должны быть числами')
+
+    # Обычное удаление с каскадами и сигналами; сводка, статистика категорий
+    # и версия данных обновляются сгруппированно в конце пакета
+    with transaction.atomic(), grouped_transaction_deletes():
+        _, deleted = Transaction.objects.filter(user=user, pk__in=ids).delete()
+    return deleted.get(Transaction._meta.label, 0)
@@ -0,0 +1,90 @@
+from django.db.models import Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncQuarter, TruncWeek, TruncYear
+
+from finance.hierarchy import CategoryTree, subtree_totals
+from finance.models import DailyCategoryTotal
+from finance.summary import ALL_TIME, summarize_period
+
+# Интервал -> (функция усечения даты, примерная длина в днях, подпись точки)
+BUCKETS = {
+    'day': (TruncDay, 1, lambda d: d.strftime('%Y-%m-%d')),
+    'week': (TruncWeek, 7, lambda d: d.strftime('%Y-%m-%d')),
+    'month': (TruncMonth, 30, lambda d: d.strftime('%Y-%m')),
+    'quarter': (TruncQuarter, 91, lambda d: f"{d.year}-Q{(d.month - 1) // 3 + 1}"),
+    'year': (TruncYear, 365, lambda d: d.strftime('%Y')),
+}
+DEFAULT_BUCKET = 'month'
+# Больше точек графику не нужно: интервал укрупняется автоматически
+MAX_POINTS = 300
+
+
+def choose_bucket(user, bucket=DEFAULT_BUCKET):
+    """Самый мелкий интервал не мельче запрошенного, дающий не больше MAX_POINTS точек.
+
+    bucket='auto' выбирает самый мелкий подходящий интервал начиная с дня.
+    """
+    names = list(BUCKETS)
+    if bucket not in BUCKETS:
+        bucket = names[0] if bucket == 'auto' else DEFAULT_BUCKET
+
+    bounds = DailyCategoryTotal.objects.filter(user=user).aggregate(first=Min('date'), last=Max('date'))
+    if bounds['first'] is None:
+        return bucket
+    span_days = (bounds['last'] - bounds['first']).days + 1
+
+    for name in names[names.index(bucket):]:
+        if span_days / BUCKETS[name][1] <= MAX_POINTS:
+            return name
+    return names[-1]
+
+
+def time_series(user, bucket=DEFAULT_BUCKET):
+    """Доходы и расходы по интервалам, посчитанные в БД.
+
+    Возвращает {'bucket': ..., 'labels': [...], 'income': [...], 'expense': [...]};
+    bucket в ответе может быть крупнее запрошенного, если точек слишком много.
+    """
+    bucket = choose_bucket(user, bucket)
+    trunc, _, label = BUCKETS[bucket]
+    rows = (
+        DailyCategoryTotal.objects
+        .filter(user=user)
+        .annotate(period=trunc('date'))
+        .values('period')
+        .annotate(
+            income=Sum('total', filter=Q(category__is_income=True)),
+            expense=Sum('total', filter=Q(category__is_income=False))
+        )
+        .order_by('period')
+    )
+
+    series = {'bucket': bucket, 'labels': [], 'income': [], 'expense': []}
+    for row in rows:
+        series['labels'].append(label(row['period']))
+        series['income'].append(float(row['income'] or 0))
+        series['expense'].append(float(row['expense'] or 0))
+    return series
+
+
+def category_distribution(user, depth=None):
+    """Расходы по категориям: {'labels': [...], 'values': [...]}, по убыванию суммы.
+
+    depth сворачивает подкатегории глубже этого уровня в предка (0 — только корневые);
+    None — каждая категория отдельно.
+    """
+    if depth is None:
+        categories = summarize_period(user, ALL_TIME).top_expense_categories(limit=None)
+    else:
+        totals = CategoryTree(subtree_totals(user, ALL_TIME)).rollup(depth)
+        categories = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'labels': [name for name, _ in categories],
+        'values': [float(amount) for _, amount in categories],
+    }
+
+
+def chart_data_etag(request, *args, **kwargs):
+    """ETag данных графиков: меняется вместе с версией данных пользователя"""
+    if not request.user.is_authenticated:
+        return None
+    return f'"{request.user.pk}-{request.user.data_version}"'
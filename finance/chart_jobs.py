@@ -0,0 +1,124 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from finance import chart_worker
+from finance.charts import CHART_CACHE_DIR, CHARTS, chart_version, get_cached_chart
+
+# Сколько процессов рисуют графики
+CHART_WORKERS = getattr(settings, 'CHART_WORKERS', 2)
+# Сколько завершённых задач помнить (нужно, чтобы не перерисовывать графики без данных)
+CHART_JOBS_MAX = getattr(settings, 'CHART_JOBS_MAX', 1000)
+# Через сколько секунд после падения пула создавать новый
+CHART_POOL_RESTART_DELAY = getattr(settings, 'CHART_POOL_RESTART_DELAY', 60)
+
+_executor = None
+# Когда (time.monotonic) пул обнаружен упавшим; None — пул исправен
+_broken_at = None
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn одинаково работает на всех платформах и не наследует соединения с БД
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=chart_worker.init_worker
+        )
+    return _executor
+
+
+def _forget_finished_jobs():
+    if len(_jobs) <= CHART_JOBS_MAX:
+        return
+    for key in [key for key, future in _jobs.items() if future.done()]:
+        del _jobs[key]
+
+
+def _restart_pending():
+    """Пул упал недавно: новый ещё не создаётся, чтобы не запускать процессы на каждом опросе"""
+    return _broken_at is not None and time.monotonic() - _broken_at < CHART_POOL_RESTART_DELAY
+
+
+def _submit(key):
+    global _executor, _broken_at
+
+    try:
+        return _get_executor().submit(chart_worker.render, *key)
+    except BrokenProcessPool as e:
+        if _broken_at is None:
+            _broken_at = time.monotonic()
+        if _restart_pending():
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    # Пул мог упасть вместе с процессом-рисовальщиком — создаём новый
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor, _broken_at = None, None
+    return _get_executor().submit(chart_worker.render, *key)
+
+
+def schedule_chart(user, kind):
+    """Ставит отрисовку графика в очередь, если его нет в кэше.
+
+    Задачи для одного пользователя, типа и версии данных не дублируются.
+    """
+    key = (user.pk, kind, chart_version(user, kind))
+    with _lock:
+        future = _jobs.get(key)
+        if future is not None and not _is_stale(future):
+            return future
+
+        _forget_finished_jobs()
+        future = _submit(key)
+        _jobs[key] = future
+        return future
+
+
+def _is_stale(future):
+    """Задача завершилась с ошибкой или её файл уже вытеснен из кэша"""
+    if not future.done():
+        return False
+    error = future.exception()
+    if isinstance(error, BrokenProcessPool):
+        # Пока пул не пересоздан, повтор снова упадёт
+        return not _restart_pending()
+    if error is not None:
+        return True
+    url = future.result()
+    return url is not None and not (CHART_CACHE_DIR / url.rsplit('/', 1)[-1]).exists()
+
+
+def chart_status(user, kind):
+    """Состояние графика: ready (с url), pending, empty (нет данных) или error"""
+    url = get_cached_chart(user, kind)
+    if url:
+        return {'status': 'ready', 'url': url}
+
+    future = schedule_chart(user, kind)
+    if not future.done():
+        return {'status': 'pending', 'url': None}
+
+    try:
+        url = future.result()
+    except Exception as e:
+        # Следующий запрос состояния поставит задачу заново
+        print(f"❌ Ошибка отрисовки графика {kind}: {e}")
+        return {'status': 'error', 'url': None}
+
+    if url:
+        return {'status': 'ready', 'url': url}
+    return {'status': 'empty', 'url': None}
+
+
+def charts_status(user, kinds=None):
+    """Состояние нескольких графиков пользователя"""
+    return {kind: chart_status(user, kind) for kind in (kinds or CHARTS)}
@@ -0,0 +1,24 @@
+"""Точка входа процессов-рисовальщиков графиков.
+
+Процесс, запущенный через spawn, импортирует этот модуль до настройки Django,
+поэтому здесь нельзя импортировать модели: finance.charts загружается только
+после django.setup().
+"""
+import os
+
+
+def init_worker():
+    """Настраивает Django в процессе-рисовальщике"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fincontrol.settings')
+    import django
+    django.setup()
+
+
+def render(user_id, kind, version):
+    from django.db import connections
+    from finance.charts import render_chart
+
+    try:
+        return render_chart(user_id, kind, version)
+    finally:
+        connections.close_all()
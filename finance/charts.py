@@ -0,0 +1,198 @@
+import hashlib
+import hmac
+import os
+import threading
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from django.conf import settings
+from django.utils import timezone
+
+from finance.chart_data import time_series
+from finance.dataframes import iter_transaction_frames
+from finance.models import MonthlyBudget, Transaction
+from finance.summary import month_period, summarize_period
+
+# Каталог и URL кэша графиков
+CHART_CACHE_DIR = Path(settings.STATICFILES_DIRS[0]) / 'images' / 'charts'
+CHART_CACHE_URL = f"{settings.STATIC_URL}images/charts/"
+# Сколько файлов графиков хранить всего (самые давние удаляются)
+CHART_CACHE_MAX_FILES = getattr(settings, 'CHART_CACHE_MAX_FILES', 1000)
+
+# pyplot хранит состояние глобально, поэтому рисуем по одному графику за раз
+_render_lock = threading.Lock()
+
+
+def create_income_expense_chart(user, chart_path):
+    """Рисует доходы и расходы по месяцам. Возвращает False, если нет данных"""
+    # Ряд считается в БД и не длиннее MAX_POINTS точек при любой длине истории
+    series = time_series(user, 'month')
+    if not series['labels']:
+        return False
+
+    plt.figure(figsize=(10, 5))
+    plt.plot(series['labels'], series['income'], label='Доходы', color='green', marker='o')
+    plt.plot(series['labels'], series['expense'], label='Расходы', color='red', marker='s')
+
+    plt.title('Доходы и расходы по месяцам')
+    plt.xlabel('Месяц')
+    plt.ylabel('Сумма (₽)')
+    plt.xticks(rotation=45)
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    plt.tight_layout()
+    return _save_figure(chart_path)
+
+
+def create_category_pie_chart(user, chart_path):
+    """Рисует распределение расходов по категориям"""
+    expenses = Transaction.objects.filter(user=user, category__is_income=False)
+
+    category_totals = None
+    for df in iter_transaction_frames(expenses, ['category', 'amount']):
+        chunk = df.groupby('category')['amount'].sum()
+        category_totals = chunk if category_totals is None else category_totals.add(chunk, fill_value=0)
+    if category_totals is None:
+        return False
+    category_totals = category_totals / 100
+
+    plt.figure(figsize=(8, 8))
+    colors = plt.cm.Set3(range(len(category_totals)))
+    plt.pie(category_totals.values, labels=category_totals.index, autopct='%1.1f%%', startangle=90, colors=colors)
+    plt.title('Распределение расходов по категориям')
+    plt.tight_layout()
+    return _save_figure(chart_path)
+
+
+def create_budget_chart(user, chart_path):
+    """Рисует сравнение плана и факта за текущий месяц"""
+    current_month = timezone.now().date().replace(day=1)
+
+    # Получаем бюджет
+    try:
+        budget = MonthlyBudget.objects.get(user=user, month=current_month.strftime('%Y-%m'))
+        planned_income = float(budget.planned_income)
+        planned_expense = float(budget.planned_expense)
+    except MonthlyBudget.DoesNotExist:
+        return False
+
+    # Фактические доходы и расходы за текущий месяц
+    summary = summarize_period(user, month_period(current_month))
+    total_income = float(summary.income)
+    total_expense = float(summary.expense)
+
+    # Строим график
+    plt.figure(figsize=(10, 6))
+
+    # План
+    plt.bar(['План', 'Факт'], [planned_income, total_income], color=['skyblue', 'green'], alpha=0.7, label='Доходы')
+    plt.bar(['План', 'Факт'], [planned_expense, total_expense], bottom=[planned_income, total_income],
+            color=['salmon', 'red'], alpha=0.7, label='Расходы')
+
+    plt.title(f'Сравнение плана и факта за {current_month.strftime("%B %Y")}')
+    plt.ylabel('Сумма (₽)')
+    plt.legend()
+    plt.grid(True, alpha=0.3)
+    return _save_figure(chart_path)
+
+
+def _save_figure(chart_path):
+    """Сохраняет текущую фигуру атомарно: сначала во временный файл"""
+    tmp_path = chart_path.with_name(f"{chart_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        plt.savefig(tmp_path, dpi=100, format='png')
+        os.replace(tmp_path, chart_path)
+        print(f"✅ График сохранён: {chart_path}")
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка сохранения графика: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return False
+    finally:
+        plt.close()
+
+
+# Тип графика -> функция отрисовки
+CHARTS = {
+    'income_expense': create_income_expense_chart,
+    'category_pie': create_category_pie_chart,
+    'budget_comparison': create_budget_chart,
+}
+
+
+def chart_version(user, kind):
+    """Версия данных графика: меняется при изменении операций или бюджета"""
+    version = str(user.data_version)
+    if kind == 'budget_comparison':
+        # График бюджета зависит ещё и от текущего месяца
+        version += timezone.now().strftime('-%Y%m')
+    return version
+
+
+def chart_filename(user_id, kind, version):
+    """Уникальное для пользователя имя файла, которое нельзя угадать"""
+    key = f"{user_id}:{kind}:{version}".encode()
+    digest = hmac.new(settings.SECRET_KEY.encode(), key, hashlib.sha256).hexdigest()[:16]
+    return f"{kind}_{user_id}_{version}_{digest}.png"
+
+
+def chart_url(filename):
+    return f"{CHART_CACHE_URL}{filename}"
+
+
+def get_cached_chart(user, kind):
+    """URL готового графика текущей версии или None, если его ещё нет"""
+    path = CHART_CACHE_DIR / chart_filename(user.pk, kind, chart_version(user, kind))
+    try:
+        # Отмечаем использование, чтобы вытеснялись самые давние файлы
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return chart_url(path.name)
+
+
+def render_chart(user_id, kind, version):
+    """Рисует график в кэш. Возвращает URL или None, если данных нет"""
+    path = CHART_CACHE_DIR / chart_filename(user_id, kind, version)
+    if path.exists():
+        return chart_url(path.name)
+
+    CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with _render_lock:
+        rendered = CHARTS[kind](user_id, path)
+    if not rendered:
+        return None
+
+    evict_charts(user_id, kind, keep=path.name)
+    return chart_url(path.name)
+
+
+def get_chart(user, kind):
+    """URL графика из кэша; при промахе график рисуется и сохраняется"""
+    cached = get_cached_chart(user, kind)
+    if cached:
+        return cached
+    return render_chart(user.pk, kind, chart_version(user, kind))
+
+
+def evict_charts(user_id, kind, keep):
+    """Удаляет устаревшие версии графика и самые давние файлы сверх лимита"""
+    for path in CHART_CACHE_DIR.glob(f"{kind}_{user_id}_*.png"):
+        if path.name != keep:
+            path.unlink(missing_ok=True)
+
+    files = []
+    for path in CHART_CACHE_DIR.glob('*.png'):
+        try:
+            files.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    if len(files) <= CHART_CACHE_MAX_FILES:
+        return
+
+    files.sort()
+    for _, path in files[:len(files) - CHART_CACHE_MAX_FILES]:
+        if path.name != keep:
+            path.unlink(missing_ok=True)
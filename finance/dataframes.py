@@ -0,0 +1,65 @@
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+# Сколько строк читать из БД за раз при загрузке по частям
+DEFAULT_CHUNK_SIZE = 50000
+
+# Колонка -> (выражение или путь ORM, тип NumPy).
+# Суммы хранятся в копейках (int64), чтобы не терять точность и не возиться с Decimal.
+COLUMNS = {
+    'id': ('id', np.int64),
+    'user_id': ('user_id', np.int64),
+    'category_id': ('category_id', np.int64),
+    'date': ('date', 'datetime64[D]'),
+    'amount': (Cast(Round(F('amount') * 100), BigIntegerField()), np.int64),
+    'is_income': ('category__is_income', np.bool_),
+    'category': ('category__name', object),
+}
+
+
+def _values_list(queryset, columns):
+    """values_list только с нужными колонками; категория присоединяется в SQL"""
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Неизвестные колонки: {', '.join(sorted(unknown))}")
+
+    expressions = {f'_col_{name}': COLUMNS[name][0] for name in columns}
+    annotations = {alias: expr for alias, expr in expressions.items() if not isinstance(expr, str)}
+    fields = [
+        alias if alias in annotations else expr
+        for alias, expr in expressions.items()
+    ]
+    return queryset.order_by().annotate(**annotations).values_list(*fields)
+
+
+def _build_frame(rows, columns):
+    """Собирает DataFrame по колонкам, без промежуточных словарей"""
+    if rows:
+        data = zip(*rows)
+    else:
+        data = ([] for _ in columns)
+    return pd.DataFrame({
+        name: np.array(values, dtype=COLUMNS[name][1])
+        for name, values in zip(columns, data)
+    })
+
+
+def transactions_frame(queryset, columns=('date', 'amount', 'is_income')):
+    """Загружает операции в DataFrame с типизированными колонками"""
+    columns = list(columns)
+    return _build_frame(list(_values_list(queryset, columns)), columns)
+
+
+def iter_transaction_frames(queryset, columns=('date', 'amount', 'is_income'), chunk_size=DEFAULT_CHUNK_SIZE):
+    """Загружает операции частями по chunk_size строк; память не растёт с историей"""
+    columns = list(columns)
+    rows = _values_list(queryset, columns).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield _build_frame(chunk, columns)
@@ -0,0 +1,59 @@
+import csv
+import tempfile
+
+from django.conf import settings
+
+# Сколько строк читать из БД за раз при выгрузке
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+HEADER = ['Дата', 'Тип', 'Сумма', 'Категория', 'Описание']
+
+
+def export_rows(transactions):
+    """Строки выгрузки без создания моделей; категория присоединяется в том же запросе"""
+    rows = (
+        transactions
+        .order_by('-date', '-id')
+        .values_list('date', 'category__is_income', 'amount', 'category__name', 'description')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    for day, is_income, amount, category, description in rows:
+        yield [day, 'Доход' if is_income else 'Расход', amount, category, description]
+
+
+class Echo:
+    """Псевдофайл для csv.writer: write() возвращает строку, а не пишет её"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(transactions):
+    """CSV по строкам; BOM нужен, чтобы Excel открыл кириллицу без вопросов"""
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(HEADER)
+    for row in export_rows(transactions):
+        yield writer.writerow(row)
+
+
+def write_xlsx(transactions):
+    """Записывает выгрузку во временный файл XLSX и возвращает его открытым на начале.
+
+    write_only сбрасывает строки на диск по мере записи, поэтому память
+    не растёт с числом операций. Файл удаляется при закрытии.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Операции')
+    sheet.append(HEADER)
+    for row in export_rows(transactions):
+        day = WriteOnlyCell(sheet, value=row[0])
+        day.number_format = 'DD.MM.YYYY'
+        sheet.append([day, *row[1:]])
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
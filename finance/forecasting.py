@@ -0,0 +1,176 @@
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from finance.models import BudgetForecast, DailyCategoryTotal, MonthlyBudget, User
+from finance.periods import month_range
+
+# Сколько дней истории учитывают прогнозы по дням недели и сглаживание
+HISTORY_DAYS = 56
+# Вес последнего дня в экспоненциальном сглаживании
+EWMA_ALPHA = 0.2
+# Метод, по которому считается основной прогноз (BudgetForecast.projected)
+FORECAST_METHOD = getattr(settings, 'FORECAST_METHOD', BudgetForecast.METHOD_WEEKDAY)
+# Сколько пользователей обрабатывать за один проход
+USERS_PER_CHUNK = 1000
+
+
+def _daily_matrix(user_ids, since, today):
+    """Расходы по дням: матрица пользователи × дни [since, today]"""
+    days = (today - since).days + 1
+    index = {user_id: row for row, user_id in enumerate(user_ids)}
+    rows = (
+        DailyCategoryTotal.objects
+        .filter(user_id__in=user_ids, date__gte=since, date__lte=today, category__is_income=False)
+        .values('user_id', 'date')
+        .annotate(spent=Sum('total'))
+        .values_list('user_id', 'date', 'spent')
+        .order_by()
+    )
+    users, offsets, amounts = [], [], []
+    for user_id, day, spent in rows:
+        users.append(index[user_id])
+        offsets.append((day - since).days)
+        amounts.append(float(spent))
+
+    matrix = np.zeros((len(user_ids), days))
+    matrix[np.array(users, dtype=np.intp), np.array(offsets, dtype=np.intp)] = amounts
+    return matrix
+
+
+def project(matrix, since, today, alpha=EWMA_ALPHA):
+    """Прогноз расходов на весь текущий месяц для каждой строки матрицы.
+
+    Возвращает (потрачено с начала месяца, {метод: прогноз}) — массивы по пользователям.
+    История пользователя отсчитывается от его первого расхода в окне, чтобы
+    у новых пользователей дни до регистрации не занижали оценки.
+    """
+    month_start, month_end = month_range(today)
+    days = matrix.shape[1]
+    month_from = max((month_start - since).days, 0)
+    spent = matrix[:, month_from:].sum(axis=1)
+
+    # Оставшиеся дни месяца и их дни недели
+    remaining = [today + timedelta(days=n) for n in range(1, (month_end - today).days)]
+    remaining_weekdays = np.bincount(np.array([day.weekday() for day in remaining], dtype=np.intp), minlength=7)
+
+    # 1. Среднее за прошедшие дни месяца — прежняя оценка
+    days_passed = (today - month_start).days + 1
+    mean = spent + spent / days_passed * len(remaining)
+
+    # Дни истории каждого пользователя: с первого расхода в окне
+    active = matrix > 0
+    first = np.where(active.any(axis=1), active.argmax(axis=1), days - 1)
+    observed = np.arange(days)[None, :] >= first[:, None]
+
+    # 2. Средние по дням недели, сложенные по оставшимся дням месяца
+    weekdays = np.array([(since + timedelta(days=n)).weekday() for n in range(days)])
+    onehot = np.eye(7)[weekdays]
+    weekday_sums = matrix @ onehot
+    weekday_counts = observed @ onehot
+    weekday_means = np.divide(weekday_sums, weekday_counts, out=np.zeros_like(weekday_sums), where=weekday_counts > 0)
+    weekday = spent + weekday_means @ remaining_weekdays
+
+    # 3. Экспоненциально сглаженный дневной расход на оставшиеся дни
+    weights = (1 - alpha) ** np.arange(days - 1, -1, -1)
+    weighted = observed * weights
+    level = (matrix * weighted).sum(axis=1) / weighted.sum(axis=1)
+    ewma = spent + level * len(remaining)
+
+    return spent, {
+        BudgetForecast.METHOD_MEAN: mean,
+        BudgetForecast.METHOD_WEEKDAY: weekday,
+        BudgetForecast.METHOD_EWMA: ewma,
+    }
+
+
+def _money(value):
+    return Decimal(f"{value:.2f}")
+
+
+def _forecast_chunk(budgets, versions, today):
+    user_ids = [budget.user_id for budget in budgets]
+    since = today - timedelta(days=HISTORY_DAYS - 1)
+    spent, projections = project(_daily_matrix(user_ids, since, today), since, today)
+
+    forecasts = []
+    for row, budget in enumerate(budgets):
+        forecast = BudgetForecast(
+            user_id=budget.user_id,
+            month=budget.month,
+            spent=_money(spent[row]),
+            planned_expense=budget.planned_expense,
+            projected_mean=_money(projections[BudgetForecast.METHOD_MEAN][row]),
+            projected_weekday=_money(projections[BudgetForecast.METHOD_WEEKDAY][row]),
+            projected_ewma=_money(projections[BudgetForecast.METHOD_EWMA][row]),
+            projected=_money(projections[FORECAST_METHOD][row]),
+            method=FORECAST_METHOD,
+            data_version=versions.get(budget.user_id, 0),
+            computed_on=today,
+        )
+        forecast.will_overspend = budget.planned_expense > 0 and forecast.projected > budget.planned_expense
+        forecasts.append(forecast)
+
+    BudgetForecast.objects.bulk_create(
+        forecasts,
+        update_conflicts=True,
+        unique_fields=['user', 'month'],
+        update_fields=[
+            'spent', 'planned_expense', 'projected_mean', 'projected_weekday', 'projected_ewma',
+            'projected', 'method', 'will_overspend', 'data_version', 'computed_on',
+        ],
+    )
+    return forecasts
+
+
+def _budgets(user_ids, today):
+    budgets = MonthlyBudget.objects.filter(month=today.strftime('%Y-%m')).order_by('user_id')
+    if user_ids is not None:
+        budgets = budgets.filter(user_id__in=user_ids)
+    return budgets
+
+
+def forecast_budgets(user_ids=None, today=None):
+    """Ночной расчёт: прогнозы всех пользователей с бюджетом на текущий месяц.
+
+    На пачку пользователей — один запрос к дневной сводке и один проход NumPy.
+    Возвращает число пользователей, которые по прогнозу превысят бюджет.
+    """
+    today = today or timezone.now().date()
+    budgets = iter(list(_budgets(user_ids, today)))
+
+    overspending = 0
+    while True:
+        chunk = list(islice(budgets, USERS_PER_CHUNK))
+        if not chunk:
+            return overspending
+        versions = dict(
+            User.objects.filter(pk__in=[b.user_id for b in chunk]).values_list('pk', 'data_version')
+        )
+        overspending += sum(f.will_overspend for f in _forecast_chunk(chunk, versions, today))
+
+
+def get_forecasts(user_ids, versions, today):
+    """Сохранённые прогнозы {user_id: BudgetForecast} на текущий месяц.
+
+    Устаревшие (данные изменились или прогноз вчерашний) пересчитываются одним проходом.
+    """
+    month = today.strftime('%Y-%m')
+    forecasts = {
+        forecast.user_id: forecast
+        for forecast in BudgetForecast.objects.filter(user_id__in=user_ids, month=month)
+    }
+    stale = [
+        budget for budget in _budgets(user_ids, today)
+        if budget.user_id not in forecasts
+        or forecasts[budget.user_id].data_version != versions.get(budget.user_id)
+        or forecasts[budget.user_id].computed_on != today
+    ]
+    if stale:
+        forecasts.update((f.user_id, f) for f in _forecast_chunk(stale, versions, today))
+    return forecasts
@@ -1,7 +1,10 @@
 from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
-from .models import Category, Transaction, Recommendation, Anomaly, FavoriteReport, MonthlyBudget
+from .hierarchy import is_in_subtree
+from .periods import filter_history_period
+from .reports import ReportFilterError, parse_filters
+from .models import Category, CategoryRule, Transaction, Recommendation, Anomaly, FavoriteReport, MonthlyBudget
 
 
 User = get_user_model()
@@ -20,6 +23,18 @@ class CategoryForm(forms.ModelForm):
             'is_income': forms.RadioSelect(choices=((False, 'Расход'), (True, 'Доход')))
         }
 
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        if user:
+            self.fields['parent'].queryset = Category.objects.filter(user=user)
+
+    def clean_parent(self):
+        parent = self.cleaned_data['parent']
+        if parent is not None and self.instance.pk is not None and is_in_subtree(parent.pk, self.instance.pk):
+            raise forms.ValidationError('Категорию нельзя вложить в неё саму или в её подкатегорию')
+        return parent
+
 class TransactionForm(forms.ModelForm):
     class Meta:
         model = Transaction
@@ -61,6 +76,18 @@ class FavoriteReportForm(forms.ModelForm):
     class Meta:
         model = FavoriteReport
         fields = ['name', 'filters']
+        labels = {
+            'name': 'Название',
+            'filters': 'Фильтр (JSON)',
+        }
+
+    def clean_filters(self):
+        filters = self.cleaned_data['filters']
+        try:
+            parse_filters(filters)
+        except ReportFilterError as e:
+            raise forms.ValidationError(str(e))
+        return filters
 
 class RegisterForm(UserCreationForm):
 
@@ -94,4 +121,65 @@ class MonthlyBudgetForm(forms.ModelForm):
         if planned_expense is not None and planned_expense < 0:
             self.add_error('planned_expense', 'Расходы не могут быть отрицательными')
 
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+class StatementImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл выписки',
+        help_text='CSV или XLSX с колонками «Дата» и «Сумма» (расходы со знаком минус)'
+    )
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError('Поддерживаются файлы CSV и XLSX')
+        return upload
+
+
+class CategoryRuleForm(forms.ModelForm):
+    class Meta:
+        model = CategoryRule
+        fields = ['pattern', 'category', 'priority']
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        if user:
+            self.fields['category'].queryset = Category.objects.filter(user=user)
+
+
+class HistoryFilterForm(forms.Form):
+    PERIOD_CHOICES = [
+        ('', 'Всё время'),
+        ('today', 'Сегодня'),
+        ('week', 'Эта неделя'),
+        ('month', 'Этот месяц'),
+    ]
+
+    period = forms.ChoiceField(label='Период', choices=PERIOD_CHOICES, required=False)
+    date_from = forms.DateField(label='С', required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(label='По', required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    category = forms.ModelChoiceField(label='Категория', queryset=Category.objects.none(), required=False)
+    amount_min = forms.DecimalField(label='Сумма от', required=False, min_value=0)
+    amount_max = forms.DecimalField(label='Сумма до', required=False, min_value=0)
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['category'].queryset = Category.objects.filter(user=user)
+
+    def filter(self, transactions, today):
+        """Применяет фильтры формы; неверно заполненные поля игнорируются"""
+        data = self.cleaned_data if self.is_valid() else {}
+        transactions = filter_history_period(transactions, data.get('period'), today)
+        if data.get('date_from'):
+            transactions = transactions.filter(date__gte=data['date_from'])
+        if data.get('date_to'):
+            transactions = transactions.filter(date__lte=data['date_to'])
+        if data.get('category'):
+            transactions = transactions.filter(category=data['category'])
+        if data.get('amount_min') is not None:
+            transactions = transactions.filter(amount__gte=data['amount_min'])
+        if data.get('amount_max') is not None:
+            transactions = transactions.filter(amount__lte=data['amount_max'])
+        return transactions
@@ -0,0 +1,179 @@
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from finance.models import Category, CategoryClosure, DailyCategoryTotal
+
+REBUILD_BATCH_SIZE = 1000
+
+# Итог по поддереву категории: сама категория и все её подкатегории
+CategoryTotal = namedtuple('CategoryTotal', ['id', 'name', 'parent_id', 'total'])
+
+
+class CategoryCycleError(ValueError):
+    """Категорию нельзя вложить в саму себя или в свою подкатегорию"""
+
+
+def add_category(category):
+    """Строки замыкания для новой категории: она сама и все предки её родителя"""
+    links = [CategoryClosure(ancestor_id=category.pk, descendant_id=category.pk, depth=0)]
+    if category.parent_id is not None:
+        links += [
+            CategoryClosure(ancestor_id=ancestor_id, descendant_id=category.pk, depth=depth + 1)
+            for ancestor_id, depth in (
+                CategoryClosure.objects
+                .filter(descendant_id=category.parent_id)
+                .values_list('ancestor_id', 'depth')
+            )
+        ]
+    CategoryClosure.objects.bulk_create(links)
+
+
+def is_in_subtree(category_id, root_id):
+    """Лежит ли category_id в поддереве root_id (включая сам root_id)"""
+    return CategoryClosure.objects.filter(ancestor_id=root_id, descendant_id=category_id).exists()
+
+
+def check_parent(category):
+    """Проверяет, что новый родитель не лежит в поддереве самой категории"""
+    if category.pk is not None and category.parent_id is not None and is_in_subtree(category.parent_id, category.pk):
+        raise CategoryCycleError("Категорию нельзя вложить в неё саму или в её подкатегорию")
+
+
+def move_category(category):
+    """Переносит поддерево категории под её текущего родителя (parent_id уже изменён)"""
+    with transaction.atomic():
+        subtree = list(
+            CategoryClosure.objects.filter(ancestor_id=category.pk).values_list('descendant_id', 'depth')
+        )
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+        # Связи поддерева с прежними предками
+        CategoryClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+        if category.parent_id is None:
+            return
+        ancestors = CategoryClosure.objects.filter(descendant_id=category.parent_id).values_list('ancestor_id', 'depth')
+        CategoryClosure.objects.bulk_create([
+            CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=up + down + 1)
+            for ancestor_id, up in ancestors
+            for descendant_id, down in subtree
+        ])
+
+
+def detach_children(category):
+    """Перед удалением категории: её подкатегории становятся корневыми.
+
+    Строки самой категории удалит каскад; здесь убираются связи её
+    потомков с её предками.
+    """
+    descendants = CategoryClosure.objects.filter(ancestor_id=category.pk, depth__gt=0).values('descendant_id')
+    ancestors = CategoryClosure.objects.filter(descendant_id=category.pk, depth__gt=0).values('ancestor_id')
+    CategoryClosure.objects.filter(descendant_id__in=descendants, ancestor_id__in=ancestors).delete()
+
+
+def rebuild_closure(user_ids=None):
+    """Пересобирает замыкание по Category.parent. Возвращает число созданных строк"""
+    categories = Category.objects.all()
+    if user_ids is not None:
+        categories = categories.filter(user_id__in=user_ids)
+    parents = dict(categories.values_list('id', 'parent_id'))
+
+    links = []
+    for category_id in parents:
+        seen = set()
+        node, depth = category_id, 0
+        # Идём вверх до корня; seen защищает от циклов в старых данных
+        while node is not None and node not in seen:
+            seen.add(node)
+            links.append(CategoryClosure(ancestor_id=node, descendant_id=category_id, depth=depth))
+            node, depth = parents.get(node), depth + 1
+
+    with transaction.atomic():
+        CategoryClosure.objects.filter(descendant_id__in=list(parents)).delete()
+        CategoryClosure.objects.bulk_create(links, batch_size=REBUILD_BATCH_SIZE)
+    return len(links)
+
+
+def subtree_ids(category_ids):
+    """Подзапрос: id категорий вместе со всеми их подкатегориями"""
+    return CategoryClosure.objects.filter(ancestor_id__in=category_ids).values('descendant_id')
+
+
+def subtree_totals(user, period, is_income=False):
+    """Итоги по поддеревьям всех категорий за период одним запросом.
+
+    Строки дневной сводки соединяются с замыканием: сумма каждой операции
+    попадает в её категорию и во всех предков. Возвращает {id: CategoryTotal}.
+    """
+    condition = Q(user=user, category__is_income=is_income)
+    if period.start is not None:
+        condition &= Q(date__gte=period.start)
+    if period.end is not None:
+        condition &= Q(date__lt=period.end)
+
+    rows = (
+        DailyCategoryTotal.objects
+        .filter(condition)
+        .values(
+            node_id=F('category__ancestor_links__ancestor_id'),
+            node_name=F('category__ancestor_links__ancestor__name'),
+            node_parent_id=F('category__ancestor_links__ancestor__parent_id'),
+        )
+        .annotate(subtree_total=Sum('total'))
+        .order_by()
+    )
+    return {
+        row['node_id']: CategoryTotal(row['node_id'], row['node_name'], row['node_parent_id'], row['subtree_total'])
+        for row in rows
+        if row['node_id'] is not None
+    }
+
+
+class CategoryTree:
+    """Дерево итогов subtree_totals: уровни, собственные суммы и свёртка до нужной глубины"""
+
+    def __init__(self, totals):
+        self.totals = totals
+        self.children = defaultdict(list)
+        for node in totals.values():
+            parent_id = node.parent_id if node.parent_id in totals else None
+            self.children[parent_id].append(node.id)
+        for ids in self.children.values():
+            ids.sort(key=lambda pk: totals[pk].total, reverse=True)
+        self._levels = {}
+
+    def level(self, category_id):
+        """Глубина категории: 0 у корневых"""
+        if category_id not in self._levels:
+            parent_id = self.totals[category_id].parent_id
+            self._levels[category_id] = 0 if parent_id not in self.totals else self.level(parent_id) + 1
+        return self._levels[category_id]
+
+    def own(self, category_id):
+        """Сумма операций самой категории, без подкатегорий"""
+        return self.totals[category_id].total - sum(
+            self.totals[child].total for child in self.children[category_id]
+        )
+
+    def rollup(self, depth):
+        """{название: сумма} с категориями глубже depth, свёрнутыми в предка на уровне depth"""
+        result = {}
+        for category_id, node in self.totals.items():
+            level = self.level(category_id)
+            if level == depth:
+                amount = node.total
+            elif level < depth:
+                amount = self.own(category_id)
+            else:
+                continue
+            if amount:
+                # Одноимённые категории объединяются, как в остальных отчётах
+                result[node.name] = result.get(node.name, 0) + amount
+        return result
+
+    def walk(self, parent_id=None):
+        """Категории в порядке обхода дерева: (уровень, CategoryTotal), крупные — первыми"""
+        for category_id in self.children[parent_id]:
+            yield self.level(category_id), self.totals[category_id]
+            yield from self.walk(category_id)
@@ -0,0 +1,316 @@
+import csv
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from finance.anomalies import update_stats
+from finance.models import Category, CategoryRule, ImportJob, Transaction, bump_data_version
+from finance.rollups import apply_transactions
+
+# Сколько операций вставлять за одну транзакцию БД
+IMPORT_BATCH_SIZE = getattr(settings, 'IMPORT_BATCH_SIZE', 1000)
+# Через сколько секунд без новых пачек импорт считается прерванным (процесс или поток завершился)
+IMPORT_STALE_AFTER = getattr(settings, 'IMPORT_STALE_AFTER', 15 * 60)
+# Пачки записываются отдельными транзакциями, поэтому прерванный импорт продолжается повторной загрузкой
+RESUME_HINT = "Загруженные строки сохранены; загрузите файл ещё раз, чтобы продолжить импорт без дублей."
+
+# Возможные заголовки колонок выписки (в нижнем регистре)
+COLUMN_ALIASES = {
+    'date': ('date', 'дата', 'дата операции', 'дата платежа'),
+    'amount': ('amount', 'сумма', 'сумма операции', 'сумма платежа'),
+    'description': ('description', 'описание', 'назначение платежа', 'комментарий'),
+    'category': ('category', 'категория'),
+    'reference': ('id', 'reference', 'номер', 'номер операции'),
+}
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d.%m.%y', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%d.%m.%Y %H:%M:%S')
+# Импорты, которые ещё не завершились
+ACTIVE_STATUSES = (ImportJob.STATUS_PENDING, ImportJob.STATUS_RUNNING)
+# Категории для операций, которые не удалось сопоставить
+FALLBACK_CATEGORIES = {False: 'Прочие расходы', True: 'Прочие доходы'}
+
+
+class ImportFormatError(ValueError):
+    """Файл не похож на выписку: нет нужных колонок или неверные значения"""
+
+
+def _map_columns(header):
+    """Номера колонок выписки: {'date': 0, 'amount': 2, ...}"""
+    normalized = [str(name or '').strip().casefold() for name in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for index, name in enumerate(normalized):
+            if name in aliases:
+                columns[field] = index
+                break
+    missing = {'date', 'amount'} - set(columns)
+    if missing:
+        raise ImportFormatError(f"Нет колонок: {', '.join(sorted(missing))}")
+    return columns
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ImportFormatError(f"Неизвестный формат даты: {value}")
+
+
+def parse_amount(value):
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    value = str(value).replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ImportFormatError(f"Неверная сумма: {value}")
+
+
+def iter_csv_rows(path):
+    """Строки CSV-файла по одной; разделитель определяется по началу файла"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def iter_xlsx_rows(path):
+    """Строки первого листа XLSX; read_only не загружает книгу в память целиком"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def count_rows(path):
+    """Число строк с данными (без заголовка) — для индикатора прогресса"""
+    if path.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return max(0, (workbook.worksheets[0].max_row or 1) - 1)
+        finally:
+            workbook.close()
+    with open(path, 'rb') as f:
+        return max(0, sum(1 for line in f if line.strip()) - 1)
+
+
+def iter_statement(path):
+    """Разобранные строки выписки: словари с date, amount, description, category, reference"""
+    rows = iter_xlsx_rows(path) if path.lower().endswith('.xlsx') else iter_csv_rows(path)
+    header = next(rows, None)
+    if header is None:
+        raise ImportFormatError("Файл пуст")
+    columns = _map_columns(header)
+
+    for row in rows:
+        if not row or all(value in (None, '') for value in row):
+            continue
+
+        def cell(field):
+            index = columns.get(field)
+            if index is None or index >= len(row) or row[index] is None:
+                return ''
+            return row[index]
+
+        yield {
+            'date': parse_date(cell('date')),
+            'amount': parse_amount(cell('amount')),
+            'description': str(cell('description')).strip(),
+            'category': str(cell('category')).strip(),
+            'reference': str(cell('reference')).strip(),
+        }
+
+
+class CategoryMatcher:
+    """Выбирает категорию строки: правила, затем колонка категории, затем «Прочие»"""
+
+    def __init__(self, user):
+        self.user = user
+        self.rules = [
+            (rule.pattern.casefold(), rule.category_id, rule.category.is_income)
+            for rule in CategoryRule.objects.filter(user=user).select_related('category')
+        ]
+        self.by_name = {
+            (category.name.casefold(), category.is_income): category.id
+            for category in Category.objects.filter(user=user)
+        }
+
+    def _category(self, name, is_income):
+        key = (name.casefold(), is_income)
+        if key not in self.by_name:
+            category, _ = Category.objects.get_or_create(user=self.user, name=name, is_income=is_income)
+            self.by_name[key] = category.id
+        return self.by_name[key]
+
+    def match(self, row, is_income):
+        description = row['description'].casefold()
+        for pattern, category_id, rule_is_income in self.rules:
+            if pattern in description and rule_is_income == is_income:
+                return category_id
+        if row['category']:
+            return self._category(row['category'], is_income)
+        return self._category(FALLBACK_CATEGORIES[is_income], is_income)
+
+
+def row_hash(user_id, row, occurrence):
+    """Отпечаток строки. occurrence — номер одинаковой операции (дата, сумма, описание) в файле"""
+    if row['reference']:
+        key = f"{user_id}|ref|{row['reference']}"
+    else:
+        key = f"{user_id}|{row['date']}|{row['amount']}|{row['description']}|{occurrence}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _write_batch(user_id, batch):
+    """Вставляет пачку операций, пропуская уже импортированные. Возвращает число вставленных"""
+    with transaction.atomic():
+        hashes = [item.import_hash for item in batch]
+        existing = set(
+            Transaction.objects
+            .filter(user_id=user_id, import_hash__in=hashes)
+            .values_list('import_hash', flat=True)
+        )
+        new = []
+        for item in batch:
+            if item.import_hash not in existing:
+                existing.add(item.import_hash)
+                new.append(item)
+        # bulk_create не вызывает сигналы, поэтому сводка, статистика категорий и версия данных обновляются здесь
+        Transaction.objects.bulk_create(new)
+        apply_transactions((user_id, item.category_id, item.date, item.amount) for item in new)
+        update_stats(added=[(item.category_id, item.amount) for item in new])
+        if new:
+            bump_data_version(user_id)
+    return len(new)
+
+
+def run_import(job_id, path, batch_size=IMPORT_BATCH_SIZE):
+    """Импортирует выписку path в рамках ImportJob.
+
+    Операции пишутся пачками по batch_size; при ошибке записанные пачки остаются,
+    а повторный импорт того же файла пропускает их по отпечаткам строк.
+    """
+    job = ImportJob.objects.select_related('user').get(pk=job_id)
+    job.status = ImportJob.STATUS_RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+
+    batch = []
+    # Счётчик одинаковых строк по всему файлу: порядок строк в выписке не важен
+    occurrences = {}
+
+    def flush():
+        job.imported_rows += _write_batch(job.user_id, batch)
+        job.skipped_rows = job.processed_rows - job.imported_rows
+        ImportJob.objects.filter(pk=job.pk).update(
+            processed_rows=job.processed_rows,
+            imported_rows=job.imported_rows,
+            skipped_rows=job.skipped_rows,
+            updated_at=timezone.now()
+        )
+        batch.clear()
+
+    try:
+        job.total_rows = count_rows(path)
+        ImportJob.objects.filter(pk=job.pk).update(total_rows=job.total_rows)
+        matcher = CategoryMatcher(job.user)
+
+        for row in iter_statement(path):
+            job.processed_rows += 1
+            if row['amount'] == 0:
+                continue
+
+            key = (row['date'], row['amount'], row['description'])
+            occurrences[key] = occurrences.get(key, 0) + 1
+
+            is_income = row['amount'] > 0
+            batch.append(Transaction(
+                user_id=job.user_id,
+                category_id=matcher.match(row, is_income),
+                amount=abs(row['amount']),
+                date=row['date'],
+                description=row['description'],
+                import_hash=row_hash(job.user_id, row, occurrences[key]),
+            ))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        job.status = ImportJob.STATUS_DONE
+    except Exception as e:
+        job.status = ImportJob.STATUS_FAILED
+        job.error = f"Строка {job.processed_rows + 1}: {e}" if isinstance(e, ImportFormatError) else str(e)
+        if job.imported_rows:
+            job.error += f"\n{RESUME_HINT}"
+    finally:
+        if job.status != ImportJob.STATUS_FAILED:
+            job.total_rows = job.processed_rows
+        job.skipped_rows = job.processed_rows - job.imported_rows
+        job.finished_at = timezone.now()
+        job.save()
+    return job
+
+
+def start_import(user, upload):
+    """Сохраняет загруженный файл и запускает импорт в фоновом потоке"""
+    suffix = os.path.splitext(upload.name)[1].lower()
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='import_')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+
+    job = ImportJob.objects.create(user=user, file_name=upload.name)
+    threading.Thread(target=_run_in_thread, args=(job.pk, path), daemon=True).start()
+    return job
+
+
+def _run_in_thread(job_id, path):
+    try:
+        run_import(job_id, path)
+    except Exception as e:
+        # run_import не смог даже записать итог (например, БД недоступна) — не оставляем «Выполняется»
+        ImportJob.objects.filter(pk=job_id, status__in=ACTIVE_STATUSES).update(
+            status=ImportJob.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+        )
+    finally:
+        os.remove(path)
+        connections.close_all()
+
+
+def fail_stale_imports(user=None):
+    """Отмечает ошибкой импорты, которые давно не продвигаются.
+
+    Фоновый поток не переживает перезапуск процесса, и без этого такой импорт
+    навсегда остался бы «Выполняется». Возвращает число отмеченных импортов.
+    """
+    jobs = ImportJob.objects.filter(
+        status__in=ACTIVE_STATUSES,
+        updated_at__lt=timezone.now() - timedelta(seconds=IMPORT_STALE_AFTER)
+    )
+    if user is not None:
+        jobs = jobs.filter(user=user)
+    return jobs.update(
+        status=ImportJob.STATUS_FAILED,
+        error=f"Импорт прерван. {RESUME_HINT}",
+        finished_at=timezone.now()
+    )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from finance.anomalies import detect_anomalies
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику категорий и ищет необычные траты (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='За сколько последних дней проверять операции'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='ID пользователя (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        created = detect_anomalies(recent_days=options['days'], user_ids=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Найдено новых аномалий: {created}"))
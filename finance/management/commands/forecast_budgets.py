@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from finance.forecasting import forecast_budgets
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает прогнозы расходов на конец месяца для пользователей с бюджетом (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='ID пользователя (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        overspending = forecast_budgets(user_ids=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Прогноз готов, превысят бюджет: {overspending}"))
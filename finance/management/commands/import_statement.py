@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.imports import run_import
+from finance.models import ImportJob, User
+
+
+class Command(BaseCommand):
+    help = 'Импортирует банковскую выписку (CSV или XLSX) для пользователя'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Имя пользователя')
+        parser.add_argument('path', help='Путь к файлу выписки')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {options['username']} не найден")
+
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"Файл {path} не найден")
+
+        job = ImportJob.objects.create(user=user, file_name=os.path.basename(path))
+        job = run_import(job.pk, path)
+
+        if job.status == ImportJob.STATUS_FAILED:
+            raise CommandError(f"Импорт не выполнен: {job.error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Обработано строк: {job.processed_rows}, добавлено: {job.imported_rows}, "
+            f"пропущено: {job.skipped_rows} за {(job.finished_at - job.created_at).total_seconds():.1f} с"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from finance.hierarchy import rebuild_closure
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает замыкание дерева категорий по Category.parent (после миграции или ручных правок)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='ID пользователя (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        created = rebuild_closure(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Замыкание пересобрано, строк: {created}"))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.rollups import rebuild_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает или проверяет сводку операций по дням и категориям'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить сводку, ничего не изменяя'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='ID пользователя (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+
+        if options['verify']:
+            mismatches = verify_rollups(user_ids)
+            for (user_id, category_id, date), expected, actual in mismatches:
+                self.stdout.write(
+                    f"user={user_id} category={category_id} date={date}: "
+                    f"ожидалось {expected}, в сводке {actual}"
+                )
+            if mismatches:
+                raise CommandError(f"Найдено расхождений: {len(mismatches)}")
+            self.stdout.write(self.style.SUCCESS("✅ Сводка совпадает с операциями"))
+            return
+
+        created = rebuild_rollups(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"✅ Сводка пересобрана, строк: {created}"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from finance.recommendations import refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сохранённые рекомендации пользователей (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='ID пользователя (можно указать несколько раз)'
+        )
+
+    def handle(self, *args, **options):
+        refreshed = refresh_recommendations(user_ids=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Рекомендации пересчитаны для {refreshed} пользователей"))
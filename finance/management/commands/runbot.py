@@ -1,5 +1,6 @@
 import django
 import os
+from django.conf import settings
 from django.core.management.base import BaseCommand
 import asyncio
 
@@ -10,11 +11,27 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fincontrol.settings')
 django.setup()
 
 # 3. Только после setup() импортируйте bot.py
-from finance.telegram.bot import start_bot
+from finance.telegram.bot import start_bot, start_webhook_mode
 
 
 class Command(BaseCommand):
     help = 'Запускает Telegram-бота'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook',
+            action='store_true',
+            help='Зарегистрировать вебхук (TELEGRAM_WEBHOOK_URL) и выполнять только рассылки по расписанию'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.TELEGRAM_BOT_WORKERS,
+            help='Число процессов-обработчиков; обновления распределяются по id чата'
+        )
+
     def handle(self, *args, **options):
-        asyncio.run(start_bot())
\ No newline at end of file
+        if options['webhook']:
+            asyncio.run(start_webhook_mode())
+        else:
+            asyncio.run(start_bot(workers=options['workers']))
\ No newline at end of file
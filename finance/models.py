@@ -1,5 +1,5 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 
@@ -8,6 +8,13 @@ class User(AbstractUser):
     telegram_linked = models.BooleanField(default=False)
     send_daily_report = models.BooleanField(default=True)
     send_weekly_report = models.BooleanField(default=True)
+    # Увеличивается при любом изменении операций, категорий или бюджета пользователя
+    data_version = models.PositiveIntegerField(default=0)
+
+def bump_data_version(user_id):
+    """Отмечает, что данные пользователя изменились (сбрасывает кэши отчётов)"""
+    User.objects.filter(pk=user_id).update(data_version=models.F('data_version') + 1)
+
 
 class Category(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -18,6 +25,22 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class CategoryClosure(models.Model):
+    """Пары «предок — потомок» дерева категорий, включая саму категорию (depth=0).
+
+    Поддерживается сигналами (finance.hierarchy), поэтому итоги по поддереву
+    считаются одним соединением, без рекурсивных запросов.
+    """
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
 class Transaction(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(
@@ -38,32 +61,198 @@ class Transaction(models.Model):
         blank=True,
         verbose_name="Описание"
     )
+    # Отпечаток строки выписки: повторный импорт того же файла не создаёт дублей
+    import_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-date']
+        # Почти все отчёты фильтруют по пользователю и диапазону дат.
+        # amount в конце второго индекса позволяет суммировать без чтения таблицы.
+        indexes = [
+            models.Index(fields=['user', 'date'], name='transaction_user_date_idx'),
+            models.Index(fields=['user', 'category', 'date', 'amount'], name='transaction_user_cat_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'import_hash'], name='transaction_user_import_hash_uniq'),
+        ]
         verbose_name = "Операция"
         verbose_name_plural = "Операции"
 
+    def save(self, *args, **kwargs):
+        # Сигналы пересчёта сводок должны выполняться в той же транзакции БД
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.date}: {self.amount} ({'Доход' if self.is_income else 'Расход'})"
 
+
+class DailyCategoryTotal(models.Model):
+    """Сводка операций пользователя по категории за день.
+
+    Поддерживается сигналами при создании, изменении и удалении Transaction,
+    поэтому отчёты суммируют дни, а не отдельные операции.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_totals')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_totals')
+    date = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'category', 'date')
+        indexes = [
+            models.Index(fields=['user', 'date'], name='dailytotal_user_date_idx'),
+        ]
+        verbose_name = "Итог за день"
+        verbose_name_plural = "Итоги за день"
+
+    def __str__(self):
+        return f"{self.date}: {self.category_id} = {self.total} ({self.count})"
+
 class Recommendation(models.Model):
+    """Рекомендация, посчитанная заранее (finance.recommendations)"""
+    KIND_GENERAL = 'general'
+    KIND_BUDGET = 'budget'
+    KIND_FORECAST = 'forecast'
+    KIND_CATEGORY = 'category'
+    KIND_ANOMALY = 'anomaly'
+    KIND_CHOICES = [
+        (KIND_GENERAL, 'Общая'),
+        (KIND_BUDGET, 'Бюджет'),
+        (KIND_FORECAST, 'Прогноз'),
+        (KIND_CATEGORY, 'Категории'),
+        (KIND_ANOMALY, 'Необычные траты'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=KIND_GENERAL)
+    # Порядок показа внутри набора рекомендаций пользователя
+    position = models.PositiveSmallIntegerField(default=0)
+    # Версия данных пользователя и день, для которых посчитан набор
+    data_version = models.PositiveIntegerField(default=0)
+    computed_on = models.DateField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['position']
+        indexes = [
+            models.Index(fields=['user', 'position'], name='recommendation_user_pos_idx'),
+        ]
+
+    def __str__(self):
+        return self.text
 
 class Anomaly(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     description = models.TextField()
     transaction = models.ForeignKey(Transaction, null=True, blank=True, on_delete=models.SET_NULL)
+    # Насколько операция отличается от обычных трат категории (модифицированный z-score)
+    score = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
     # Для хранения обнаруженных аномалий
 
+    class Meta:
+        ordering = ['-created_at']
+
+
+class CategoryStats(models.Model):
+    """Статистика сумм расходов пользователя по категории для поиска аномалий.
+
+    count, mean и m2 — накопленные по алгоритму Уэлфорда и обновляются при каждой
+    новой операции; median и mad пересчитываются ночным расчётом.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_stats')
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, related_name='stats')
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+    median = models.FloatField(null=True, blank=True)
+    mad = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Статистика категории"
+        verbose_name_plural = "Статистика категорий"
+
+    @property
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+    def add(self, amount):
+        """Учитывает новую сумму в среднем и дисперсии (алгоритм Уэлфорда)"""
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+
+    def remove(self, amount):
+        """Убирает сумму удалённой или изменённой операции (обратный шаг Уэлфорда)"""
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = (self.count * self.mean - amount) / (self.count - 1)
+        # Погрешность округления не должна делать дисперсию отрицательной
+        self.m2 = max(self.m2 - (amount - mean) * (amount - self.mean), 0.0)
+        self.mean = mean
+        self.count -= 1
+
+    def __str__(self):
+        return f"{self.category_id}: n={self.count}, median={self.median}"
+
+class BudgetForecast(models.Model):
+    """Прогноз расходов на конец месяца для пользователя с бюджетом (finance.forecasting)"""
+    METHOD_MEAN = 'mean'
+    METHOD_WEEKDAY = 'weekday'
+    METHOD_EWMA = 'ewma'
+    METHOD_CHOICES = [
+        (METHOD_MEAN, 'Среднее за месяц'),
+        (METHOD_WEEKDAY, 'По дням недели'),
+        (METHOD_EWMA, 'Экспоненциальное сглаживание'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budget_forecasts')
+    month = models.CharField(max_length=7)
+    # Расходы с начала месяца по день расчёта включительно
+    spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    planned_expense = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Прогноз расходов на весь месяц разными методами; projected — по выбранному method
+    projected_mean = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    projected_weekday = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    projected_ewma = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    projected = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    method = models.CharField(max_length=10, choices=METHOD_CHOICES, default=METHOD_WEEKDAY)
+    will_overspend = models.BooleanField(default=False)
+    # Версия данных пользователя и день, для которых посчитан прогноз
+    data_version = models.PositiveIntegerField(default=0)
+    computed_on = models.DateField()
+
+    class Meta:
+        unique_together = ('user', 'month')
+        verbose_name = "Прогноз бюджета"
+        verbose_name_plural = "Прогнозы бюджета"
+
+    @property
+    def difference(self):
+        """Насколько прогноз больше плана (отрицательное — остаток)"""
+        return self.projected - self.planned_expense
+
+    def __str__(self):
+        return f"{self.user_id} {self.month}: {self.projected} / {self.planned_expense}"
+
 class FavoriteReport(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
-    filters = models.JSONField()  # Хранит настройки фильтрации (например, период, категории)
+    filters = models.JSONField()  # Фильтр отчёта, формат описан в finance.reports
     # Для сохранения избранных отчётов
 
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
 class NotificationHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
@@ -91,4 +280,63 @@ class MonthlyBudget(models.Model):
         ordering = ['-month']
 
     def __str__(self):
-        return f"Budget for {self.month}"
\ No newline at end of file
+        return f"Budget for {self.month}"
+
+
+class CategoryRule(models.Model):
+    """Правило импорта: операции, в описании которых есть pattern, попадают в category"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_rules')
+    pattern = models.CharField(max_length=100, verbose_name="Текст в описании")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    # Правила проверяются по возрастанию приоритета
+    priority = models.PositiveIntegerField(default=100, verbose_name="Приоритет")
+
+    class Meta:
+        ordering = ['priority', 'id']
+        verbose_name = "Правило категории"
+        verbose_name_plural = "Правила категорий"
+
+    def __str__(self):
+        return f"{self.pattern} → {self.category}"
+
+
+class ImportJob(models.Model):
+    """Импорт банковской выписки и его прогресс"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    file_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    imported_rows = models.PositiveIntegerField(default=0)
+    skipped_rows = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Обновляется с каждой записанной пачкой: по нему видно, что импорт ещё идёт
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Импорт выписки"
+        verbose_name_plural = "Импорт выписок"
+
+    @property
+    def progress(self):
+        """Доля обработанных строк, 0..100"""
+        if not self.total_rows:
+            return 100 if self.status == self.STATUS_DONE else 0
+        return min(100, round(self.processed_rows * 100 / self.total_rows))
+
+    def __str__(self):
+        return f"{self.file_name} ({self.get_status_display()})"
@@ -0,0 +1,44 @@
+import base64
+from datetime import date
+
+from django.db.models import Q
+
+# Операций на странице истории
+HISTORY_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы повреждён или подделан"""
+
+
+def encode_cursor(day, pk):
+    """Курсор следующей страницы: дата и id последней показанной операции"""
+    return base64.urlsafe_b64encode(f"{day.isoformat()}:{pk}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        day, pk = raw.split(':')
+        return date.fromisoformat(day), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+def keyset_page(queryset, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    """Страница операций по убыванию (date, id), начиная после cursor.
+
+    Вместо OFFSET фильтр продолжает с последней показанной строки, поэтому
+    любая страница стоит как первая. Возвращает (операции, курсор следующей страницы или None).
+    """
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        day, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+
+    # Лишняя строка показывает, есть ли следующая страница, без COUNT
+    items = list(queryset[:page_size + 1])
+    if len(items) <= page_size:
+        return items, None
+    items = items[:page_size]
+    return items, encode_cursor(items[-1].date, items[-1].pk)
@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+
+
+def month_range(day):
+    """Полуинтервал [первое число месяца, первое число следующего месяца)"""
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def previous_month_range(day):
+    """Полуинтервал предыдущего месяца"""
+    end = day.replace(day=1)
+    start = (end - timedelta(days=1)).replace(day=1)
+    return start, end
+
+
+def parse_month(month):
+    """Первое число месяца, заданного строкой "YYYY-MM" (как в MonthlyBudget)"""
+    year, month = map(int, month.split('-'))
+    return date(year, month, 1)
+
+
+def history_range(period, today):
+    """Полуинтервал фильтра истории (?period=today|week|month); None — за всё время.
+
+    У недели нет верхней границы: в неё попадают и операции, внесённые наперёд.
+    """
+    if period == 'today':
+        return today, today + timedelta(days=1)
+    if period == 'week':
+        return today - timedelta(days=today.weekday()), None
+    if period == 'month':
+        return month_range(today)
+    return None
+
+
+def filter_history_period(transactions, period, today):
+    """Операции за период истории"""
+    bounds = history_range(period, today)
+    if bounds is None:
+        return transactions
+    start, end = bounds
+    transactions = transactions.filter(date__gte=start)
+    return transactions if end is None else transactions.filter(date__lt=end)
@@ -0,0 +1,189 @@
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from finance.models import Anomaly, MonthlyBudget, Recommendation, User
+from finance.forecasting import get_forecasts
+from finance.summary import ALL_TIME, month_period, summarize_users
+
+# Сколько пользователей пересчитывать за один проход
+USERS_PER_CHUNK = 500
+# Порог «больших» расходов по категории за всё время
+LARGE_CATEGORY_EXPENSE = 5000
+# Сколько последних необычных трат показывать и за какой срок
+ANOMALIES_SHOWN = 3
+ANOMALY_DAYS = 30
+
+
+def build_recommendations(totals, month, budget, forecast, anomalies):
+    """Рекомендации пользователя: список пар (вид, текст).
+
+    totals и month — PeriodSummary за всё время и за текущий месяц,
+    budget и forecast — MonthlyBudget и BudgetForecast текущего месяца или None,
+    anomalies — тексты необычных трат.
+    """
+    items = []
+
+    # 1. Стандартные рекомендации
+    if totals.expense > 30000:
+        items.append((Recommendation.KIND_GENERAL, "Вы тратите много. Рассмотрите возможность сокращения расходов."))
+    if totals.income > 0 and totals.expense / totals.income > 0.7:
+        items.append((
+            Recommendation.KIND_GENERAL,
+            "Ваши расходы составляют более 70% от дохода — обратите внимание на бюджет."
+        ))
+
+    # 2. Рекомендации на основе бюджета
+    if budget:
+        # Анализ доходов
+        if budget.planned_income > 0:
+            income_diff = month.income - budget.planned_income
+            income_percent = month.income / budget.planned_income * 100
+
+            if income_diff > 0:
+                items.append((
+                    Recommendation.KIND_BUDGET,
+                    f"✅ Ваши доходы превысили план на {abs(income_diff):.2f} ₽ "
+                    f"({income_percent:.1f}% от запланированного). Отлично!"
+                ))
+            elif income_diff < 0:
+                items.append((
+                    Recommendation.KIND_BUDGET,
+                    f"⚠️ Ваши доходы ниже плана на {abs(income_diff):.2f} ₽ "
+                    f"({income_percent:.1f}% от запланированного). "
+                    "Рассмотрите возможности увеличения доходов."
+                ))
+
+        # Анализ расходов
+        if budget.planned_expense > 0:
+            expense_diff = month.expense - budget.planned_expense
+            expense_percent = month.expense / budget.planned_expense * 100
+
+            if expense_diff > 0:
+                items.append((
+                    Recommendation.KIND_BUDGET,
+                    f"⚠️ Ваши расходы превысили план на {abs(expense_diff):.2f} ₽ "
+                    f"({expense_percent:.1f}% от запланированного). "
+                    "Обратите внимание на категории с наибольшими отклонениями."
+                ))
+            elif expense_diff < 0:
+                items.append((
+                    Recommendation.KIND_BUDGET,
+                    f"✅ Ваши расходы ниже плана на {abs(expense_diff):.2f} ₽ "
+                    f"({expense_percent:.1f}% от запланированного). "
+                    "Отлично! Вы укладываетесь в бюджет."
+                ))
+
+        # Прогноз на конец месяца (считается заранее, см. finance.forecasting)
+        if forecast is not None and budget.planned_expense > 0:
+            if forecast.projected > budget.planned_expense:
+                over = forecast.projected - budget.planned_expense
+                items.append((
+                    Recommendation.KIND_FORECAST,
+                    f"⚠️ По текущим тратам вы превысите бюджет на конец месяца на {over:.2f} ₽"
+                ))
+            else:
+                remaining = budget.planned_expense - forecast.projected
+                items.append((
+                    Recommendation.KIND_FORECAST,
+                    f"✅ По текущим тратам вы уложитесь в бюджет, остаток составит {remaining:.2f} ₽"
+                ))
+
+    # 3. Необычные траты последнего месяца
+    for text in anomalies[:ANOMALIES_SHOWN]:
+        items.append((Recommendation.KIND_ANOMALY, f"🔎 {text}"))
+
+    # 4. Топ-3 категории с наибольшими расходами
+    for category, amount in totals.top_expense_categories(3):
+        if amount > LARGE_CATEGORY_EXPENSE:
+            items.append((
+                Recommendation.KIND_CATEGORY,
+                f"💡 Вы тратите много на '{category}' — {amount:.2f} ₽. "
+                "Может быть, есть возможности для оптимизации?"
+            ))
+
+    # 5. Если нет рекомендаций
+    if not items:
+        items.append((Recommendation.KIND_GENERAL, "Отличная работа! Вы хорошо управляете своими финансами."))
+    return items
+
+
+def _refresh_chunk(user_ids, today):
+    # Версии читаются до расчёта: изменения во время расчёта сделают набор устаревшим
+    versions = dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'data_version'))
+    summaries = summarize_users(user_ids, {'all': ALL_TIME, 'month': month_period(today)})
+    budgets = {
+        budget.user_id: budget
+        for budget in MonthlyBudget.objects.filter(user_id__in=user_ids, month=today.strftime('%Y-%m'))
+    }
+    forecasts = get_forecasts(user_ids, versions, today)
+    anomalies = defaultdict(list)
+    recent = Anomaly.objects.filter(
+        user_id__in=user_ids, created_at__date__gte=today - timedelta(days=ANOMALY_DAYS)
+    ).order_by('user_id', '-created_at').values_list('user_id', 'description')
+    for user_id, description in recent:
+        anomalies[user_id].append(description)
+
+    rows = []
+    for user_id in versions:
+        items = build_recommendations(
+            summaries[user_id]['all'], summaries[user_id]['month'],
+            budgets.get(user_id), forecasts.get(user_id), anomalies[user_id]
+        )
+        rows.extend(
+            Recommendation(
+                user_id=user_id, kind=kind, text=text, position=position,
+                data_version=versions[user_id], computed_on=today
+            )
+            for position, (kind, text) in enumerate(items)
+        )
+
+    with transaction.atomic():
+        # Блокировка строк пользователей выстраивает параллельные пересчёты одного
+        # пользователя (ночной и ленивый) в очередь: иначе оба удалят старый набор
+        # и оба вставят новый, и рекомендации задвоятся
+        list(User.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+        Recommendation.objects.filter(user_id__in=user_ids).delete()
+        Recommendation.objects.bulk_create(rows)
+    return len(versions)
+
+
+def refresh_recommendations(user_ids=None, today=None):
+    """Пересчитывает рекомендации пользователей (по умолчанию всех) пачками.
+
+    На пачку уходит несколько сгруппированных запросов независимо от числа
+    пользователей в ней. Возвращает число обработанных пользователей.
+    """
+    today = today or timezone.now().date()
+    users = User.objects.order_by('pk').values_list('pk', flat=True)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    users = iter(list(users))
+
+    refreshed = 0
+    while True:
+        chunk = list(islice(users, USERS_PER_CHUNK))
+        if not chunk:
+            return refreshed
+        refreshed += _refresh_chunk(chunk, today)
+
+
+def get_recommendations(user, kinds=None, today=None):
+    """Тексты рекомендаций пользователя.
+
+    Читает сохранённый набор; если данные пользователя изменились с момента
+    расчёта или наступил новый день, пересчитывает набор только для него.
+    """
+    user_id = getattr(user, 'pk', user)
+    today = today or timezone.now().date()
+
+    version = User.objects.filter(pk=user_id).values_list('data_version', flat=True).first()
+    stored = list(Recommendation.objects.filter(user_id=user_id))
+    if not stored or stored[0].data_version != version or stored[0].computed_on != today:
+        refresh_recommendations([user_id], today)
+        stored = list(Recommendation.objects.filter(user_id=user_id))
+
+    return [item.text for item in stored if kinds is None or item.kind in kinds]
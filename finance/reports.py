@@ -0,0 +1,273 @@
+"""Избранные отчёты: фильтр FavoriteReport.filters превращается в один запрос к БД.
+
+Формат фильтра (все ключи необязательны):
+
+    {
+        "period": "month",            # today, week, month, previous_month, year, all
+                                      # или {"from": "2025-01-01", "to": "2025-03-31"}
+        "type": "expense",            # expense или income
+        "categories": [3, 7],         # id категорий; подкатегории входят в отчёт
+        "amount_min": "100",          # границы суммы одной операции
+        "amount_max": "5000",
+        "group_by": "category",       # category, day, week, month, none
+        "metric": "sum"               # sum, count, avg, max
+    }
+"""
+import hashlib
+import json
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max, Q, Sum
+
+from finance.chart_data import BUCKETS
+from finance.hierarchy import subtree_ids
+from finance.models import DailyCategoryTotal, Transaction, User
+from finance.periods import history_range, previous_month_range
+from finance.summary import ALL_TIME, Period
+
+# Сколько хранить результат отчёта; при изменении данных ключ и так меняется
+REPORT_CACHE_TTL = getattr(settings, 'REPORT_CACHE_TTL', 24 * 3600)
+
+PERIODS = ('today', 'week', 'month', 'previous_month', 'year', 'all')
+TYPES = ('expense', 'income')
+GROUPS = ('category', 'day', 'week', 'month', 'none')
+METRICS = ('sum', 'count', 'avg', 'max')
+DEFAULT_FILTERS = {
+    'period': 'month',
+    'type': 'expense',
+    'categories': [],
+    'amount_min': None,
+    'amount_max': None,
+    'group_by': 'category',
+    'metric': 'sum',
+}
+METRIC_LABELS = {'sum': 'Сумма', 'count': 'Количество', 'avg': 'Средняя сумма', 'max': 'Наибольшая сумма'}
+
+# rows — [(подпись, значение)], total — значение по всем строкам
+ReportResult = namedtuple('ReportResult', ['rows', 'total', 'metric', 'group_by', 'period'])
+
+
+class ReportFilterError(ValueError):
+    """Фильтр отчёта не соответствует формату"""
+
+
+def _choice(filters, key, choices):
+    value = filters.get(key, DEFAULT_FILTERS[key])
+    if value not in choices:
+        raise ReportFilterError(f"{key}: ожидается одно из {', '.join(choices)}")
+    return value
+
+
+def _parse_period(value):
+    if isinstance(value, str):
+        if value not in PERIODS:
+            raise ReportFilterError(f"period: ожидается одно из {', '.join(PERIODS)} или {{from, to}}")
+        return value
+    if not isinstance(value, dict) or not set(value) <= {'from', 'to'}:
+        raise ReportFilterError("period: ожидается строка или {from, to}")
+    try:
+        bounds = {key: date.fromisoformat(day).isoformat() for key, day in value.items() if day}
+    except (TypeError, ValueError):
+        raise ReportFilterError("period: даты в формате YYYY-MM-DD")
+    if 'from' in bounds and 'to' in bounds and bounds['from'] > bounds['to']:
+        raise ReportFilterError("period: начало позже конца")
+    return bounds
+
+
+def _parse_amount(filters, key):
+    value = filters.get(key)
+    if value in (None, ''):
+        return None
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ReportFilterError(f"{key}: ожидается число")
+    if not amount.is_finite() or amount < 0:
+        raise ReportFilterError(f"{key}: ожидается неотрицательное число")
+    return str(amount)
+
+
+def parse_filters(filters):
+    """Проверяет фильтр и приводит его к каноническому виду (с умолчаниями)"""
+    if not isinstance(filters, dict):
+        raise ReportFilterError("Фильтр должен быть объектом")
+    unknown = set(filters) - set(DEFAULT_FILTERS)
+    if unknown:
+        raise ReportFilterError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+
+    categories = filters.get('categories') or []
+    if not isinstance(categories, list) or not all(
+        isinstance(pk, int) and not isinstance(pk, bool) for pk in categories
+    ):
+        raise ReportFilterError("categories: ожидается список id")
+
+    canonical = {
+        'period': _parse_period(filters.get('period', DEFAULT_FILTERS['period'])),
+        'type': _choice(filters, 'type', TYPES),
+        'categories': sorted(set(categories)),
+        'amount_min': _parse_amount(filters, 'amount_min'),
+        'amount_max': _parse_amount(filters, 'amount_max'),
+        'group_by': _choice(filters, 'group_by', GROUPS),
+        'metric': _choice(filters, 'metric', METRICS),
+    }
+    if (
+        canonical['amount_min'] is not None and canonical['amount_max'] is not None
+        and Decimal(canonical['amount_min']) > Decimal(canonical['amount_max'])
+    ):
+        raise ReportFilterError("amount_min больше amount_max")
+    return canonical
+
+
+def resolve_period(period, today):
+    """Полуинтервал дат отчёта на сегодняшний день"""
+    if isinstance(period, dict):
+        start = date.fromisoformat(period['from']) if 'from' in period else None
+        end = date.fromisoformat(period['to']) + timedelta(days=1) if 'to' in period else None
+        return Period(start, end)
+    if period == 'all':
+        return ALL_TIME
+    if period == 'previous_month':
+        return Period(*previous_month_range(today))
+    if period == 'year':
+        return Period(date(today.year, 1, 1), date(today.year + 1, 1, 1))
+    return Period(*history_range(period, today))
+
+
+def filters_hash(canonical, period):
+    """Отпечаток фильтра; относительный период входит в него уже в виде дат"""
+    key = dict(canonical, period=[
+        period.start.isoformat() if period.start else None,
+        period.end.isoformat() if period.end else None,
+    ])
+    payload = json.dumps(key, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def compile_report(user_id, canonical, period):
+    """Запрос отчёта и агрегаты для него.
+
+    Без фильтра по сумме и метрики max отчёт считается по дневной сводке
+    DailyCategoryTotal, иначе — по операциям. Возвращает (queryset, агрегаты).
+    """
+    by_operation = (
+        canonical['amount_min'] is not None or canonical['amount_max'] is not None
+        or canonical['metric'] == 'max'
+    )
+    if by_operation:
+        queryset = Transaction.objects.filter(user_id=user_id)
+        aggregates = {'s': Sum('amount'), 'c': Count('id'), 'm': Max('amount')}
+    else:
+        queryset = DailyCategoryTotal.objects.filter(user_id=user_id)
+        aggregates = {'s': Sum('total'), 'c': Sum('count')}
+
+    condition = Q(category__is_income=canonical['type'] == 'income')
+    if period.start is not None:
+        condition &= Q(date__gte=period.start)
+    if period.end is not None:
+        condition &= Q(date__lt=period.end)
+    if canonical['categories']:
+        # Подкатегории любой глубины — через замыкание дерева, в том же запросе
+        condition &= Q(category_id__in=subtree_ids(canonical['categories']))
+    if canonical['amount_min'] is not None:
+        condition &= Q(amount__gte=Decimal(canonical['amount_min']))
+    if canonical['amount_max'] is not None:
+        condition &= Q(amount__lte=Decimal(canonical['amount_max']))
+    return queryset.filter(condition), aggregates
+
+
+def _value(metric, row):
+    total, count = row['s'] or Decimal('0'), row['c'] or 0
+    if metric == 'sum':
+        return total
+    if metric == 'count':
+        return count
+    if metric == 'avg':
+        return (total / count).quantize(Decimal('0.01')) if count else Decimal('0')
+    return row.get('m') or Decimal('0')
+
+
+def execute_report(user_id, canonical, period):
+    """Выполняет отчёт одним запросом"""
+    queryset, aggregates = compile_report(user_id, canonical, period)
+    metric, group_by = canonical['metric'], canonical['group_by']
+
+    if group_by == 'none':
+        row = queryset.aggregate(**aggregates)
+        value = _value(metric, row)
+        return ReportResult([('Итого', value)], value, metric, group_by, period)
+
+    if group_by == 'category':
+        grouped = queryset.values(label=F('category__name'))
+    else:
+        trunc, _, label = BUCKETS[group_by]
+        grouped = queryset.annotate(bucket=trunc('date')).values('bucket')
+    rows = list(grouped.annotate(**aggregates).order_by())
+
+    totals = {
+        's': sum((row['s'] or 0 for row in rows), Decimal('0')),
+        'c': sum(row['c'] or 0 for row in rows),
+        'm': max((row['m'] for row in rows if row.get('m') is not None), default=None),
+    }
+    if group_by == 'category':
+        result = [(row['label'], _value(metric, row)) for row in rows]
+        result.sort(key=lambda item: item[1], reverse=True)
+    else:
+        rows.sort(key=lambda row: row['bucket'])
+        result = [(label(row['bucket']), _value(metric, row)) for row in rows]
+    return ReportResult(result, _value(metric, totals), metric, group_by, period)
+
+
+def _data_version(user):
+    version = getattr(user, 'data_version', None)
+    if version is None:
+        version = User.objects.filter(pk=getattr(user, 'pk', user)).values_list('data_version', flat=True).first()
+    return version
+
+
+def run_report(user, filters, today):
+    """Результат отчёта с кэшем по (пользователь, отпечаток фильтра, версия данных).
+
+    Пока данные пользователя не меняются, повторное открытие отчёта не обращается к БД
+    за строками. user — пользователь или его id.
+    """
+    canonical = parse_filters(filters)
+    period = resolve_period(canonical['period'], today)
+    user_id = getattr(user, 'pk', user)
+
+    key = f"report:{user_id}:{filters_hash(canonical, period)}:{_data_version(user)}"
+    result = cache.get(key)
+    if result is None:
+        result = execute_report(user_id, canonical, period)
+        cache.set(key, result, REPORT_CACHE_TTL)
+    return result
+
+
+def format_value(metric, value):
+    return str(value) if metric == 'count' else f"{value:.2f} ₽"
+
+
+def format_period(period):
+    if period.start is None and period.end is None:
+        return "за всё время"
+    if period.end is None:
+        return f"с {period.start:%d.%m.%Y}"
+    last = period.end - timedelta(days=1)
+    if period.start is None:
+        return f"по {last:%d.%m.%Y}"
+    return f"{period.start:%d.%m.%Y} – {last:%d.%m.%Y}"
+
+
+def format_report(name, result):
+    """Текст отчёта для бота"""
+    lines = [f"📑 {name} ({format_period(result.period)})", f"{METRIC_LABELS[result.metric]}:"]
+    if result.group_by != 'none':
+        if not result.rows:
+            lines.append("Нет операций")
+        for label, value in result.rows:
+            lines.append(f"• {label}: {format_value(result.metric, value)}")
+    lines.append(f"Итого: {format_value(result.metric, result.total)}")
+    return "\n".join(lines)
@@ -0,0 +1,117 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from finance.models import DailyCategoryTotal, Transaction
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def apply_delta(user_id, category_id, date, amount, count):
+    """Прибавляет сумму и количество операций к сводке за день"""
+    # Бот передаёт сумму как float, а дата по умолчанию — datetime
+    amount = Decimal(str(amount))
+    date = Transaction._meta.get_field('date').to_python(date)
+
+    with transaction.atomic():
+        rollups = DailyCategoryTotal.objects.filter(user_id=user_id, category_id=category_id, date=date)
+        if count <= 0:
+            # Вычитание только меняет существующую строку: если её нет,
+            # строку с отрицательным количеством не создаём
+            rollups.update(total=F('total') + amount, count=F('count') + count)
+            # Пустые строки не нужны отчётам
+            rollups.filter(count__lte=0).delete()
+            return
+
+        row, created = DailyCategoryTotal.objects.get_or_create(
+            user_id=user_id,
+            category_id=category_id,
+            date=date,
+            defaults={'total': amount, 'count': count}
+        )
+        if not created:
+            DailyCategoryTotal.objects.filter(pk=row.pk).update(total=F('total') + amount, count=F('count') + count)
+
+
+def apply_transactions(rows, sign=1):
+    """Учитывает в сводке пачку операций.
+
+    rows — итерируемое из кортежей (user_id, category_id, date, amount),
+    sign — 1 при добавлении операций и -1 при удалении.
+    Операции одного дня и категории сворачиваются в одно обновление.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for user_id, category_id, date, amount in rows:
+        delta = deltas[(user_id, category_id, date)]
+        delta[0] += amount * sign
+        delta[1] += sign
+
+    with transaction.atomic():
+        for (user_id, category_id, date), (amount, count) in deltas.items():
+            apply_delta(user_id, category_id, date, amount, count)
+
+
+def _expected_totals(user_ids=None):
+    """Итоги по дням и категориям, посчитанные напрямую по Transaction"""
+    transactions = Transaction.objects.all()
+    if user_ids is not None:
+        transactions = transactions.filter(user_id__in=user_ids)
+
+    return (
+        transactions
+        .order_by()
+        .values('user_id', 'category_id', 'date')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    )
+
+
+def rebuild_rollups(user_ids=None):
+    """Пересобирает сводку с нуля. Возвращает число созданных строк"""
+    created = 0
+    with transaction.atomic():
+        rollups = DailyCategoryTotal.objects.all()
+        if user_ids is not None:
+            rollups = rollups.filter(user_id__in=user_ids)
+        rollups.delete()
+
+        batch = []
+        for row in _expected_totals(user_ids).iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(DailyCategoryTotal(**row))
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                DailyCategoryTotal.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+
+        if batch:
+            DailyCategoryTotal.objects.bulk_create(batch)
+            created += len(batch)
+
+    return created
+
+
+def verify_rollups(user_ids=None):
+    """Сравнивает сводку с операциями.
+
+    Возвращает список расхождений вида
+    ((user_id, category_id, date), (ожидаемая сумма, количество), (фактическая сумма, количество)).
+    """
+    expected = {
+        (row['user_id'], row['category_id'], row['date']): (row['total'], row['count'])
+        for row in _expected_totals(user_ids).iterator()
+    }
+
+    rollups = DailyCategoryTotal.objects.all()
+    if user_ids is not None:
+        rollups = rollups.filter(user_id__in=user_ids)
+    actual = {
+        (row['user_id'], row['category_id'], row['date']): (row['total'], row['count'])
+        for row in rollups.values('user_id', 'category_id', 'date', 'total', 'count').iterator()
+    }
+
+    mismatches = []
+    for key in expected.keys() | actual.keys():
+        if expected.get(key) != actual.get(key):
+            mismatches.append((key, expected.get(key), actual.get(key)))
+    return sorted(mismatches, key=lambda item: (item[0][0], item[0][2], item[0][1]))
@@ -0,0 +1,176 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from finance.anomalies import check_transaction, update_stats
+from finance.hierarchy import add_category, check_parent, detach_children, move_category
+from finance.models import Category, MonthlyBudget, Transaction, User, bump_data_version
+from finance.rollups import apply_delta, apply_transactions
+from finance.telegram.category_index import category_indexes
+from finance.telegram.user_cache import user_cache
+
+# Строки операций, удалённых внутри grouped_transaction_deletes() в этом потоке
+_deleted = threading.local()
+
+
+@contextmanager
+def grouped_transaction_deletes():
+    """Пакетное удаление операций: сводка, статистика категорий и версия данных
+    обновляются одним проходом в конце блока, а не для каждой удалённой строки.
+
+    Каскады и остальные обработчики post_delete срабатывают как обычно.
+    Блок нужно выполнять внутри transaction.atomic().
+    """
+    if getattr(_deleted, 'rows', None) is not None:
+        yield
+        return
+    _deleted.rows = []
+    try:
+        yield
+        rows = _deleted.rows
+    finally:
+        _deleted.rows = None
+    if rows:
+        apply_transactions(rows, sign=-1)
+        update_stats(removed=[(category_id, amount) for _, category_id, _, amount in rows])
+        for user_id in {row[0] for row in rows}:
+            bump_data_version(user_id)
+
+
+def _defer_deleted(instance):
+    """Откладывает удалённую операцию до конца пакета. False — пакета нет"""
+    rows = getattr(_deleted, 'rows', None)
+    if rows is None:
+        return False
+    rows.append((instance.user_id, instance.category_id, instance.date, instance.amount))
+    return True
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_state(sender, instance, raw=False, **kwargs):
+    """Запоминает прежние значения операции перед изменением"""
+    instance._rollup_previous = None
+    if raw or instance.pk is None:
+        return
+    instance._rollup_previous = (
+        Transaction.objects
+        .filter(pk=instance.pk)
+        .values_list('user_id', 'category_id', 'date', 'amount')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    """Переносит изменение операции в сводку по дням"""
+    if raw:
+        return
+
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        user_id, category_id, date, amount = previous
+        apply_delta(user_id, category_id, date, -amount, -1)
+
+    apply_delta(instance.user_id, instance.category_id, instance.date, instance.amount, 1)
+
+
+@receiver(post_save, sender=Transaction)
+def check_for_anomaly(sender, instance, created, raw=False, **kwargs):
+    """Сравнивает новую трату с обычными для её категории; изменённую переносит в статистике"""
+    if raw:
+        return
+    if created:
+        check_transaction(instance)
+        return
+
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        _, category_id, _, amount = previous
+        if (category_id, amount) != (instance.category_id, instance.amount):
+            update_stats(removed=[(category_id, amount)], added=[(instance.category_id, instance.amount)])
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    """Вычитает удалённую операцию из сводки"""
+    if _defer_deleted(instance):
+        return
+    apply_delta(instance.user_id, instance.category_id, instance.date, -instance.amount, -1)
+
+
+@receiver(post_delete, sender=Transaction)
+def forget_deleted_amount(sender, instance, **kwargs):
+    """Убирает удалённую трату из статистики категории"""
+    if getattr(_deleted, 'rows', None) is not None:
+        return
+    update_stats(removed=[(instance.category_id, instance.amount)])
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=MonthlyBudget)
+@receiver(post_delete, sender=MonthlyBudget)
+def bump_user_data_version(sender, instance, raw=False, **kwargs):
+    """Новая версия данных пользователя сбрасывает кэши графиков и отчётов"""
+    if raw:
+        return
+    if sender is Transaction and getattr(_deleted, 'rows', None) is not None:
+        return
+    bump_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Изменения пользователя сбрасывают его запись в кэше бота этого процесса.
+
+    Другие процессы увидят изменения не позже, чем через BOT_USER_CACHE_TTL.
+    """
+    user_cache.invalidate(user_id=instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def update_category_index(sender, instance, raw=False, **kwargs):
+    """Новая или переименованная категория сразу видна боту в этом процессе"""
+    if raw:
+        return
+    category_indexes.category_saved(instance)
+
+
+@receiver(post_delete, sender=Category)
+def remove_from_category_index(sender, instance, **kwargs):
+    category_indexes.category_deleted(instance)
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_parent(sender, instance, raw=False, **kwargs):
+    """Запоминает прежнего родителя и не даёт вложить категорию в её же подкатегорию"""
+    instance._closure_previous_parent = None
+    if raw or instance.pk is None:
+        return
+    instance._closure_previous_parent = (
+        Category.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+    )
+    if instance._closure_previous_parent != instance.parent_id:
+        check_parent(instance)
+
+
+@receiver(post_save, sender=Category)
+def update_category_closure(sender, instance, created, raw=False, **kwargs):
+    """Новая категория или смена родителя меняют замыкание дерева категорий"""
+    if raw:
+        return
+    if created:
+        add_category(instance)
+    elif getattr(instance, '_closure_previous_parent', None) != instance.parent_id:
+        move_category(instance)
+
+
+@receiver(pre_delete, sender=Category)
+def detach_subcategories(sender, instance, **kwargs):
+    """Подкатегории удаляемой категории становятся корневыми (parent обнуляется каскадом SET_NULL)"""
+    detach_children(instance)
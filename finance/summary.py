@@ -0,0 +1,145 @@
+from collections import namedtuple
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Q, Sum
+
+from finance.models import DailyCategoryTotal
+from finance.periods import month_range, previous_month_range
+
+# Полуинтервал дат [start, end); None означает отсутствие границы
+Period = namedtuple('Period', ['start', 'end'])
+
+ALL_TIME = Period(None, None)
+
+
+def day_period(day):
+    """Один календарный день"""
+    return Period(day, day + timedelta(days=1))
+
+
+def last_days_period(today, days):
+    """Последние days дней, включая сегодняшний и день days дней назад"""
+    return Period(today - timedelta(days=days), today + timedelta(days=1))
+
+
+def previous_days_period(today, days):
+    """Такой же отрезок, как last_days_period, но сдвинутый на days дней назад"""
+    return Period(today - timedelta(days=days * 2), today - timedelta(days=days))
+
+
+def month_period(day):
+    return Period(*month_range(day))
+
+
+def previous_month_period(day):
+    return Period(*previous_month_range(day))
+
+
+@dataclass
+class PeriodSummary:
+    """Итоги за период: доходы, расходы и разбивка по категориям"""
+    income: Decimal = Decimal('0')
+    expense: Decimal = Decimal('0')
+    income_by_category: dict = field(default_factory=dict)
+    expense_by_category: dict = field(default_factory=dict)
+
+    @property
+    def balance(self):
+        return self.income - self.expense
+
+    def top_expense_categories(self, limit=3):
+        """Категории с наибольшими расходами, по убыванию суммы"""
+        return sorted(self.expense_by_category.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def _period_filter(period):
+    condition = Q()
+    if period.start is not None:
+        condition &= Q(date__gte=period.start)
+    if period.end is not None:
+        condition &= Q(date__lt=period.end)
+    return condition
+
+
+def _covering_period(periods):
+    """Наименьший полуинтервал, содержащий все периоды"""
+    starts = [period.start for period in periods]
+    ends = [period.end for period in periods]
+    start = None if None in starts else min(starts)
+    end = None if None in ends else max(ends)
+    return Period(start, end)
+
+
+def _aggregates(periods):
+    return {
+        f'period_{index}': Sum('total', filter=_period_filter(period))
+        for index, period in enumerate(periods.values())
+    }
+
+
+def _add_row(summaries, row):
+    """Прибавляет строку сгруппированной сводки к итогам периодов"""
+    name = row['category__name']
+    for index, summary in enumerate(summaries.values()):
+        amount = row[f'period_{index}']
+        if amount is None:
+            continue
+        if row['category__is_income']:
+            summary.income += amount
+            by_category = summary.income_by_category
+        else:
+            summary.expense += amount
+            by_category = summary.expense_by_category
+        # Одноимённые категории в отчётах объединяются
+        by_category[name] = by_category.get(name, 0) + amount
+
+
+def summarize(user, periods):
+    """Считает итоги сразу за несколько периодов одним запросом.
+
+    periods — словарь {имя: Period}. Возвращает словарь {имя: PeriodSummary}.
+    Запрос группирует сводку по категориям и считает сумму каждого периода
+    условной агрегацией, поэтому число периодов не влияет на число запросов.
+    """
+    summaries = {name: PeriodSummary() for name in periods}
+    if not periods:
+        return summaries
+
+    rows = (
+        DailyCategoryTotal.objects
+        .filter(_period_filter(_covering_period(periods.values())), user=user)
+        .values('category__name', 'category__is_income')
+        .annotate(**_aggregates(periods))
+        .order_by()
+    )
+    for row in rows:
+        _add_row(summaries, row)
+    return summaries
+
+
+def summarize_users(user_ids, periods):
+    """То же, что summarize, но для нескольких пользователей одним запросом.
+
+    Возвращает {user_id: {имя: PeriodSummary}}; у пользователей без операций итоги нулевые.
+    """
+    result = {user_id: {name: PeriodSummary() for name in periods} for user_id in user_ids}
+    if not periods or not user_ids:
+        return result
+
+    rows = (
+        DailyCategoryTotal.objects
+        .filter(_period_filter(_covering_period(periods.values())), user_id__in=user_ids)
+        .values('user_id', 'category__name', 'category__is_income')
+        .annotate(**_aggregates(periods))
+        .order_by()
+    )
+    for row in rows:
+        _add_row(result[row['user_id']], row)
+    return result
+
+
+def summarize_period(user, period):
+    """Итоги за один период"""
+    return summarize(user, {'period': period})['period']
@@ -1,58 +1,208 @@
 
+import asyncio
+from itertools import islice
+
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from django.conf import settings
+from django.db import connections
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from asgiref.sync import sync_to_async
+from finance.anomalies import detect_anomalies
+from finance.forecasting import forecast_budgets
+from finance.recommendations import refresh_recommendations
+from finance.telegram.executor import db_executor
 from finance.telegram.handlers import router
-from finance.telegram.services import prepare_daily_reports
+from finance.telegram.sender import send_messages
+from finance.telegram.services import prepare_daily_reports, prepare_weekly_reports
+from finance.telegram.sharding import sharded_dispatcher
+from finance.telegram.webhook import webhook_secret
+
+
+def create_bot():
+    """Бот; TELEGRAM_API_SERVER позволяет указать локальный (или тестовый) Bot API"""
+    api_server = getattr(settings, 'TELEGRAM_API_SERVER', None)
+    if api_server:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_server))
+        return Bot(token=settings.TELEGRAM_BOT_TOKEN, session=session)
+    return Bot(token=settings.TELEGRAM_BOT_TOKEN)
+
 
 # Инициализация бота
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+bot = create_bot()
 dp = Dispatcher()
 
 # Планировщик
 scheduler = AsyncIOScheduler()
 
 
+# Сколько отчётов забирать из генератора за раз
+REPORT_BATCH_SIZE = 500
+
+
+async def iter_reports(reports):
+    """Забирает отчёты из синхронного генератора пачками.
+
+    sync_to_async по умолчанию выполняет код в одном и том же потоке,
+    поэтому курсор генератора не переходит между потоками (пул db_executor
+    для этого не подходит: пачки попадали бы в разные потоки).
+    """
+    while True:
+        batch = await sync_to_async(lambda: list(islice(reports, REPORT_BATCH_SIZE)))()
+        if not batch:
+            return
+        for item in batch:
+            yield item
+
+
 async def send_daily_report():
     try:
-        # Получаем данные в синхронной функции
-        reports = await sync_to_async(prepare_daily_reports)()
-
-        # Отправляем отчёты
-        for chat_id, text in reports:
-            try:
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=text
-                )
-            except Exception as e:
-                print(f"❌ Не удалось отправить отчёт {chat_id}: {e}")
+        # Отчёты готовятся одним запросом и рассылаются параллельно
+        # с соблюдением ограничений Telegram
+        stats = await send_messages(bot, iter_reports(prepare_daily_reports()))
+        print(f"📨 Ежедневные отчёты: {stats}")
     except Exception as e:
         print(f"❌ Ошибка при отправке отчётов: {e}")
 
 
+async def send_weekly_report():
+    try:
+        # Итоги недели всех пользователей считаются одним запросом
+        stats = await send_messages(bot, iter_reports(prepare_weekly_reports()))
+        print(f"📨 Еженедельные отчёты: {stats}")
+    except Exception as e:
+        print(f"❌ Ошибка при отправке еженедельных отчётов: {e}")
+
+
+async def log_db_stats():
+    """Пишет в лог загрузку пула БД, если есть очередь или таймауты"""
+    stats = db_executor.stats()
+    if stats['queued'] or stats['timeouts']:
+        print(
+            f"🗄 Пул БД: в очереди {stats['queued']}, выполняется {stats['running']}/{stats['workers']}, "
+            f"выполнено {stats['completed']}, таймаутов {stats['timeouts']}"
+        )
+
+
+def _detect_anomalies():
+    try:
+        return detect_anomalies()
+    finally:
+        connections.close_all()
+
+
+async def run_anomaly_detection():
+    try:
+        # Расчёт долгий, поэтому выполняется в отдельном потоке, а не в пуле обработчиков
+        created = await sync_to_async(_detect_anomalies, thread_sensitive=False)()
+        print(f"🔎 Новых аномалий: {created}")
+    except Exception as e:
+        print(f"❌ Ошибка поиска аномалий: {e}")
+
+
+def _forecast_budgets():
+    try:
+        return forecast_budgets()
+    finally:
+        connections.close_all()
+
+
+async def run_budget_forecast():
+    try:
+        overspending = await sync_to_async(_forecast_budgets, thread_sensitive=False)()
+        print(f"📈 Прогноз бюджета: превысят план {overspending} пользователей")
+    except Exception as e:
+        print(f"❌ Ошибка прогноза бюджета: {e}")
+
+
+def _refresh_recommendations():
+    try:
+        return refresh_recommendations()
+    finally:
+        connections.close_all()
+
+
+async def run_recommendations_refresh():
+    try:
+        refreshed = await sync_to_async(_refresh_recommendations, thread_sensitive=False)()
+        print(f"💡 Рекомендации пересчитаны для {refreshed} пользователей")
+    except Exception as e:
+        print(f"❌ Ошибка пересчёта рекомендаций: {e}")
+
+
 def start_scheduler():
     scheduler.add_job(send_daily_report, 'cron', hour=9, minute=0)
+    scheduler.add_job(run_anomaly_detection, 'cron', hour=3, minute=0)
+    scheduler.add_job(run_budget_forecast, 'cron', hour=3, minute=15)
+    # После поиска аномалий и прогноза, чтобы они попали в рекомендации
+    scheduler.add_job(run_recommendations_refresh, 'cron', hour=3, minute=30)
+    scheduler.add_job(send_weekly_report, 'cron', day_of_week='mon', hour=9, minute=5)
+    scheduler.add_job(log_db_stats, 'interval', minutes=1)
     scheduler.start()
 
 
-async def start_bot():
+BOT_COMMANDS = [
+    types.BotCommand(command="/today", description="Отчёт за сегодня"),
+    types.BotCommand(command="/week", description="Отчёт за неделю"),
+    types.BotCommand(command="/add", description="Добавить операцию"),
+    types.BotCommand(command="/report", description="Избранный отчёт"),
+    types.BotCommand(command="/help", description="Справка"),
+    types.BotCommand(command="/menu", description="Показать меню")
+]
+
+
+def setup_dispatcher():
+    """Регистрирует обработчики; маршрутизатор подключается к диспетчеру один раз"""
+    if router.parent_router is None:
+        dp.include_router(router)
+    return dp
+
+
+async def start_bot(workers=1):
+    """Опрос Telegram; при workers > 1 обновления обрабатываются в отдельных процессах"""
     # Регистрируем маршрутизатор с обработчиками
-    dp.include_router(router)
+    dispatcher = sharded_dispatcher(workers) if workers > 1 else setup_dispatcher()
 
     # Устанавливаем список команд в интерфейсе Telegram
-    await bot.set_my_commands([
-        types.BotCommand(command="/today", description="Отчёт за сегодня"),
-        types.BotCommand(command="/week", description="Отчёт за неделю"),
-        types.BotCommand(command="/add", description="Добавить операцию"),
-        types.BotCommand(command="/help", description="Справка"),
-        types.BotCommand(command="/menu", description="Показать меню")
-    ])
+    await bot.set_my_commands(BOT_COMMANDS)
 
     # Запускаем планировщик
     start_scheduler()
 
+    # В режиме опроса вебхук должен быть снят, иначе Telegram вернёт конфликт
+    await bot.delete_webhook()
+
     # Запускаем бота
     print("✅ Telegram-бот запущен...")
-    await dp.start_polling(bot)
\ No newline at end of file
+    try:
+        await dispatcher.start_polling(
+            bot,
+            allowed_updates=router.resolve_used_update_types(),
+            # Раскладка по процессам быстрая; последовательно — чтобы сохранить порядок
+            handle_as_tasks=workers <= 1,
+        )
+    finally:
+        db_executor.shutdown()
+
+
+async def start_webhook_mode():
+    """Регистрирует вебхук и выполняет только плановые рассылки.
+
+    Обновления принимает ASGI-приложение проекта (finance.telegram.webhook),
+    поэтому процессов с ним может быть несколько; планировщик нужен в одном.
+    """
+    secret = webhook_secret()
+    await bot.set_my_commands(BOT_COMMANDS)
+    await bot.set_webhook(
+        settings.TELEGRAM_WEBHOOK_URL,
+        secret_token=secret,
+        allowed_updates=router.resolve_used_update_types(),
+    )
+    start_scheduler()
+
+    print(f"✅ Вебхук зарегистрирован: {settings.TELEGRAM_WEBHOOK_URL}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await bot.session.close()
@@ -0,0 +1,164 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from difflib import get_close_matches
+
+from django.conf import settings
+
+from finance.models import Category
+
+# Сколько пользователей держать в кэше и сколько секунд доверять индексу.
+# Категории, созданные в другом процессе (на сайте), появятся не позже чем через TTL.
+CATEGORY_INDEX_SIZE = getattr(settings, 'BOT_CATEGORY_INDEX_SIZE', 10000)
+CATEGORY_INDEX_TTL = getattr(settings, 'BOT_CATEGORY_INDEX_TTL', 300)
+# Минимальное сходство названий для исправления опечаток (0..1)
+FUZZY_CUTOFF = 0.75
+
+CategoryEntry = namedtuple('CategoryEntry', ['id', 'name', 'is_income'])
+
+
+def normalize(name):
+    return ' '.join(name.split()).casefold()
+
+
+class CategoryIndex:
+    """Категории одного пользователя по нормализованному названию.
+
+    Названия не уникальны (доход и расход, подкатегории разных родителей),
+    поэтому под одним названием хранится список категорий.
+
+    Индекс, попавший в кэш, больше не меняется: его читают потоки db_executor
+    без блокировки, а изменения собираются в копии (см. CategoryIndexCache).
+    """
+
+    def __init__(self, entries=()):
+        self._by_key = {}
+        self._key_by_id = {}
+        self._keys = []
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        self.remove(entry.id)
+        key = normalize(entry.name)
+        if key not in self._by_key:
+            self._keys.insert(bisect_left(self._keys, key), key)
+            self._by_key[key] = []
+        self._by_key[key].append(entry)
+        self._key_by_id[entry.id] = key
+
+    def copy(self):
+        index = CategoryIndex()
+        index._by_key = {key: list(entries) for key, entries in self._by_key.items()}
+        index._key_by_id = dict(self._key_by_id)
+        index._keys = list(self._keys)
+        return index
+
+    def remove(self, category_id):
+        key = self._key_by_id.pop(category_id, None)
+        if key is None:
+            return
+        entries = [entry for entry in self._by_key[key] if entry.id != category_id]
+        if entries:
+            self._by_key[key] = entries
+        else:
+            del self._by_key[key]
+            self._keys.remove(key)
+
+    def _entries(self, keys, is_income):
+        return [
+            entry
+            for key in keys
+            for entry in self._by_key.get(key, ())
+            if is_income is None or entry.is_income == is_income
+        ]
+
+    def get(self, name, is_income=None):
+        """Категории с точно таким названием без учёта регистра и лишних пробелов"""
+        return self._entries([normalize(name)], is_income)
+
+    def with_prefix(self, name, is_income=None):
+        key = normalize(name)
+        start = bisect_left(self._keys, key)
+        keys = []
+        for candidate in self._keys[start:]:
+            if not candidate.startswith(key):
+                break
+            keys.append(candidate)
+        return self._entries(keys, is_income)
+
+    def similar(self, name, is_income=None, limit=3):
+        return self._entries(get_close_matches(normalize(name), self._keys, n=limit, cutoff=FUZZY_CUTOFF), is_income)
+
+    def resolve(self, name, is_income=None):
+        """Ищет категорию по названию; is_income ограничивает поиск доходами или расходами.
+
+        Категория выбирается только при единственном точном совпадении. Иначе
+        возвращаются подсказки: одноимённые категории, категории с таким началом
+        названия или похожие (опечатки). Возвращает (категория или None, подсказки).
+        """
+        exact = self.get(name, is_income)
+        if len(exact) == 1:
+            return exact[0], []
+        if exact:
+            return None, exact
+        return None, self.with_prefix(name, is_income) or self.similar(name, is_income)
+
+    def names(self):
+        return sorted(entry.name for entries in self._by_key.values() for entry in entries)
+
+
+class CategoryIndexCache:
+    """LRU-кэш индексов категорий по id пользователя"""
+
+    def __init__(self, maxsize=CATEGORY_INDEX_SIZE, ttl=CATEGORY_INDEX_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._indexes = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached is not None and cached[1] > now:
+                self._indexes.move_to_end(user_id)
+                return cached[0]
+
+        rows = Category.objects.filter(user_id=user_id).values_list(*CategoryEntry._fields)
+        index = CategoryIndex(CategoryEntry(*row) for row in rows)
+        with self._lock:
+            self._indexes[user_id] = (index, now + self.ttl)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _update(self, user_id, change):
+        """Заменяет загруженный индекс пользователя изменённой копией"""
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached is not None:
+                index = cached[0].copy()
+                change(index)
+                self._indexes[user_id] = (index, cached[1])
+
+    def category_saved(self, category):
+        """Обновляет загруженный индекс после создания или переименования категории"""
+        entry = CategoryEntry(category.pk, category.name, category.is_income)
+        self._update(category.user_id, lambda index: index.add(entry))
+
+    def category_deleted(self, category):
+        self._update(category.user_id, lambda index: index.remove(category.pk))
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+category_indexes = CategoryIndexCache()
+
+
+def get_category_index(user_id):
+    return category_indexes.get(user_id)
@@ -0,0 +1,114 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+# Потоков для работы с БД: запросы разных чатов выполняются параллельно,
+# но не больше DB_WORKERS одновременно (у каждого потока своё соединение)
+DB_WORKERS = getattr(settings, 'BOT_DB_WORKERS', 4)
+# Сколько секунд обработчик ждёт ответа из БД
+DB_TIMEOUT = getattr(settings, 'BOT_DB_TIMEOUT', 30)
+
+
+class DatabaseTimeout(Exception):
+    """Запрос к БД не уложился в отведённое время"""
+
+
+class DatabaseExecutor:
+    """Ограниченный пул потоков для синхронного кода Django из обработчиков бота"""
+
+    def __init__(self, max_workers=DB_WORKERS, timeout=DB_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.submitted = 0
+        self.running = 0
+        self.completed = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='bot-db')
+        return self._executor
+
+    def _call(self, func, args, kwargs):
+        with self._lock:
+            self.running += 1
+        # Как в цикле запроса Django: устаревшие соединения потока закрываются
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def _submit(self, func, args, kwargs):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.submitted += 1
+        return loop.run_in_executor(
+            self._get_executor(), functools.partial(self._call, func, args, kwargs)
+        )
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """Выполняет чтение func(*args, **kwargs) в пуле и ждёт не дольше timeout секунд.
+
+        По истечении времени поднимается DatabaseTimeout; сам запрос в потоке
+        дорабатывает до конца, но обработчик его больше не ждёт. Поэтому так
+        можно вызывать только то, что безопасно повторить.
+        """
+        future = self._submit(func, args, kwargs)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise DatabaseTimeout(f"{getattr(func, '__name__', func)} дольше {timeout or self.timeout} с")
+
+    async def run_write(self, func, *args, **kwargs):
+        """Выполняет изменение данных в пуле и дожидается его завершения.
+
+        Тайм-аута нет: запись в потоке всё равно завершилась бы, а повтор
+        команды пользователем после ответа «попробуйте ещё раз» создал бы дубль.
+        """
+        return await self._submit(func, args, kwargs)
+
+    @property
+    def queued(self):
+        """Вызовы, ожидающие свободного потока"""
+        with self._lock:
+            return self.submitted - self.completed - self.running
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queued': self.submitted - self.completed - self.running,
+                'running': self.running,
+                'completed': self.completed,
+                'timeouts': self.timeouts,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+db_executor = DatabaseExecutor()
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронное чтение из БД в пуле потоков бота с тайм-аутом"""
+    return await db_executor.run(func, *args, **kwargs)
+
+
+async def write_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию, меняющую данные, в пуле потоков бота без тайм-аута"""
+    return await db_executor.run_write(func, *args, **kwargs)
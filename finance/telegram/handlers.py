@@ -1,8 +1,9 @@
 from aiogram import Router, types
-from aiogram.filters import Command
-from asgiref.sync import sync_to_async
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.filters import Command, ExceptionTypeFilter
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ErrorEvent
+from finance.telegram.executor import DatabaseTimeout, run_db, write_db
 from finance.telegram.keyboards import get_main_menu, get_remove_keyboard
+from finance.telegram.user_cache import get_cached_user
 from finance.telegram.services import (
     process_start_command,
     get_today_report,
@@ -16,6 +17,7 @@ from finance.telegram.services import (
     compare_with_previous_month,
     set_monthly_budget,
     get_budget_recommendations,
+    get_favorite_report,
     User  # Добавлен импорт User
 )
 
@@ -28,7 +30,7 @@ async def cmd_start(message: types.Message):
 
     # Проверяем, есть ли у пользователя telegram_id
     try:
-        user = await sync_to_async(User.objects.get)(telegram_id=message.from_user.id)
+        user = await run_db(get_cached_user, message.from_user.id)
 
         # Если пользователь уже привязан
         if user.telegram_linked:
@@ -46,7 +48,7 @@ async def cmd_start(message: types.Message):
     if len(args) > 1:
         token = args[1]
         try:
-            result = await sync_to_async(process_start_command)(token, message.from_user.id)
+            result = await write_db(process_start_command, token, message.from_user.id)
             await message.answer(result, reply_markup=get_main_menu())
             return
         except Exception as e:
@@ -54,13 +56,13 @@ async def cmd_start(message: types.Message):
             return
 
     # Если это простой /start без токена
-    result = await sync_to_async(process_start_command)(None, message.from_user.id)
+    result = await write_db(process_start_command, None, message.from_user.id)
     await message.answer(result, reply_markup=get_main_menu())
 
 
 @router.message(Command("today"))
 async def cmd_today(message: types.Message):
-    result = await sync_to_async(get_today_report)(message.from_user.id)
+    result = await run_db(get_today_report, message.from_user.id)
 
     # Создаём инлайн-кнопки
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -74,7 +76,7 @@ async def cmd_today(message: types.Message):
 
 @router.message(Command("week"))
 async def cmd_week(message: types.Message):
-    result = await sync_to_async(get_week_report)(message.from_user.id)
+    result = await run_db(get_week_report, message.from_user.id)
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📊 Подробнее", callback_data="report_detailed")],
@@ -104,8 +106,8 @@ async def cmd_add(message: types.Message):
         description = " ".join(parts[2].split(" ")[1:]) if len(parts[2].split(" ")) > 1 else ""
 
         # Выполняем всю логику в синхронной функции
-        result = await sync_to_async(process_add_command)(
-            message.from_user.id, amount, category_name, description
+        result = await write_db(
+            process_add_command, message.from_user.id, amount, category_name, description
         )
         await message.answer(result, reply_markup=get_main_menu())
     except ValueError:
@@ -131,6 +133,7 @@ async def cmd_help(message: types.Message):
         "📌 /week - Отчёт о расходах за неделю\n"
         "📌 /add сумма категория [описание] - Добавить операцию\n"
         "    Пример: /add 500 Еда обед\n"
+        "📌 /report [номер или название] - Избранный отчёт\n"
         "📌 /menu - Показать главное меню\n\n"
         "💡 Совет: Вы можете использовать кнопки ниже для быстрого доступа к командам."
     )
@@ -140,13 +143,13 @@ async def cmd_help(message: types.Message):
 # Обработка нажатия на кнопки
 @router.message(lambda message: message.text == "/today")
 async def button_today(message: types.Message):
-    result = await sync_to_async(get_today_report)(message.from_user.id)
+    result = await run_db(get_today_report, message.from_user.id)
     await message.answer(result, reply_markup=get_main_menu())
 
 
 @router.message(lambda message: message.text == "/week")
 async def button_week(message: types.Message):
-    result = await sync_to_async(get_week_report)(message.from_user.id)
+    result = await run_db(get_week_report, message.from_user.id)
     await message.answer(result, reply_markup=get_main_menu())
 
 
@@ -222,8 +225,8 @@ async def cmd_createcategory(message: types.Message):
         is_income = (type_str == 'income')
 
         # Создаем категорию
-        result = await sync_to_async(create_category)(
-            message.from_user.id, name, is_income
+        result = await write_db(
+            create_category, message.from_user.id, name, is_income
         )
 
         await message.answer(result, reply_markup=get_main_menu())
@@ -264,12 +267,16 @@ async def cmd_setbudget_values(message: types.Message):
         planned_expense = float(parts[2])
 
         # Сохраняем бюджет
-        result = await sync_to_async(set_monthly_budget)(
-            message.from_user.id, planned_income, planned_expense
+        result = await write_db(
+            set_monthly_budget, message.from_user.id, planned_income, planned_expense
         )
 
-        # Получаем рекомендации
-        recommendations = await sync_to_async(get_budget_recommendations)(message.from_user.id)
+        # Получаем рекомендации; бюджет уже сохранён, поэтому тайм-аут анализа не должен
+        # выглядеть как ошибка сохранения
+        try:
+            recommendations = await run_db(get_budget_recommendations, message.from_user.id)
+        except DatabaseTimeout:
+            recommendations = ["⏳ Анализ сейчас недоступен, он появится на сайте чуть позже."]
 
         response = f"{result}\n\n📊 Анализ бюджета:\n"
         response += "\n".join(recommendations)
@@ -282,17 +289,26 @@ async def cmd_setbudget_values(message: types.Message):
         )
 
 
+@router.message(Command("report"))
+async def cmd_report(message: types.Message):
+    """Избранный отчёт, сохранённый на сайте"""
+    parts = message.text.split(" ", 1)
+    name = parts[1].strip() if len(parts) > 1 else None
+    result = await run_db(get_favorite_report, message.from_user.id, name)
+    await message.answer(result, reply_markup=get_main_menu())
+
+
 # Обработчики callback-запросов
 @router.callback_query(lambda c: c.data == "report_detailed")
 async def callback_detailed_report(callback: CallbackQuery):
-    result = await sync_to_async(get_detailed_today_report)(callback.from_user.id)
+    result = await run_db(get_detailed_today_report, callback.from_user.id)
     await callback.message.edit_text(result)
     await callback.answer()
 
 
 @router.callback_query(lambda c: c.data == "report_compare_week")
 async def callback_compare_week(callback: CallbackQuery):
-    result = await sync_to_async(compare_with_previous_week)(callback.from_user.id)
+    result = await run_db(compare_with_previous_week, callback.from_user.id)
     await callback.message.edit_text(result)
     await callback.answer()
 
@@ -310,13 +326,28 @@ async def callback_add_expense(callback: CallbackQuery):
 
 @router.callback_query(lambda c: c.data == "report_detailed_week")
 async def callback_detailed_week_report(callback: CallbackQuery):
-    result = await sync_to_async(get_detailed_week_report)(callback.from_user.id)
+    result = await run_db(get_detailed_week_report, callback.from_user.id)
     await callback.message.edit_text(result)
     await callback.answer()
 
 
 @router.callback_query(lambda c: c.data == "report_compare_month")
 async def callback_compare_month(callback: CallbackQuery):
-    result = await sync_to_async(compare_with_previous_month)(callback.from_user.id)
+    result = await run_db(compare_with_previous_month, callback.from_user.id)
     await callback.message.edit_text(result)
-    await callback.answer()
\ No newline at end of file
+    await callback.answer()
+
+
+@router.errors(ExceptionTypeFilter(DatabaseTimeout))
+async def on_database_timeout(event: ErrorEvent):
+    """Отвечает пользователю, если чтение из БД не успело выполниться.
+
+    Тайм-аут есть только у чтения (run_db), поэтому повтор безопасен; изменения
+    данных (write_db) всегда дожидаются результата.
+    """
+    print(f"⏳ {event.exception}")
+    update = event.update
+    if update.callback_query:
+        await update.callback_query.answer("⏳ Сервер занят, попробуйте ещё раз чуть позже.", show_alert=True)
+    elif update.message:
+        await update.message.answer("⏳ Сервер занят, попробуйте ещё раз чуть позже.")
@@ -0,0 +1,189 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from django.conf import settings
+
+# Одновременных запросов к Bot API
+SEND_CONCURRENCY = getattr(settings, 'TELEGRAM_SEND_CONCURRENCY', 20)
+# Telegram допускает около 30 сообщений в секунду на бота и 1 в секунду в один чат
+GLOBAL_RATE = getattr(settings, 'TELEGRAM_GLOBAL_RATE', 25)
+PER_CHAT_RATE = getattr(settings, 'TELEGRAM_PER_CHAT_RATE', 1)
+# Повторы одного сообщения: при retry_after, сетевых ошибках и ошибках сервера Telegram
+MAX_RETRIES = getattr(settings, 'TELEGRAM_SEND_RETRIES', 3)
+RETRY_BACKOFF = 1.0
+
+
+def _is_flood_error(error):
+    """429 без retry_after: aiogram отдаёт его как общий TelegramAPIError"""
+    return isinstance(error, TelegramAPIError) and 'too many requests' in error.message.lower()
+
+
+class TokenBucket:
+    """Асинхронное «ведро токенов»: в среднем не больше rate операций в секунду"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Запрещает операции на seconds секунд (ответ Telegram retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class SendStats:
+    """Итоги рассылки"""
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float = None
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Отправлено сообщений в секунду"""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"отправлено {self.sent}, ошибок {self.failed}, повторов {self.retried} "
+            f"за {self.elapsed:.1f} с ({self.throughput:.1f} сообщ./с)"
+        )
+
+
+class MessageSender:
+    """Параллельная рассылка с ограничением скорости.
+
+    Общая скорость ограничивается одним ведром токенов, скорость в каждый
+    чат — отдельным. На retry_after от Telegram рассылка приостанавливается
+    целиком, сетевые ошибки повторяются с экспоненциальной задержкой.
+    """
+
+    def __init__(self, bot, concurrency=SEND_CONCURRENCY, global_rate=GLOBAL_RATE,
+                 per_chat_rate=PER_CHAT_RATE, max_retries=MAX_RETRIES):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.stats = SendStats()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+
+    def _fail(self, chat_id, error):
+        print(f"❌ Не удалось отправить сообщение {chat_id}: {error}")
+        self.stats.failed += 1
+        return False
+
+    async def send(self, chat_id, text):
+        """Отправляет одно сообщение с учётом ограничений. Возвращает True при успехе.
+
+        Все повторы, в том числе по retry_after, считаются в пределах max_retries:
+        чат, который Telegram ограничивает дольше, не задерживает рассылку навсегда.
+        """
+        attempt = 0
+        while True:
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                self.stats.sent += 1
+                return True
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    return self._fail(chat_id, e)
+                # Ограничение действует на весь бот, поэтому ждут все
+                self.stats.retried += 1
+                self.global_bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота — повторять бессмысленно
+                self.stats.failed += 1
+                return False
+            except Exception as e:
+                # Повторяются сетевые ошибки, ошибки сервера Telegram и 429 без retry_after
+                flood = _is_flood_error(e)
+                retryable = flood or isinstance(e, (TelegramNetworkError, TelegramServerError))
+                attempt += 1
+                if not retryable or attempt > self.max_retries:
+                    return self._fail(chat_id, e)
+                self.stats.retried += 1
+                delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+                if flood:
+                    # 429 без срока ожидания: приостанавливаем всю рассылку
+                    self.global_bucket.pause(delay)
+                else:
+                    await asyncio.sleep(delay)
+
+    async def send_all(self, messages):
+        """Рассылает пары (chat_id, text) из обычного или асинхронного итератора"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                try:
+                    if item is None:
+                        return
+                    await self.send(*item)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(messages, '__aiter__'):
+                async for item in messages:
+                    await queue.put(item)
+            else:
+                for item in messages:
+                    await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            self.stats.finished_at = time.monotonic()
+
+        return self.stats
+
+
+async def send_messages(bot, messages, **options):
+    """Рассылает сообщения и возвращает SendStats"""
+    return await MessageSender(bot, **options).send_all(messages)
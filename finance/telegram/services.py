@@ -1,8 +1,29 @@
 
+from django.db.models import FilteredRelation, Q, Sum
 from django.utils import timezone
 from datetime import timedelta
-from django.db.models import Sum
-from finance.models import TelegramLinkToken, Transaction, Category, User, MonthlyBudget
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+from finance.models import TelegramLinkToken, Transaction, Category, User, MonthlyBudget, Recommendation, FavoriteReport
+from finance.hierarchy import CategoryTree, subtree_totals
+from finance.recommendations import get_recommendations
+from finance.reports import ReportFilterError, format_report, run_report
+from finance.summary import (
+    Period,
+    day_period,
+    last_days_period,
+    month_period,
+    previous_days_period,
+    previous_month_period,
+    summarize,
+    summarize_period,
+)
+from finance.telegram.category_index import get_category_index, normalize
+from finance.telegram.user_cache import get_cached_user, user_cache
+
+# Сколько строк читать из БД за раз при подготовке рассылок
+REPORT_CHUNK_SIZE = 2000
 
 
 def process_start_command(token, telegram_id):
@@ -20,6 +41,7 @@ def process_start_command(token, telegram_id):
         user.telegram_linked = True
         user.save()
         link_token.delete()
+        user_cache.invalidate(telegram_id=telegram_id)
 
         return (
             "✅ Аккаунт успешно привязан!\n\n"
@@ -48,18 +70,12 @@ def process_start_command(token, telegram_id):
 def get_today_report(telegram_id):
     """Синхронная функция для получения отчёта за сегодня"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
         today = timezone.now().date()
 
-        expenses = Transaction.objects.filter(
-            user=user, date=today, category__is_income=False
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
+        summary = summarize_period(user.id, day_period(today))
 
-        income = Transaction.objects.filter(
-            user=user, date=today, category__is_income=True
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
-
-        return f"📊 Отчёт за сегодня:\nДоходы: {income} ₽\nРасходы: {expenses} ₽"
+        return f"📊 Отчёт за сегодня:\nДоходы: {summary.income} ₽\nРасходы: {summary.expense} ₽"
 
     except User.DoesNotExist:
         return "❌ Ваш аккаунт не привязан. Перейдите на сайт и привяжите Telegram."
@@ -70,14 +86,10 @@ def get_today_report(telegram_id):
 def get_week_report(telegram_id):
     """Синхронная функция для получения отчёта за неделю"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
-        week_ago = timezone.now().date() - timedelta(days=7)
-
-        expenses = Transaction.objects.filter(
-            user=user, date__gte=week_ago, category__is_income=False
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
+        user = get_cached_user(telegram_id)
+        summary = summarize_period(user.id, last_days_period(timezone.now().date(), 7))
 
-        return f"📈 Расходы за неделю: {expenses} ₽"
+        return f"📈 Расходы за неделю: {summary.expense} ₽"
 
     except User.DoesNotExist:
         return "❌ Ваш аккаунт не привязан."
@@ -88,33 +100,44 @@ def get_week_report(telegram_id):
 def process_add_command(telegram_id, amount, category_name, description):
     """Синхронная функция для добавления операции"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
 
-        # Нормализуем ввод пользователя
-        normalized_input = category_name.strip().lower()
+        # Знак перед названием уточняет тип одноимённых категорий: +Подарки — доход, -Подарки — расход
+        is_income = None
+        if len(category_name) > 1 and category_name[0] in '+-':
+            is_income, category_name = category_name[0] == '+', category_name[1:]
 
-        # Получаем все категории пользователя
-        user_categories = Category.objects.filter(user=user)
-
-        # Ищем совпадение без учета регистра
-        category = None
-        for cat in user_categories:
-            if cat.name.lower() == normalized_input:
-                category = cat
-                break
+        # Операция записывается только при точном совпадении названия;
+        # похожие категории предлагаются, но не выбираются молча
+        category_index = get_category_index(user.id)
+        category, suggestions = category_index.resolve(category_name, is_income)
 
         if not category:
+            if suggestions and all(normalize(c.name) == normalize(category_name) for c in suggestions):
+                return (
+                    f"❌ Категорий с названием '{category_name}' несколько.\n"
+                    f"Уточните тип: /add {amount} +{category_name} — доход, "
+                    f"/add {amount} -{category_name} — расход"
+                )
+            if suggestions:
+                variants = ", ".join(sorted({c.name for c in suggestions}))
+                return (
+                    f"❌ Категория '{category_name}' не найдена.\n"
+                    f"Возможно, вы имели в виду: {variants}\n"
+                    f"Повторите команду с точным названием, например: "
+                    f"/add {amount} {suggestions[0].name} {description}".rstrip()
+                )
             # Для диагностики: покажем доступные категории
-            available_categories = ", ".join([c.name for c in user_categories])
+            available_categories = ", ".join(category_index.names())
             return (
                 f"❌ Категория '{category_name}' не найдена.\n"
                 f"Доступные категории: {available_categories}"
             )
 
         Transaction.objects.create(
-            user=user,
+            user_id=user.id,
             amount=amount,
-            category=category,
+            category_id=category.id,
             description=description
         )
 
@@ -126,40 +149,122 @@ def process_add_command(telegram_id, amount, category_name, description):
         return f"❌ Ошибка: {str(e)}"
 
 
-def prepare_daily_reports():
-    """Синхронная функция для подготовки ежедневных отчётов"""
-    reports = []
-    try:
-        users = User.objects.filter(telegram_linked=True, send_daily_report=True)
-        today = timezone.now().date()
+def prepare_daily_reports(today=None):
+    """Синхронный генератор ежедневных отчётов: пары (telegram_id, текст).
+
+    Расходы всех подписанных пользователей по категориям считаются одним
+    запросом к сводке, присоединённой к пользователям. Строки читаются
+    с сервера частями, поэтому память не зависит от числа пользователей.
+    Генератор нужно потреблять в одном потоке (см. bot.send_daily_report).
+    """
+    today = today or timezone.now().date()
+    rows = (
+        User.objects
+        .filter(telegram_linked=True, send_daily_report=True, telegram_id__isnull=False)
+        .annotate(today_totals=FilteredRelation('daily_totals', condition=Q(daily_totals__date=today)))
+        .values_list('telegram_id', 'today_totals__category__name')
+        .annotate(spent=Sum('today_totals__total', filter=Q(today_totals__category__is_income=False)))
+        .order_by('telegram_id', 'today_totals__category__name')
+    )
 
-        for user in users:
-            expenses = Transaction.objects.filter(
-                user=user, date=today, category__is_income=False
-            ).aggregate(sum=Sum('amount'))['sum'] or 0
-
-            reports.append((
-                user.telegram_id,
-                f"📅 Ежедневный отчёт:\nСегодня потрачено: {expenses} ₽"
-            ))
+    try:
+        user_rows = groupby(rows.iterator(chunk_size=REPORT_CHUNK_SIZE), key=itemgetter(0))
+        for telegram_id, categories in user_rows:
+            # Категории доходов дают spent=None, пользователи без операций — одну пустую строку
+            expenses = [(name, spent) for _, name, spent in categories if spent is not None]
+            total = sum((spent for _, spent in expenses), Decimal('0'))
+
+            text = f"📅 Ежедневный отчёт:\nСегодня потрачено: {total} ₽"
+            for name, spent in expenses:
+                text += f"\n• {name}: {spent} ₽"
+            yield telegram_id, text
     except Exception as e:
         print(f"❌ Ошибка при подготовке отчётов: {e}")
 
-    return reports
+
+def prepare_weekly_reports(today=None):
+    """Синхронный генератор еженедельных дайджестов: пары (telegram_id, текст).
+
+    Итоги недели, топ категорий и сравнение с прошлой неделей для всех
+    подписанных пользователей считаются одним запросом: сводка за две недели
+    присоединяется к пользователям, а периоды разделяются условной агрегацией.
+    """
+    today = today or timezone.now().date()
+    # Две равные непересекающиеся недели: семь полных дней до вчерашнего включительно
+    # и семь дней перед ними. Сегодняшний день войдёт в следующий дайджест
+    current = Period(today - timedelta(days=7), today)
+    previous = Period(today - timedelta(days=14), current.start)
+    expense = Q(weeks__category__is_income=False)
+    in_current = Q(weeks__date__gte=current.start, weeks__date__lt=current.end)
+    in_previous = Q(weeks__date__gte=previous.start, weeks__date__lt=previous.end)
+
+    rows = (
+        User.objects
+        .filter(telegram_linked=True, send_weekly_report=True, telegram_id__isnull=False)
+        .annotate(weeks=FilteredRelation('daily_totals', condition=Q(
+            daily_totals__date__gte=previous.start,
+            daily_totals__date__lt=current.end
+        )))
+        .values_list('telegram_id', 'weeks__category__name')
+        .annotate(
+            spent=Sum('weeks__total', filter=in_current & expense),
+            spent_before=Sum('weeks__total', filter=in_previous & expense),
+            earned=Sum('weeks__total', filter=in_current & ~expense)
+        )
+        .order_by('telegram_id', 'weeks__category__name')
+    )
+
+    try:
+        user_rows = groupby(rows.iterator(chunk_size=REPORT_CHUNK_SIZE), key=itemgetter(0))
+        for telegram_id, categories in user_rows:
+            yield telegram_id, format_weekly_report(list(categories))
+    except Exception as e:
+        print(f"❌ Ошибка при подготовке еженедельных отчётов: {e}")
+
+
+def format_weekly_report(categories):
+    """Текст дайджеста по строкам (telegram_id, категория, расход, расход неделей ранее, доход)"""
+    zero = Decimal('0')
+    expense = sum((spent or zero for _, _, spent, _, _ in categories), zero)
+    previous_expense = sum((before or zero for _, _, _, before, _ in categories), zero)
+    income = sum((earned or zero for _, _, _, _, earned in categories), zero)
+    top = sorted(
+        ((name, spent) for _, name, spent, _, _ in categories if spent),
+        key=itemgetter(1),
+        reverse=True
+    )[:3]
+
+    report = "🗓 Еженедельный отчёт:\n"
+    report += f"Доходы: {income} ₽\n"
+    report += f"Расходы: {expense} ₽\n"
+    if top:
+        report += "Больше всего потрачено:\n"
+        for name, spent in top:
+            report += f"• {name}: {spent} ₽\n"
+
+    diff = expense - previous_expense
+    report += f"Прошлая неделя: {previous_expense} ₽\n"
+    if diff > 0:
+        report += f"Вы потратили на {diff:.2f} ₽ больше. 💸"
+    elif diff < 0:
+        report += f"Вы сэкономили {abs(diff):.2f} ₽! 🎉"
+    else:
+        report += "Расходы одинаковы. 🟰"
+    return report
 
 
 def create_category(telegram_id, name, is_income):
     """Создает новую категорию"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
 
         # Проверяем, нет ли уже такой категории
-        if Category.objects.filter(user=user, name__iexact=name).exists():
+        if get_category_index(user.id).get(name):
             return f"❌ Категория '{name}' уже существует."
 
         # Создаем новую категорию
         Category.objects.create(
-            user=user,
+            user_id=user.id,
             name=name,
             is_income=is_income
         )
@@ -175,12 +280,12 @@ def create_category(telegram_id, name, is_income):
 def set_monthly_budget(telegram_id, planned_income, planned_expense):
     """Устанавливает бюджет на текущий месяц"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
         current_month = timezone.now().replace(day=1).strftime('%Y-%m')
 
         # Создаем или обновляем бюджет
         budget, created = MonthlyBudget.objects.update_or_create(
-            user=user,
+            user_id=user.id,
             month=current_month,
             defaults={
                 'planned_income': planned_income,
@@ -201,110 +306,78 @@ def set_monthly_budget(telegram_id, planned_income, planned_expense):
 
 
 def get_budget_recommendations(telegram_id):
-    """Генерирует рекомендации на основе бюджета"""
+    """Рекомендации по бюджету из сохранённого набора (тот же, что на сайте)"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
-        current_month = timezone.now().replace(day=1).strftime('%Y-%m')
-
-        try:
-            budget = MonthlyBudget.objects.get(user=user, month=current_month)
-        except MonthlyBudget.DoesNotExist:
-            return ["📊 Установите бюджет для получения персонализированных рекомендаций."]
-
-        # Аналогичная логика как в home view
-        year, month = map(int, current_month.split('-'))
-        transactions = Transaction.objects.filter(
-            user=user,
-            date__year=year,
-            date__month=month
+        user = get_cached_user(telegram_id)
+        recommendations = get_recommendations(
+            user.id, kinds=(Recommendation.KIND_BUDGET, Recommendation.KIND_FORECAST)
         )
+        if not recommendations:
+            return ["📊 Установите бюджет для получения персонализированных рекомендаций."]
+        return recommendations
 
-        total_income = transactions.filter(category__is_income=True).aggregate(sum=Sum('amount'))['sum'] or 0
-        total_expense = transactions.filter(category__is_income=False).aggregate(sum=Sum('amount'))['sum'] or 0
-
-        recommendations = []
-
-        # Анализ доходов
-        if budget.planned_income > 0:
-            income_diff = total_income - budget.planned_income
-            income_percent = (total_income / budget.planned_income * 100) if budget.planned_income else 0
-
-            if income_diff > 0:
-                recommendations.append(
-                    f"✅ Доходы превысили план на {abs(income_diff):.2f} ₽ ({income_percent:.1f}%)"
-                )
-            elif income_diff < 0:
-                recommendations.append(
-                    f"⚠️ Доходы ниже плана на {abs(income_diff):.2f} ₽ ({income_percent:.1f}%)"
-                )
-
-        # Анализ расходов
-        if budget.planned_expense > 0:
-            expense_diff = total_expense - budget.planned_expense
-            expense_percent = (total_expense / budget.planned_expense * 100) if budget.planned_expense else 0
+    except User.DoesNotExist:
+        return ["❌ Ваш аккаунт не привязан."]
+    except Exception as e:
+        return [f"❌ Ошибка: {str(e)}"]
 
-            if expense_diff > 0:
-                recommendations.append(
-                    f"⚠️ Расходы превысили план на {abs(expense_diff):.2f} ₽ ({expense_percent:.1f}%)"
-                )
-            elif expense_diff < 0:
-                recommendations.append(
-                    f"✅ Расходы ниже плана на {abs(expense_diff):.2f} ₽ ({expense_percent:.1f}%)"
-                )
 
-        # Прогноз на конец месяца
-        today = timezone.now().date()
-        days_passed = (today - today.replace(day=1)).days + 1
-        if days_passed > 0 and budget.planned_expense > 0:
-            daily_expense = total_expense / days_passed
-            days_in_month = (today.replace(month=today.month % 12 + 1) - timedelta(days=1)).day
-            days_remaining = days_in_month - days_passed
-            projected_expense = total_expense + (daily_expense * days_remaining)
-
-            if projected_expense > budget.planned_expense:
-                over = projected_expense - budget.planned_expense
-                recommendations.append(
-                    f"⚠️ По текущим тратам вы превысите бюджет на {over:.2f} ₽"
-                )
-            else:
-                remaining = budget.planned_expense - projected_expense
-                recommendations.append(
-                    f"✅ По текущим тратам вы уложитесь в бюджет, остаток {remaining:.2f} ₽"
-                )
+def get_favorite_report(telegram_id, name=None):
+    """Избранный отчёт по названию или номеру; без аргумента — список отчётов"""
+    try:
+        user = get_cached_user(telegram_id)
+        reports = list(FavoriteReport.objects.filter(user_id=user.id))
+        if not reports:
+            return "📑 У вас нет избранных отчётов. Их можно создать на сайте в разделе «Отчёты»."
+
+        if not name:
+            lines = ["📑 Ваши отчёты:"]
+            lines += [f"{number}. {report.name}" for number, report in enumerate(reports, 1)]
+            lines.append("\nОткрыть: /report номер или /report название")
+            return "\n".join(lines)
+
+        if name.isdigit() and 1 <= int(name) <= len(reports):
+            report = reports[int(name) - 1]
+        else:
+            report = next((r for r in reports if r.name.casefold() == name.casefold()), None)
+        if report is None:
+            return f"❌ Отчёт «{name}» не найден. Список отчётов: /report"
 
-        return recommendations
+        result = run_report(user.id, report.filters, timezone.now().date())
+        return format_report(report.name, result)
 
     except User.DoesNotExist:
-        return ["❌ Ваш аккаунт не привязан."]
+        return "❌ Ваш аккаунт не привязан."
+    except ReportFilterError as e:
+        return f"❌ Фильтр отчёта устарел: {e}"
     except Exception as e:
-        return [f"❌ Ошибка: {str(e)}"]
+        return f"❌ Ошибка: {str(e)}"
+
+
+def category_tree_lines(totals):
+    """Строки отчёта по дереву категорий: у родителя — сумма вместе с подкатегориями"""
+    tree = CategoryTree(totals)
+    lines = []
+    for level, node in tree.walk():
+        marker = "•" if level == 0 else "    " * (level - 1) + "  └"
+        suffix = " (с подкатегориями)" if tree.children[node.id] else ""
+        lines.append(f"{marker} {node.name}: {node.total} ₽{suffix}")
+    return lines
 
 
 def get_detailed_today_report(telegram_id):
     """Подробный отчёт за сегодня"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
         today = timezone.now().date()
 
-        # Группировка по категориям
-        expenses_by_category = {}
-        transactions = Transaction.objects.filter(
-            user=user,
-            date=today,
-            category__is_income=False
-        )
-
-        for t in transactions:
-            cat_name = t.category.name
-            if cat_name not in expenses_by_category:
-                expenses_by_category[cat_name] = 0
-            expenses_by_category[cat_name] += t.amount
+        # Группировка по категориям с итогами по подкатегориям
+        lines = category_tree_lines(subtree_totals(user.id, day_period(today)))
 
         # Формируем отчёт
         report = f"📊 Подробный отчёт за сегодня ({today}):\n"
-        if expenses_by_category:
-            for category, amount in expenses_by_category.items():
-                report += f"• {category}: {amount} ₽\n"
+        if lines:
+            report += "".join(f"{line}\n" for line in lines)
         else:
             report += "Нет расходов за сегодня.\n"
 
@@ -319,25 +392,16 @@ def get_detailed_today_report(telegram_id):
 def compare_with_previous_week(telegram_id):
     """Сравнение с прошлой неделей"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
         today = timezone.now().date()
 
-        # Текущая неделя
-        week_ago = today - timedelta(days=7)
-        current_week_expenses = Transaction.objects.filter(
-            user=user,
-            date__gte=week_ago,
-            category__is_income=False
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
-
-        # Прошлая неделя
-        two_weeks_ago = today - timedelta(days=14)
-        previous_week_expenses = Transaction.objects.filter(
-            user=user,
-            date__gte=two_weeks_ago,
-            date__lt=week_ago,
-            category__is_income=False
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
+        # Текущая и прошлая неделя одним запросом
+        summaries = summarize(user.id, {
+            'current': last_days_period(today, 7),
+            'previous': previous_days_period(today, 7),
+        })
+        current_week_expenses = summaries['current'].expense
+        previous_week_expenses = summaries['previous'].expense
 
         diff = current_week_expenses - previous_week_expenses
 
@@ -363,28 +427,16 @@ def compare_with_previous_week(telegram_id):
 def get_detailed_week_report(telegram_id):
     """Подробный отчёт за неделю"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
-        week_ago = timezone.now().date() - timedelta(days=7)
-
-        # Группировка по категориям
-        expenses_by_category = {}
-        transactions = Transaction.objects.filter(
-            user=user,
-            date__gte=week_ago,
-            category__is_income=False
-        )
+        user = get_cached_user(telegram_id)
+        week = last_days_period(timezone.now().date(), 7)
 
-        for t in transactions:
-            cat_name = t.category.name
-            if cat_name not in expenses_by_category:
-                expenses_by_category[cat_name] = 0
-            expenses_by_category[cat_name] += t.amount
+        # Группировка по категориям с итогами по подкатегориям
+        lines = category_tree_lines(subtree_totals(user.id, week))
 
         # Формируем отчёт
         report = f"📈 Подробный отчёт за неделю:\n"
-        if expenses_by_category:
-            for category, amount in expenses_by_category.items():
-                report += f"• {category}: {amount} ₽\n"
+        if lines:
+            report += "".join(f"{line}\n" for line in lines)
         else:
             report += "Нет расходов за неделю.\n"
 
@@ -399,31 +451,16 @@ def get_detailed_week_report(telegram_id):
 def compare_with_previous_month(telegram_id):
     """Сравнение с прошлым месяцем"""
     try:
-        user = User.objects.get(telegram_id=telegram_id)
+        user = get_cached_user(telegram_id)
         today = timezone.now().date()
-        current_month_str = today.replace(day=1).strftime('%Y-%m')
-
-        # Текущий месяц
-        current_year, current_month = map(int, current_month_str.split('-'))
-        current_month_expenses = Transaction.objects.filter(
-            user=user,
-            date__year=current_year,
-            date__month=current_month,
-            category__is_income=False
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
-
-        # Прошлый месяц
-        if current_month == 1:
-            previous_year, previous_month = current_year - 1, 12
-        else:
-            previous_year, previous_month = current_year, current_month - 1
-
-        previous_month_expenses = Transaction.objects.filter(
-            user=user,
-            date__year=previous_year,
-            date__month=previous_month,
-            category__is_income=False
-        ).aggregate(sum=Sum('amount'))['sum'] or 0
+
+        # Текущий и прошлый месяц одним запросом
+        summaries = summarize(user.id, {
+            'current': month_period(today),
+            'previous': previous_month_period(today),
+        })
+        current_month_expenses = summaries['current'].expense
+        previous_month_expenses = summaries['previous'].expense
 
         diff = current_month_expenses - previous_month_expenses
 
@@ -0,0 +1,171 @@
+import asyncio
+import multiprocessing
+import signal
+from queue import Full
+
+from aiogram import Dispatcher
+from aiogram.types import Update
+from django.conf import settings
+
+# Сколько процессов обрабатывают обновления и сколько обновлений ждут в очереди каждого.
+# При заполненной очереди приём обновлений притормаживает, пока процесс не освободится.
+BOT_WORKERS = getattr(settings, 'TELEGRAM_BOT_WORKERS', 1)
+WORKER_QUEUE_SIZE = getattr(settings, 'TELEGRAM_WORKER_QUEUE_SIZE', 1000)
+# Сколько секунд ждать, пока процессы дообработают очередь при остановке
+DRAIN_TIMEOUT = 30
+
+
+def shard_key(update):
+    """Чат обновления: все обновления одного чата попадают в один процесс"""
+    event = update.event
+    chat = getattr(event, 'chat', None)
+    if chat is None and getattr(event, 'message', None) is not None:
+        chat = event.message.chat
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else update.update_id
+
+
+class UpdateSharder:
+    """Распределяет обновления по процессам-обработчикам по id чата.
+
+    Обновления одного чата всегда идут в один процесс и обрабатываются там
+    по порядку; разные чаты обрабатываются параллельно на всех ядрах.
+    """
+
+    def __init__(self, workers=BOT_WORKERS, queue_size=WORKER_QUEUE_SIZE, target=None, start_method='spawn'):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.target = target or _worker_main
+        self.start_method = start_method
+        self.queues = []
+        self.processes = []
+        # Сколько обновлений каждого процесса ждут места в очереди
+        self.waiting = []
+        self._locks = []
+
+    async def start(self, **kwargs):
+        if self.processes:
+            return
+        context = multiprocessing.get_context(self.start_method)
+        for index in range(self.workers):
+            queue = context.Queue(maxsize=self.queue_size)
+            process = context.Process(target=self.target, args=(index, queue), name=f'bot-worker-{index}')
+            process.start()
+            self.queues.append(queue)
+            self.processes.append(process)
+        self.waiting = [0] * self.workers
+        self._locks = [asyncio.Lock() for _ in range(self.workers)]
+        print(f"✅ Запущено процессов-обработчиков: {self.workers}")
+
+    async def submit(self, update):
+        key = shard_key(update)
+        index = key % self.workers
+        item = (key, update.model_dump(mode='json', exclude_none=True))
+        queue = self.queues[index]
+
+        # Пока никто не ждёт места в очереди, кладём сразу, не блокируя цикл событий
+        if not self.waiting[index]:
+            try:
+                queue.put_nowait(item)
+                return
+            except Full:
+                pass
+
+        # Очередь заполнена — это обратное давление: ждём места в отдельном потоке.
+        # Ожидающие выстраиваются по порядку, поэтому порядок обновлений чата сохраняется
+        self.waiting[index] += 1
+        try:
+            async with self._locks[index]:
+                await asyncio.to_thread(queue.put, item)
+        finally:
+            self.waiting[index] -= 1
+
+    async def stop(self, **kwargs):
+        """Плавная остановка: процессы дообрабатывают свои очереди и завершаются.
+
+        Процессы ждут одновременно, так что остановка занимает не больше DRAIN_TIMEOUT.
+        """
+        if not self.processes:
+            return
+        await asyncio.gather(*(asyncio.to_thread(queue.put, None) for queue in self.queues))
+        await asyncio.gather(*(asyncio.to_thread(process.join, DRAIN_TIMEOUT) for process in self.processes))
+        for process in self.processes:
+            if process.is_alive():
+                print(f"⚠️ {process.name} не завершился за {DRAIN_TIMEOUT} с, останавливаем")
+                process.terminate()
+        self.queues = []
+        self.processes = []
+
+    async def middleware(self, handler, update, data):
+        # Обработчики во входном процессе не вызываются: обновление уходит в очередь
+        await self.submit(update)
+
+
+def sharded_dispatcher(workers=BOT_WORKERS):
+    """Диспетчер входного процесса, который только раскладывает обновления по процессам"""
+    sharder = UpdateSharder(workers)
+    dp = Dispatcher()
+    dp.update.outer_middleware(sharder.middleware)
+    dp.startup.register(sharder.start)
+    dp.shutdown.register(sharder.stop)
+    return dp
+
+
+def _worker_main(index, queue):
+    # Ctrl+C получает входной процесс; обработчики останавливаются по его сигналу
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import django
+    django.setup()
+
+    asyncio.run(_run_worker(queue))
+
+
+async def _run_worker(queue):
+    from finance.telegram.bot import bot, setup_dispatcher
+    from finance.telegram.executor import db_executor
+
+    dp = setup_dispatcher()
+
+    async def handle(data):
+        update = Update.model_validate(data, context={'bot': bot})
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"❌ Ошибка обработки обновления {update.update_id}: {e}")
+
+    try:
+        await _consume(queue, handle)
+    finally:
+        db_executor.shutdown()
+        await bot.session.close()
+
+
+async def _consume(queue, handle):
+    """Читает очередь до None; обновления одного чата обрабатываются по порядку"""
+    loop = asyncio.get_running_loop()
+    # Последняя задача каждого чата: следующее обновление чата ждёт её завершения
+    chains = {}
+
+    def forget(key, task):
+        if chains.get(key) is task:
+            del chains[key]
+
+    while True:
+        item = await loop.run_in_executor(None, queue.get)
+        if item is None:
+            break
+        key, data = item
+        task = asyncio.create_task(_handle_after(chains.get(key), handle, data))
+        task.add_done_callback(lambda task, key=key: forget(key, task))
+        chains[key] = task
+
+    await asyncio.gather(*chains.values(), return_exceptions=True)
+
+
+async def _handle_after(previous, handle, data):
+    if previous is not None:
+        await asyncio.gather(previous, return_exceptions=True)
+    await handle(data)
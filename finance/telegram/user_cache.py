@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from finance.models import User
+
+# Сколько пользователей держать в кэше и сколько секунд доверять записи.
+# Сигналы сбрасывают запись только в процессе, где пользователя сохранили;
+# для других процессов (сайт, воркеры бота) единственная гарантия — TTL.
+USER_CACHE_SIZE = getattr(settings, 'BOT_USER_CACHE_SIZE', 10000)
+USER_CACHE_TTL = getattr(settings, 'BOT_USER_CACHE_TTL', 300)
+
+CachedUser = namedtuple(
+    'CachedUser',
+    ['id', 'username', 'telegram_linked', 'send_daily_report', 'send_weekly_report']
+)
+
+
+class UserCache:
+    """LRU-кэш telegram_id -> CachedUser с временем жизни записей"""
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # id пользователя -> telegram_id его записи, чтобы сбрасывать запись без перебора кэша
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id):
+        """Пользователь по telegram_id; User.DoesNotExist, если аккаунт не привязан"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        row = (
+            User.objects
+            .filter(telegram_id=telegram_id)
+            .values_list(*CachedUser._fields)
+            .first()
+        )
+        if row is None:
+            raise User.DoesNotExist(f"Нет пользователя с telegram_id={telegram_id}")
+
+        user = CachedUser(*row)
+        with self._lock:
+            # Запись под прежним telegram_id того же пользователя больше не нужна
+            self._remove(self._keys.get(user.id))
+            self._entries[telegram_id] = (user, now + self.ttl)
+            self._entries.move_to_end(telegram_id)
+            self._keys[user.id] = telegram_id
+            while len(self._entries) > self.maxsize:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._keys.pop(evicted.id, None)
+        return user
+
+    def _remove(self, telegram_id):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None:
+            self._keys.pop(entry[0].id, None)
+
+    def invalidate(self, telegram_id=None, user_id=None):
+        """Удаляет запись по telegram_id или по id пользователя.
+
+        Действует только на кэш этого процесса.
+        """
+        with self._lock:
+            if telegram_id is not None:
+                self._remove(telegram_id)
+            if user_id is not None:
+                self._remove(self._keys.get(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+user_cache = UserCache()
+
+
+def get_cached_user(telegram_id):
+    return user_cache.get(telegram_id)
@@ -0,0 +1,164 @@
+import asyncio
+import hmac
+import json
+from urllib.parse import urlparse
+
+from aiogram.types import Update
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Сколько обновлений обрабатывать одновременно и сколько держать в очереди.
+# При переполнении очереди Telegram получает 503 и повторит запрос позже.
+WEBHOOK_WORKERS = getattr(settings, 'TELEGRAM_WEBHOOK_WORKERS', 16)
+WEBHOOK_QUEUE_SIZE = getattr(settings, 'TELEGRAM_WEBHOOK_QUEUE_SIZE', 1000)
+SECRET_HEADER = b'x-telegram-bot-api-secret-token'
+
+
+def webhook_path():
+    """Путь, на который Telegram присылает обновления (из TELEGRAM_WEBHOOK_URL)"""
+    url = getattr(settings, 'TELEGRAM_WEBHOOK_URL', None)
+    return urlparse(url).path if url else None
+
+
+def webhook_secret():
+    """Секретный токен вебхука. Без него Telegram присылал бы обновления без
+    заголовка, а WebhookApp отвечал бы 403 на каждое — бот молча перестал бы работать
+    """
+    secret = getattr(settings, 'TELEGRAM_WEBHOOK_SECRET', None)
+    if not secret:
+        raise ImproperlyConfigured("TELEGRAM_WEBHOOK_SECRET обязателен, если задан TELEGRAM_WEBHOOK_URL")
+    return secret
+
+
+class WebhookApp:
+    """ASGI-приложение, принимающее обновления Telegram.
+
+    Запрос проверяется по секретному токену, обновление кладётся в очередь
+    и сразу подтверждается; обработчики выполняются в WEBHOOK_WORKERS задачах.
+    """
+
+    def __init__(self, dispatcher, bot, secret, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = None
+        self._tasks = []
+
+    async def start(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            await self.dispatcher.emit_startup(bot=self.bot)
+
+    async def stop(self):
+        """Дожидается обработки уже принятых обновлений и останавливает задачи"""
+        if self.queue is None:
+            return
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.queue = None
+        self._tasks = []
+        await self.dispatcher.emit_shutdown(bot=self.bot)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception as e:
+                print(f"❌ Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _authorized(self, scope):
+        if not self.secret:
+            return False
+        token = dict(scope['headers']).get(SECRET_HEADER, b'')
+        return hmac.compare_digest(token, self.secret.encode())
+
+    async def __call__(self, scope, receive, send):
+        if scope['method'] != 'POST':
+            return await _respond(send, 405)
+        if not self._authorized(scope):
+            return await _respond(send, 403)
+
+        body = await _read_body(receive)
+        try:
+            update = Update.model_validate(json.loads(body), context={'bot': self.bot})
+        except ValueError:
+            return await _respond(send, 400)
+
+        await self.start()
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return await _respond(send, 503)
+        await _respond(send, 200)
+
+
+class WebhookRouter:
+    """Отдаёт запросы на путь вебхука боту, остальные — приложению Django"""
+
+    def __init__(self, application, webhook, path):
+        self.application = application
+        self.webhook = webhook
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            return await self.webhook(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.webhook.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.webhook.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _respond(send, status):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain')],
+    })
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def with_webhook(application):
+    """Подключает вебхук бота к ASGI-приложению, если задан TELEGRAM_WEBHOOK_URL"""
+    path = webhook_path()
+    if not path:
+        return application
+
+    from finance.telegram.bot import bot, setup_dispatcher
+    from finance.telegram.sharding import BOT_WORKERS, sharded_dispatcher
+
+    secret = webhook_secret()
+    if BOT_WORKERS > 1:
+        # Обработка уходит в процессы по id чата; раскладывает одна задача,
+        # чтобы обновления чата попадали в очередь процесса по порядку
+        webhook = WebhookApp(sharded_dispatcher(BOT_WORKERS), bot, secret, workers=1)
+    else:
+        webhook = WebhookApp(setup_dispatcher(), bot, secret)
+    return WebhookRouter(application, webhook, path)
@@ -1,3 +1,1480 @@
-from django.test import TestCase
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import re
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Update
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from finance import chart_jobs, chart_worker, charts
+from finance.anomalies import detect_anomalies
+from finance.chart_data import MAX_POINTS, choose_bucket
+from finance.dataframes import iter_transaction_frames, transactions_frame
+from finance.forecasting import HISTORY_DAYS, forecast_budgets, project
+from finance.hierarchy import CategoryCycleError, CategoryTree, rebuild_closure, subtree_totals
+from finance.imports import run_import
+from finance.models import (
+    Anomaly, BudgetForecast, Category, CategoryClosure, CategoryRule, CategoryStats, DailyCategoryTotal, ImportJob,
+    MonthlyBudget, Recommendation, Transaction, User
+)
+from finance.recommendations import get_recommendations, refresh_recommendations
+from finance.reports import ReportFilterError, filters_hash, parse_filters, resolve_period, run_report
+from finance.rollups import apply_delta, verify_rollups
+from finance.summary import ALL_TIME, last_days_period, previous_days_period, summarize
+from finance.telegram import services
+from finance.telegram.category_index import CategoryEntry, CategoryIndex, CategoryIndexCache, category_indexes
+from finance.telegram.executor import DatabaseExecutor, DatabaseTimeout
+from finance.telegram.sender import send_messages
+from finance.telegram.sharding import UpdateSharder, _consume, shard_key
+from finance.telegram.user_cache import UserCache, user_cache
+from finance.telegram.webhook import WebhookApp, with_webhook
+
+
+class ReportQueryPlanTests(TestCase):
+    """Отчёты не должны читать таблицы операций целиком"""
+
+    # Таблицы, полный просмотр которых считается регрессией
+    watched_tables = ('finance_transaction', 'finance_dailycategorytotal')
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        for index in range(3):
+            user = User.objects.create_user(
+                username=f'user{index}',
+                password='password',
+                telegram_id=1000 + index,
+                telegram_linked=True
+            )
+            food = Category.objects.create(user=user, name='Еда')
+            salary = Category.objects.create(user=user, name='Зарплата', is_income=True)
+            for days in range(0, 60, 3):
+                Transaction.objects.create(
+                    user=user, category=food, amount=Decimal('150.00'), date=today - timedelta(days=days)
+                )
+            Transaction.objects.create(user=user, category=salary, amount=Decimal('50000.00'), date=today)
+            MonthlyBudget.objects.create(
+                user=user,
+                month=today.strftime('%Y-%m'),
+                planned_income=60000,
+                planned_expense=30000
+            )
+        cls.user = User.objects.get(username='user0')
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [row[-1] for row in cursor.fetchall()]
+
+        scans = []
+        for detail in details:
+            match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+            if match and match.group(1) in self.watched_tables:
+                scans.append(detail)
+        return scans
+
+    def assertNoFullScans(self, report):
+        with CaptureQueriesContext(connection) as context:
+            report()
+
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            scans = self.full_scans(sql)
+            self.assertEqual(scans, [], f'Полный просмотр таблицы в запросе:\n{sql}')
+
+    def test_bot_reports_use_indexes(self):
+        telegram_id = self.user.telegram_id
+        reports = [
+            services.get_today_report,
+            services.get_week_report,
+            services.get_detailed_today_report,
+            services.get_detailed_week_report,
+            services.compare_with_previous_week,
+            services.compare_with_previous_month,
+            services.get_budget_recommendations,
+        ]
+        for report in reports:
+            with self.subTest(report=report.__name__):
+                self.assertNoFullScans(lambda: report(telegram_id))
+
+    def test_web_reports_use_indexes(self):
+        self.client.force_login(self.user)
+        for url in (reverse('budget'), reverse('history') + '?period=month'):
+            with self.subTest(url=url):
+                self.assertNoFullScans(lambda: self.client.get(url))
+
+
+class RollupTests(TestCase):
+    """Дневная сводка DailyCategoryTotal следует за операциями"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='rollup', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.taxi = Category.objects.create(user=self.user, name='Такси')
+        self.day = date(2025, 3, 1)
+
+    def rollup(self):
+        return sorted(
+            DailyCategoryTotal.objects.filter(user=self.user).values_list('category__name', 'date', 'total', 'count')
+        )
+
+    def test_stays_in_sync_with_operations(self):
+        operation = Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('100'), date=self.day)
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('50'), date=self.day)
+        self.assertEqual(self.rollup(), [('Еда', self.day, Decimal('150.00'), 2)])
+
+        operation.amount = Decimal('120')
+        operation.save()
+        self.assertEqual(self.rollup(), [('Еда', self.day, Decimal('170.00'), 2)])
+
+        operation.category = self.taxi
+        operation.save()
+        self.assertEqual(self.rollup(), [
+            ('Еда', self.day, Decimal('50.00'), 1), ('Такси', self.day, Decimal('120.00'), 1),
+        ])
+
+        operation.date = self.day + timedelta(days=1)
+        operation.save()
+        self.assertEqual(self.rollup(), [
+            ('Еда', self.day, Decimal('50.00'), 1), ('Такси', self.day + timedelta(days=1), Decimal('120.00'), 1),
+        ])
+
+        operation.delete()
+        self.assertEqual(self.rollup(), [('Еда', self.day, Decimal('50.00'), 1)])
+        self.assertEqual(verify_rollups([self.user.pk]), [])
+
+    def test_subtraction_never_creates_rows(self):
+        apply_delta(self.user.pk, self.food.pk, self.day, Decimal('-100'), -1)
+        self.assertEqual(self.rollup(), [])
+
+    def test_verify_command(self):
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('100'), date=self.day)
+        call_command('rebuild_rollups', verify=True, stdout=StringIO())
+
+        DailyCategoryTotal.objects.filter(user=self.user).update(total=Decimal('1'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', verify=True, user_ids=[self.user.pk], stdout=StringIO())
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        call_command('rebuild_rollups', verify=True, stdout=StringIO())
+
+
+class PeriodSummaryTests(TestCase):
+    """Итоги за периоды одним запросом"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='summary', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.today = date(2025, 3, 20)
+        for days, amount in ((0, '1'), (7, '10'), (8, '100'), (14, '1000'), (15, '10000')):
+            Transaction.objects.create(
+                user=self.user, category=self.food, amount=Decimal(amount), date=self.today - timedelta(days=days)
+            )
+
+    def test_last_days_bounds(self):
+        period = last_days_period(self.today, 7)
+        self.assertEqual(period, (self.today - timedelta(days=7), self.today + timedelta(days=1)))
+        # Предыдущий отрезок примыкает к текущему без пересечения
+        self.assertEqual(previous_days_period(self.today, 7).end, period.start)
+
+        summaries = summarize(self.user, {
+            'current': period,
+            'previous': previous_days_period(self.today, 7),
+            'all': ALL_TIME,
+        })
+        self.assertEqual(summaries['current'].expense, Decimal('11'))
+        self.assertEqual(summaries['previous'].expense, Decimal('1100'))
+        self.assertEqual(summaries['all'].expense, Decimal('11111'))
+        self.assertEqual(summaries['current'].expense_by_category, {'Еда': Decimal('11')})
+
+
+class ChartCacheTests(TestCase):
+    """Кэш PNG-графиков по версии данных"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='charts', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('150'), date=date.today())
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = Path(directory.name)
+        patcher = mock.patch.object(charts, 'CHART_CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_hit_and_invalidation(self):
+        user = User.objects.get(pk=self.user.pk)
+        self.assertIsNone(charts.get_cached_chart(user, 'category_pie'))
+        version = charts.chart_version(user, 'category_pie')
+        url = charts.get_chart(user, 'category_pie')
+        self.assertTrue(url.endswith('.png'))
+
+        # Повторный запрос той же версии не рисует и не обращается к БД
+        with self.assertNumQueries(0):
+            self.assertEqual(charts.get_chart(user, 'category_pie'), url)
+
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('50'), date=date.today())
+        user = User.objects.get(pk=self.user.pk)
+        self.assertNotEqual(charts.chart_version(user, 'category_pie'), version)
+        self.assertIsNone(charts.get_cached_chart(user, 'category_pie'))
+
+        new_url = charts.get_chart(user, 'category_pie')
+        self.assertNotEqual(new_url, url)
+        # Прежняя версия графика удалена из кэша
+        self.assertEqual([path.name for path in self.cache_dir.glob('*.png')], [new_url.rsplit('/', 1)[-1]])
+
+
+class ChartApiTests(TestCase):
+    """JSON-данные графиков"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='chartapi', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('150'), date=date.today())
+        self.client.force_login(self.user)
+
+    def test_etag_and_not_modified(self):
+        url = reverse('api_chart_income_expense')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Данные не менялись: тот же ETag, ответ без тела
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('api_chart_categories'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('50'), date=date.today())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['expense'], [200.0])
+
+    def test_bucket_coarsening(self):
+        # Без данных интервал не меняется; auto начинается с дня
+        self.assertEqual(choose_bucket(self.user, 'auto'), 'day')
+        self.assertEqual(choose_bucket(self.user, 'unknown'), 'month')
+
+        # Два года по дням — больше MAX_POINTS точек, интервал укрупняется до недели
+        Transaction.objects.create(
+            user=self.user, category=self.food, amount=Decimal('10'), date=date.today() - timedelta(days=730)
+        )
+        self.assertEqual(choose_bucket(self.user, 'day'), 'week')
+        self.assertEqual(choose_bucket(self.user, 'quarter'), 'quarter')
+
+        response = self.client.get(reverse('api_chart_income_expense'), {'bucket': 'day'})
+        series = response.json()
+        self.assertEqual(series['bucket'], 'week')
+        self.assertLessEqual(len(series['labels']), MAX_POINTS)
+
+
+class ChartJobTests(SimpleTestCase):
+    """Фоновая отрисовка графиков в пуле процессов"""
+
+    def setUp(self):
+        patcher = mock.patch.multiple(chart_jobs, _executor=None, _broken_at=None, _jobs={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_job_runs_in_spawn_pool(self):
+        user = User(pk=987654, data_version=3)
+        key = (user.pk, 'category_pie', charts.chart_version(user, 'category_pie'))
+        # Готовый файл: задача проходит через настоящий пул, не обращаясь к БД
+        path = charts.CHART_CACHE_DIR / charts.chart_filename(*key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+        self.addCleanup(path.unlink, missing_ok=True)
+
+        future = chart_jobs.schedule_chart(user, 'category_pie')
+        self.addCleanup(lambda: chart_jobs._executor.shutdown(wait=True))
+        self.assertEqual(future.result(timeout=120), charts.chart_url(path.name))
+        self.assertIs(chart_jobs.schedule_chart(user, 'category_pie'), future)
+
+    def test_broken_pool_is_not_recreated_on_every_poll(self):
+        broken = mock.Mock(**{'submit.side_effect': BrokenProcessPool('пул упал')})
+        chart_jobs._executor = broken
+        user = User(pk=987655, data_version=1)
+
+        with mock.patch.object(chart_jobs, 'ProcessPoolExecutor') as pool_class:
+            for _ in range(3):
+                self.assertEqual(chart_jobs.chart_status(user, 'category_pie')['status'], 'error')
+            self.assertEqual(broken.submit.call_count, 1)
+            pool_class.assert_not_called()
+
+            # После паузы пул создаётся заново и задача ставится ещё раз
+            chart_jobs._broken_at -= chart_jobs.CHART_POOL_RESTART_DELAY
+            chart_jobs.schedule_chart(user, 'category_pie')
+            pool_class.assert_called_once()
+            pool_class.return_value.submit.assert_called_once_with(
+                chart_worker.render, user.pk, 'category_pie', '1'
+            )
+            broken.shutdown.assert_called_once()
+
+
+class TransactionFrameTests(TestCase):
+    """Загрузка операций в DataFrame"""
+
+    columns = ['id', 'date', 'amount', 'is_income', 'category']
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='frames', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.salary = Category.objects.create(user=self.user, name='Зарплата', is_income=True)
+        self.day = date(2025, 3, 1)
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('100.05'), date=self.day)
+        Transaction.objects.create(
+            user=self.user, category=self.salary, amount=Decimal('50000'), date=self.day + timedelta(days=1)
+        )
+        Transaction.objects.create(
+            user=self.user, category=self.food, amount=Decimal('0.10'), date=self.day + timedelta(days=2)
+        )
+
+    def operations(self):
+        return Transaction.objects.filter(user=self.user).order_by('pk')
+
+    def assertTyped(self, frame):
+        self.assertEqual(list(frame.columns), self.columns)
+        self.assertTrue(np.issubdtype(frame['date'].dtype, np.datetime64))
+        self.assertEqual(frame['amount'].dtype, np.int64)
+        self.assertEqual(frame['is_income'].dtype, np.bool_)
+        self.assertTrue(pd.api.types.is_string_dtype(frame['category']))
+
+    def test_types_and_join(self):
+        frame = transactions_frame(self.operations(), self.columns).sort_values('id')
+        self.assertTyped(frame)
+        # Суммы в копейках, название категории приходит из JOIN в том же запросе
+        self.assertEqual(frame['amount'].tolist(), [10005, 5000000, 10])
+        self.assertEqual(frame['category'].tolist(), ['Еда', 'Зарплата', 'Еда'])
+        self.assertEqual(frame['is_income'].tolist(), [False, True, False])
+        self.assertEqual(frame['date'].iloc[0], pd.Timestamp(self.day))
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            transactions_frame(self.operations(), self.columns)
+
+    def test_chunks(self):
+        frames = list(iter_transaction_frames(self.operations(), self.columns, chunk_size=2))
+        self.assertEqual([len(frame) for frame in frames], [2, 1])
+        for frame in frames:
+            self.assertTyped(frame)
+        combined = pd.concat(frames).sort_values('id')
+        pd.testing.assert_frame_equal(
+            combined.reset_index(drop=True),
+            transactions_frame(self.operations(), self.columns).sort_values('id').reset_index(drop=True)
+        )
+
+    def test_empty(self):
+        frame = transactions_frame(Transaction.objects.none(), self.columns)
+        self.assertTrue(frame.empty)
+        self.assertTyped(frame)
+        self.assertEqual(list(iter_transaction_frames(Transaction.objects.none(), self.columns)), [])
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            transactions_frame(self.operations(), ['amount', 'password'])
+
+
+class HomePageTests(TestCase):
+    """Главная страница"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='home', password='password')
+        food = Category.objects.create(user=self.user, name='Еда')
+        Transaction.objects.create(user=self.user, category=food, amount=Decimal('150.00'), date=date.today())
+
+    def test_renders_for_logged_in_user(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'id="chart-income-expense"')
+        self.assertContains(response, 'Еда')
+
+
+class FakeBotAPI:
+    """Локальный сервер, отвечающий как Bot API на sendMessage"""
+
+    def __init__(self, flood_chats=(), retry_after=1, throttled_chats=()):
+        # Чаты, для которых первый запрос получает 429; retry_after=None — ответ без срока.
+        # throttled_chats получают 429 на каждый запрос
+        self.flood_chats = set(flood_chats)
+        self.throttled_chats = set(throttled_chats)
+        self.retry_after = retry_after
+        self.delivered = []
+
+    async def send_message(self, request):
+        data = await request.post()
+        chat_id = int(data['chat_id'])
+        if chat_id in self.flood_chats or chat_id in self.throttled_chats:
+            self.flood_chats.discard(chat_id)
+            error = {'ok': False, 'error_code': 429, 'description': 'Too Many Requests'}
+            if self.retry_after is not None:
+                error['description'] += f': retry after {self.retry_after}'
+                error['parameters'] = {'retry_after': self.retry_after}
+            return web.json_response(error, status=429)
+
+        self.delivered.append(chat_id)
+        return web.json_response({
+            'ok': True,
+            'result': {
+                'message_id': len(self.delivered),
+                'date': 0,
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': data['text'],
+            },
+        })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/sendMessage', self.send_message)
+        return app
+
+
+class MessageSenderTests(SimpleTestCase):
+    """Рассылка через локальный поддельный Bot API"""
+
+    def run_against_fake_api(self, fake_api, messages, **options):
+        async def scenario():
+            server = TestServer(fake_api.app())
+            await server.start_server()
+            session = AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url(''))))
+            bot = Bot(token='42:TEST', session=session)
+            try:
+                return await send_messages(bot, messages, **options)
+            finally:
+                await session.close()
+                await server.close()
+
+        return asyncio.run(scenario())
+
+    def test_sends_every_message(self):
+        fake_api = FakeBotAPI()
+        messages = [(chat_id, 'отчёт') for chat_id in range(1, 51)]
+
+        stats = self.run_against_fake_api(fake_api, messages, concurrency=10, global_rate=1000)
+
+        self.assertEqual(stats.sent, 50)
+        self.assertEqual(stats.failed, 0)
+        self.assertEqual(sorted(fake_api.delivered), list(range(1, 51)))
+
+    def test_retries_after_flood_control(self):
+        fake_api = FakeBotAPI(flood_chats={3, 7})
+        messages = [(chat_id, 'отчёт') for chat_id in range(1, 11)]
+
+        stats = self.run_against_fake_api(fake_api, messages, concurrency=4, global_rate=1000)
+
+        self.assertEqual(stats.sent, 10)
+        self.assertEqual(stats.retried, 2)
+        self.assertEqual(sorted(fake_api.delivered), list(range(1, 11)))
+
+    def test_retries_flood_control_without_retry_after(self):
+        fake_api = FakeBotAPI(flood_chats={5}, retry_after=None)
+        messages = [(chat_id, 'отчёт') for chat_id in range(1, 6)]
+
+        stats = self.run_against_fake_api(fake_api, messages, concurrency=2, global_rate=1000)
+
+        self.assertEqual(stats.sent, 5)
+        self.assertEqual(stats.failed, 0)
+        self.assertEqual(stats.retried, 1)
+
+    def test_gives_up_on_throttled_chat(self):
+        # Чат под постоянным ограничением не держит рассылку бесконечно
+        fake_api = FakeBotAPI(throttled_chats={2})
+        messages = [(chat_id, 'отчёт') for chat_id in range(1, 4)]
+
+        stats = self.run_against_fake_api(fake_api, messages, concurrency=2, global_rate=1000, max_retries=1)
+
+        self.assertEqual(stats.sent, 2)
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(stats.retried, 1)
+        self.assertEqual(sorted(fake_api.delivered), [1, 3])
+
+    def test_global_rate_limit(self):
+        fake_api = FakeBotAPI()
+        messages = [(chat_id, 'отчёт') for chat_id in range(1, 21)]
+
+        stats = self.run_against_fake_api(fake_api, messages, concurrency=20, global_rate=10)
+
+        # 10 сообщений уходят сразу, остальные 10 — со скоростью 10 в секунду
+        self.assertGreaterEqual(stats.elapsed, 0.9)
+        self.assertEqual(stats.sent, 20)
+
+
+class UserCacheTests(TestCase):
+    """Кэш пользователей бота по telegram_id"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached', password='password', telegram_id=777)
+        self.cache = UserCache(maxsize=2, ttl=60)
+
+    def test_hit_after_first_lookup(self):
+        self.cache.get(777)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(777).username, 'cached')
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_saving_user_invalidates_entry(self):
+        user_cache.clear()
+        user_cache.get(777)
+        self.user.send_daily_report = not self.user.send_daily_report
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(user_cache.get(777).send_daily_report, self.user.send_daily_report)
+
+    def test_invalidate_by_user_id(self):
+        self.cache.get(777)
+        # Пользователь перепривязал Telegram: старая запись вытесняется новой
+        User.objects.filter(pk=self.user.pk).update(telegram_id=778)
+        self.cache.get(778)
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+        self.cache.invalidate(user_id=self.user.pk)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_eviction_forgets_user(self):
+        other = User.objects.create_user(username='other', password='password', telegram_id=888)
+        third = User.objects.create_user(username='third', password='password', telegram_id=999)
+        for telegram_id in (777, 888, 999):
+            self.cache.get(telegram_id)
+
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.cache.invalidate(user_id=other.pk)
+        self.cache.invalidate(user_id=self.user.pk)
+        self.assertEqual(self.cache.stats()['size'], 1)
+        self.assertEqual(self.cache.get(999).id, third.pk)
+
+
+class CategoryIndexTests(SimpleTestCase):
+    """Поиск категории по названию из команды /add"""
+
+    def setUp(self):
+        self.index = CategoryIndex([
+            CategoryEntry(1, 'Еда', False),
+            CategoryEntry(2, 'Транспорт', False),
+            CategoryEntry(3, 'Такси', False),
+            CategoryEntry(4, 'Зарплата', True),
+        ])
+
+    def test_exact_match_ignores_case_and_spaces(self):
+        self.assertEqual(self.index.resolve('  ЕДА ')[0].id, 1)
+
+    def test_prefix_only_suggests(self):
+        self.assertEqual(self.index.resolve('зарп'), (None, [CategoryEntry(4, 'Зарплата', True)]))
+
+    def test_ambiguous_prefix_gives_suggestions(self):
+        category, suggestions = self.index.resolve('т')
+        self.assertIsNone(category)
+        self.assertEqual({c.id for c in suggestions}, {2, 3})
+
+    def test_typo_only_suggests(self):
+        category, suggestions = self.index.resolve('Транспрот')
+        self.assertIsNone(category)
+        self.assertEqual([c.id for c in suggestions], [2])
+
+    def test_rename_replaces_old_name(self):
+        self.index.add(CategoryEntry(3, 'Такси и каршеринг', False))
+        self.assertEqual(self.index.get('Такси'), [])
+        self.assertEqual(self.index.resolve('такси и  каршеринг')[0].id, 3)
+
+    def test_income_and_expense_with_same_name(self):
+        self.index.add(CategoryEntry(5, 'Подарки', False))
+        self.index.add(CategoryEntry(6, 'Подарки', True))
+
+        category, suggestions = self.index.resolve('подарки')
+        self.assertIsNone(category)
+        self.assertEqual({c.id for c in suggestions}, {5, 6})
+        self.assertEqual(self.index.resolve('подарки', is_income=True)[0].id, 6)
+
+        self.index.remove(5)
+        self.assertEqual(self.index.resolve('подарки')[0].id, 6)
+
+    def test_cache_changes_copy_the_index(self):
+        # Читатель, уже получивший индекс, не видит изменений посреди поиска
+        indexes = CategoryIndexCache()
+        indexes._indexes[7] = (self.index, time.monotonic() + 60)
+
+        indexes.category_saved(Category(pk=3, user_id=7, name='Такси и каршеринг', is_income=False))
+        indexes.category_deleted(Category(pk=1, user_id=7, name='Еда'))
+
+        self.assertEqual(self.index.resolve('такси')[0].id, 3)
+        self.assertEqual(self.index.resolve('еда')[0].id, 1)
+        updated = indexes.get(7)
+        self.assertIsNot(updated, self.index)
+        self.assertEqual(updated.get('такси'), [])
+        self.assertEqual(updated.resolve('такси и каршеринг')[0].id, 3)
+        self.assertEqual(updated.get('еда'), [])
+
+
+class AddCommandTests(TestCase):
+    """Команда /add бота"""
+
+    def setUp(self):
+        category_indexes.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user(username='bot', password='password', telegram_id=555)
+        self.taxi = Category.objects.create(user=self.user, name='Такси')
+        Category.objects.create(user=self.user, name='Подарки')
+        self.gifts = Category.objects.create(user=self.user, name='Подарки', is_income=True)
+
+    def test_exact_name(self):
+        self.assertTrue(services.process_add_command(555, 300.0, 'такси', 'домой').startswith('✅'))
+        self.assertEqual(Transaction.objects.get().category, self.taxi)
+
+    def test_similar_name_is_only_suggested(self):
+        reply = services.process_add_command(555, 300.0, 'Такс', 'домой')
+        self.assertIn('/add 300.0 Такси домой', reply)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_same_name_needs_type(self):
+        reply = services.process_add_command(555, 1000.0, 'Подарки', '')
+        self.assertIn('+Подарки', reply)
+        self.assertFalse(Transaction.objects.exists())
+
+        services.process_add_command(555, 1000.0, '+Подарки', '')
+        self.assertEqual(Transaction.objects.get().category, self.gifts)
+
+
+class ScheduledReportTests(TestCase):
+    """Ежедневные и еженедельные отчёты бота"""
+
+    def setUp(self):
+        self.today = date(2025, 3, 12)
+        self.user = User.objects.create_user(username='reports', password='password', telegram_id=701,
+                                             telegram_linked=True)
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.taxi = Category.objects.create(user=self.user, name='Такси')
+        self.salary = Category.objects.create(user=self.user, name='Зарплата', is_income=True)
+        User.objects.create_user(username='idle', password='password', telegram_id=702, telegram_linked=True)
+        User.objects.create_user(username='quiet', password='password', telegram_id=703, telegram_linked=True,
+                                 send_daily_report=False, send_weekly_report=False)
+        User.objects.create_user(username='unlinked', password='password', telegram_id=704)
+
+    def add(self, category, amount, days_ago=0):
+        Transaction.objects.create(
+            user=self.user, category=category, amount=Decimal(amount), date=self.today - timedelta(days=days_ago)
+        )
+
+    def amounts(self, text):
+        """Строки отчёта как (подпись, сумма): число знаков после запятой зависит от СУБД"""
+        lines = []
+        for line in text.splitlines():
+            label, _, value = line.partition(': ')
+            lines.append((label.rstrip(':'), Decimal(value.split()[0]) if value else None))
+        return lines
+
+    def test_daily_reports(self):
+        self.add(self.food, '150')
+        self.add(self.food, '50')
+        self.add(self.taxi, '300')
+        self.add(self.salary, '1000')
+        self.add(self.taxi, '999', days_ago=1)
+
+        reports = dict(services.prepare_daily_reports(self.today))
+        # Только привязанные пользователи с подпиской, доходы и вчерашние траты не входят
+        self.assertEqual(set(reports), {701, 702})
+        self.assertEqual(self.amounts(reports[701]), [
+            ('📅 Ежедневный отчёт', None), ('Сегодня потрачено', Decimal('500')),
+            ('• Еда', Decimal('200')), ('• Такси', Decimal('300')),
+        ])
+        self.assertEqual(reports[702], "📅 Ежедневный отчёт:\nСегодня потрачено: 0 ₽")
+
+    def test_weekly_reports(self):
+        # Неделя — семь полных дней до вчерашнего; сегодняшние траты войдут в следующий отчёт
+        self.add(self.food, '5000')
+        self.add(self.food, '200', days_ago=1)
+        self.add(self.taxi, '300', days_ago=7)
+        self.add(self.salary, '1000', days_ago=2)
+        # Прошлая неделя — семь дней перед ней, более ранние траты не учитываются
+        self.add(self.taxi, '900', days_ago=8)
+        self.add(self.taxi, '99', days_ago=14)
+        self.add(self.food, '50', days_ago=15)
+
+        reports = dict(services.prepare_weekly_reports(self.today))
+        self.assertEqual(set(reports), {701, 702})
+        self.assertEqual(self.amounts(reports[701]), [
+            ('🗓 Еженедельный отчёт', None), ('Доходы', Decimal('1000')), ('Расходы', Decimal('500')),
+            ('Больше всего потрачено', None), ('• Такси', Decimal('300')), ('• Еда', Decimal('200')),
+            ('Прошлая неделя', Decimal('999')), ('Вы сэкономили 499.00 ₽! 🎉', None),
+        ])
+        self.assertTrue(reports[702].endswith("Расходы одинаковы. 🟰"))
+
+    def test_format_weekly_report(self):
+        rows = [
+            (701, 'Еда', Decimal('100'), Decimal('50'), None),
+            (701, 'Такси', Decimal('300'), None, None),
+            (701, 'Кино', Decimal('200'), None, None),
+            (701, 'Книги', Decimal('50'), None, None),
+            (701, 'Зарплата', None, None, Decimal('1000')),
+        ]
+        report = services.format_weekly_report(rows)
+        # В топ попадают три крупнейшие категории по убыванию
+        self.assertIn("• Такси: 300 ₽\n• Кино: 200 ₽\n• Еда: 100 ₽\nПрошлая неделя", report)
+        self.assertNotIn('Книги', report)
+        self.assertIn("Доходы: 1000 ₽\nРасходы: 650 ₽", report)
+        self.assertTrue(report.endswith("Вы потратили на 600.00 ₽ больше. 💸"))
+
+        report = services.format_weekly_report([(702, None, None, None, None)])
+        self.assertNotIn('Больше всего потрачено', report)
+        self.assertTrue(report.endswith("Расходы одинаковы. 🟰"))
+
+
+class DatabaseExecutorTests(SimpleTestCase):
+    """Пул потоков для запросов бота к БД"""
+
+    def test_calls_run_in_parallel(self):
+        executor = DatabaseExecutor(max_workers=4, timeout=5)
+
+        async def scenario():
+            started = time.monotonic()
+            await asyncio.gather(*(executor.run(time.sleep, 0.2) for _ in range(4)))
+            return time.monotonic() - started
+
+        try:
+            elapsed = asyncio.run(scenario())
+        finally:
+            executor.shutdown()
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(executor.stats()['completed'], 4)
+
+    def test_timeout(self):
+        executor = DatabaseExecutor(max_workers=1, timeout=5)
+        try:
+            with self.assertRaises(DatabaseTimeout):
+                asyncio.run(executor.run(time.sleep, 0.5, timeout=0.05))
+        finally:
+            executor.shutdown()
+        self.assertEqual(executor.stats()['timeouts'], 1)
+
+    def test_writes_wait_for_completion(self):
+        # Изменения данных не прерываются по тайм-ауту: повтор команды создал бы дубль
+        executor = DatabaseExecutor(max_workers=1, timeout=0.05)
+        try:
+            result = asyncio.run(executor.run_write(lambda: time.sleep(0.3) or 'готово'))
+        finally:
+            executor.shutdown()
+        self.assertEqual(result, 'готово')
+        self.assertEqual(executor.stats()['timeouts'], 0)
+
+
+# Обновление в том виде, в каком его присылает Telegram
+RECORDED_UPDATE = {
+    'update_id': 100,
+    'message': {
+        'message_id': 1,
+        'date': 1700000000,
+        'chat': {'id': 555, 'type': 'private'},
+        'from': {'id': 555, 'is_bot': False, 'first_name': 'Тест'},
+        'text': '/today',
+    },
+}
+
+
+class WebhookTests(SimpleTestCase):
+    """Приём обновлений через ASGI-вебхук"""
+
+    def setUp(self):
+        self.received = []
+        router = Router()
+
+        @router.message()
+        async def remember(message):
+            self.received.append(message.text)
+
+        dispatcher = Dispatcher()
+        dispatcher.include_router(router)
+        self.webhook = WebhookApp(dispatcher, Bot(token='42:TEST'), secret='s3cret', workers=4)
+
+    def post(self, updates, secret='s3cret'):
+        """Отправляет записанные обновления в приложение и возвращает статусы ответов"""
+        async def call(update):
+            messages = [{'type': 'http.request', 'body': json.dumps(update).encode()}]
+            statuses = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            scope = {
+                'type': 'http',
+                'method': 'POST',
+                'path': '/telegram/webhook/',
+                'headers': [(b'x-telegram-bot-api-secret-token', secret.encode())],
+            }
+            await self.webhook(scope, receive, send)
+            return statuses[0]
+
+        async def scenario():
+            statuses = [await call(update) for update in updates]
+            await self.webhook.stop()
+            return statuses
+
+        return asyncio.run(scenario())
+
+    def test_replay_updates(self):
+        updates = []
+        for update_id in range(10):
+            update = json.loads(json.dumps(RECORDED_UPDATE))
+            update['update_id'] = update_id
+            update['message']['text'] = f'/add {update_id} Еда'
+            updates.append(update)
+
+        self.assertEqual(self.post(updates), [200] * 10)
+        self.assertEqual(sorted(self.received), sorted(u['message']['text'] for u in updates))
+
+    def test_rejects_wrong_secret(self):
+        self.assertEqual(self.post([RECORDED_UPDATE], secret='wrong'), [403])
+        self.assertEqual(self.received, [])
+
+    def test_rejects_invalid_update(self):
+        self.assertEqual(self.post([{'message': 'oops'}]), [400])
+
+    @override_settings(TELEGRAM_WEBHOOK_URL='https://example.com/telegram/', TELEGRAM_WEBHOOK_SECRET=None)
+    def test_requires_secret(self):
+        # Без секрета каждое обновление получало бы 403: лучше не запускаться
+        from finance.telegram.bot import start_webhook_mode
+
+        with self.assertRaises(ImproperlyConfigured):
+            with_webhook(lambda scope, receive, send: None)
+        with self.assertRaises(ImproperlyConfigured):
+            asyncio.run(start_webhook_mode())
+
+
+def chat_update(update_id, chat_id):
+    update = json.loads(json.dumps(RECORDED_UPDATE))
+    update['update_id'] = update_id
+    update['message']['chat']['id'] = chat_id
+    update['message']['from']['id'] = chat_id
+    return Update.model_validate(update)
+
+
+def recording_worker(results):
+    """Процесс-обработчик для тестов: записывает (процесс, чат, update_id) по порядку"""
+    def target(index, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            time.sleep(0.005)
+            results.put((index, item[0], item[1]['update_id']))
+    return target
+
+
+class UpdateShardingTests(SimpleTestCase):
+    """Раздача обновлений бота по процессам"""
+
+    def test_shard_key_is_chat(self):
+        callback = Update.model_validate({
+            'update_id': 1,
+            'callback_query': {
+                'id': '1',
+                'from': {'id': 7, 'is_bot': False, 'first_name': 'Тест'},
+                'chat_instance': '1',
+                'data': 'x',
+                'message': {
+                    'message_id': 1, 'date': 1700000000,
+                    'chat': {'id': -100, 'type': 'group'}, 'text': 'кнопки',
+                },
+            },
+        })
+        self.assertEqual(shard_key(chat_update(1, 555)), 555)
+        self.assertEqual(shard_key(callback), -100)
+
+    def test_routes_by_chat_and_drains_on_stop(self):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest('Нужен start method fork')
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        # Маленькая очередь заставляет submit ждать места
+        sharder = UpdateSharder(workers=3, queue_size=2, target=recording_worker(results), start_method='fork')
+        chats = [11, 12, 13, 14, 15]
+
+        async def scenario():
+            await sharder.start()
+            for update_id in range(40):
+                await sharder.submit(chat_update(update_id, chats[update_id % len(chats)]))
+            await sharder.stop()
+
+        asyncio.run(scenario())
+        processed = [results.get(timeout=5) for _ in range(40)]
+
+        self.assertEqual(sorted(update_id for _, _, update_id in processed), list(range(40)))
+        for chat_id in chats:
+            handled = [(index, update_id) for index, key, update_id in processed if key == chat_id]
+            self.assertEqual({index for index, _ in handled}, {chat_id % 3})
+            self.assertEqual([update_id for _, update_id in handled], list(range(chats.index(chat_id), 40, 5)))
+
+    def test_chat_updates_are_handled_in_order(self):
+        done = []
+
+        async def handle(data):
+            # Первое обновление чата 1 обрабатывается дольше остальных
+            await asyncio.sleep(0.05 if data['id'] == 'a' else 0)
+            done.append(data['id'])
+
+        items = queue.Queue()
+        for item in [(1, {'id': 'a'}), (1, {'id': 'b'}), (2, {'id': 'c'}), None]:
+            items.put(item)
+
+        asyncio.run(_consume(items, handle))
+
+        # Чат 2 не ждёт чат 1, а внутри чата 1 порядок сохранён; всё обработано до выхода
+        self.assertEqual(done, ['c', 'a', 'b'])
+
+
+class StatementImportTests(TestCase):
+    """Импорт выписки из CSV"""
+
+    statement = (
+        "Дата;Сумма;Описание\n"
+        "01.03.2025;-350,50;Пятёрочка\n"
+        "01.03.2025;-350,50;Пятёрочка\n"
+        "02.03.2025;-120;Метро\n"
+        "05.03.2025;50 000,00;Зарплата\n"
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        CategoryRule.objects.create(user=self.user, pattern='пятёрочка', category=self.food)
+
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.statement)
+        self.addCleanup(os.remove, self.path)
+
+    def run_import(self):
+        job = ImportJob.objects.create(user=self.user, file_name='statement.csv')
+        return run_import(job.pk, self.path)
+
+    def test_import(self):
+        job = self.run_import()
+
+        self.assertEqual(job.status, ImportJob.STATUS_DONE, job.error)
+        self.assertEqual(job.imported_rows, 4)
+        self.assertEqual(Transaction.objects.filter(user=self.user, category=self.food).count(), 2)
+        salary = Transaction.objects.get(user=self.user, category__is_income=True)
+        self.assertEqual(salary.amount, Decimal('50000.00'))
+        self.assertEqual(salary.category.name, 'Прочие доходы')
+        self.assertEqual(verify_rollups([self.user.pk]), [])
+        # Статистика категорий для проверки на аномалии учитывает импорт
+        stats = CategoryStats.objects.get(category=self.food)
+        self.assertEqual((stats.count, stats.mean), (2, 350.5))
+
+    def test_reimport_skips_existing_rows(self):
+        self.run_import()
+        job = self.run_import()
+
+        self.assertEqual(job.imported_rows, 0)
+        self.assertEqual(job.skipped_rows, 4)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 4)
+
+    def write_statement(self, text):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_unsorted_duplicates_are_kept(self):
+        self.write_statement(
+            "Дата;Сумма;Описание\n"
+            "01.03.2025;-100;Кофе\n"
+            "02.03.2025;-120;Метро\n"
+            "01.03.2025;-100;Кофе\n"
+        )
+        self.assertEqual(self.run_import().imported_rows, 3)
+        self.assertEqual(self.run_import().imported_rows, 0)
+
+    def test_failed_import_resumes(self):
+        broken = self.statement + "06.03.2025;много;Ошибка\n"
+        self.write_statement(broken)
+        job = ImportJob.objects.create(user=self.user, file_name='statement.csv')
+        job = run_import(job.pk, self.path, batch_size=2)
+
+        self.assertEqual(job.status, ImportJob.STATUS_FAILED)
+        self.assertIn('Строка 5', job.error)
+        self.assertEqual(job.imported_rows, 4)
+
+        self.write_statement(self.statement + "06.03.2025;-99;Аптека\n")
+        job = self.run_import()
+        self.assertEqual(job.imported_rows, 1)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(verify_rollups([self.user.pk]), [])
+
+    def test_stale_job_is_failed(self):
+        job = ImportJob.objects.create(user=self.user, file_name='statement.csv', status=ImportJob.STATUS_RUNNING)
+        fresh = ImportJob.objects.create(user=self.user, file_name='new.csv', status=ImportJob.STATUS_RUNNING)
+        ImportJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('import_status', args=[job.pk]))
+
+        self.assertEqual(response.json()['status'], ImportJob.STATUS_FAILED)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, ImportJob.STATUS_RUNNING)
+
+
+class HistoryExportTests(TestCase):
+    """Выгрузка истории операций"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter', password='password')
+        food = Category.objects.create(user=self.user, name='Еда')
+        today = timezone.now().date()
+        Transaction.objects.create(user=self.user, category=food, amount=Decimal('100.00'), date=today)
+        Transaction.objects.create(
+            user=self.user, category=food, amount=Decimal('200.00'), date=today - timedelta(days=400)
+        )
+        self.client.force_login(self.user)
+
+    def test_csv_respects_period(self):
+        response = self.client.get(reverse('export_history', args=['csv']) + '?period=month')
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+
+        lines = content.strip().splitlines()
+        self.assertEqual(lines[0], 'Дата,Тип,Сумма,Категория,Описание')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('100.00,Еда', lines[1])
+        self.assertRegex(response['Content-Disposition'], r'filename="operations_month_[\d-]+\.csv"')
+
+    def test_filename_ignores_unknown_period(self):
+        response = self.client.get(reverse('export_history', args=['csv']), {'period': 'x"; evil=1'})
+        self.assertRegex(response['Content-Disposition'], r'^attachment; filename="operations_all_[\d-]+\.csv"$')
+
+    def test_xlsx(self):
+        response = self.client.get(reverse('export_history', args=['xlsx']))
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'PK'))
+
+
+class HistoryPaginationTests(TestCase):
+    """Постраничная история по курсору"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        food = Category.objects.create(user=cls.user, name='Еда')
+        today = timezone.now().date()
+        for index in range(120):
+            Transaction.objects.create(
+                user=cls.user, category=food, amount=Decimal(index + 1), date=today - timedelta(days=index // 3)
+            )
+
+    def test_pages_cover_history_once(self):
+        self.client.force_login(self.user)
+        seen = []
+        url = reverse('history')
+        while url:
+            response = self.client.get(url)
+            seen.extend(op.pk for op in response.context['transactions'])
+            cursor = response.context['next_cursor']
+            url = f"{reverse('history')}?cursor={cursor}" if cursor else None
+
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(len(set(seen)), 120)
+
+    def test_amount_filter(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('history') + '?amount_min=100&amount_max=110')
+        self.assertEqual(len(response.context['transactions']), 11)
+        self.assertIsNone(response.context['next_cursor'])
+
+
+class TransactionsApiTests(TestCase):
+    """Пакетный JSON API операций"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='api', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.taxi = Category.objects.create(user=self.user, name='Такси')
+        self.client.force_login(self.user)
+        self.url = reverse('api_transactions')
+
+    def send(self, method, data):
+        return getattr(self.client, method)(self.url, json.dumps(data), content_type='application/json')
+
+    def test_batch_create_update_delete(self):
+        items = [
+            {'amount': '100.50', 'date': '2025-03-01', 'category': self.food.pk},
+            {'amount': 250, 'date': '2025-03-02', 'category': self.taxi.pk, 'description': 'домой'},
+        ]
+        response = self.send('post', {'items': items})
+        self.assertEqual(response.status_code, 201)
+        created = response.json()['results']
+        self.assertEqual([op['amount'] for op in created], ['100.50', '250.00'])
+
+        response = self.send('patch', {'items': [{'id': created[0]['id'], 'category': self.taxi.pk}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.filter(category=self.taxi).count(), 2)
+
+        response = self.send('delete', {'ids': [created[1]['id']]})
+        self.assertEqual(response.json(), {'deleted': 1})
+        self.assertEqual(verify_rollups([self.user.pk]), [])
+
+    def test_batch_delete_keeps_anomalies_and_versions(self):
+        operations = [
+            Transaction.objects.create(user=self.user, category=self.food, amount=Decimal(amount), date=date(2025, 3, 1))
+            for amount in ('100', '200', '300')
+        ]
+        anomaly = Anomaly.objects.create(
+            user=self.user, transaction=operations[0], score=5, description='Необычная трата'
+        )
+        version = User.objects.get(pk=self.user.pk).data_version
+
+        response = self.send('delete', {'ids': [op.pk for op in operations[:2]]})
+        self.assertEqual(response.json(), {'deleted': 2})
+        # Каскад SET_NULL из модели, версия данных — один раз на пакет
+        anomaly.refresh_from_db()
+        self.assertIsNone(anomaly.transaction_id)
+        self.assertEqual(User.objects.get(pk=self.user.pk).data_version, version + 1)
+        self.assertEqual(verify_rollups([self.user.pk]), [])
+        self.assertEqual(CategoryStats.objects.get(category=self.food).count, 1)
+
+    def test_batch_delete_updates_rollup_in_bulk(self):
+        self.send('post', {'items': [
+            {'amount': '10', 'date': '2025-03-01', 'category': self.food.pk} for _ in range(20)
+        ]})
+        ids = list(Transaction.objects.filter(user=self.user).values_list('pk', flat=True))
+        version = User.objects.get(pk=self.user.pk).data_version
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.send('delete', {'ids': ids})
+
+        self.assertEqual(response.json(), {'deleted': 20})
+        self.assertLess(len(context.captured_queries), 20)
+        self.assertEqual(verify_rollups([self.user.pk]), [])
+        self.assertEqual(User.objects.get(pk=self.user.pk).data_version, version + 1)
+
+    def test_requires_csrf_token_and_json(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        data = json.dumps({'ids': [1]})
+        self.assertEqual(client.delete(self.url, data, content_type='application/json').status_code, 403)
+
+        response = self.client.post(self.url, {'items': '[]'})
+        self.assertEqual(response.status_code, 415)
+
+    def test_invalid_item_rejects_batch(self):
+        items = [
+            {'amount': '100', 'date': '2025-03-01', 'category': self.food.pk},
+            {'amount': '-5', 'date': 'вчера', 'category': 999},
+        ]
+        response = self.send('post', {'items': items})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['errors']['1']), {'amount', 'date', 'category'})
+        self.assertFalse(Transaction.objects.filter(user=self.user).exists())
+
+    def test_list(self):
+        self.send('post', {'items': [
+            {'amount': '10', 'date': '2025-03-01', 'category': self.food.pk} for _ in range(3)
+        ]})
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertIsNone(response.json()['next_cursor'])
+
+
+class AnomalyDetectionTests(TestCase):
+    """Поиск необычных трат"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='spender', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.today = timezone.now().date()
+        for index in range(20):
+            Transaction.objects.create(
+                user=self.user, category=self.food, amount=Decimal(480 + index * 2),
+                date=self.today - timedelta(days=index + 1)
+            )
+
+    def test_check_on_save(self):
+        self.assertFalse(Anomaly.objects.exists())
+        self.assertEqual(CategoryStats.objects.get(category=self.food).count, 20)
+
+        big = Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('5000'), date=self.today)
+
+        anomaly = Anomaly.objects.get()
+        self.assertEqual(anomaly.transaction, big)
+        self.assertGreater(anomaly.score, 3.5)
+
+    def test_nightly_batch(self):
+        # Операция в обход сигналов, как при импорте
+        big = Transaction.objects.bulk_create([
+            Transaction(user=self.user, category=self.food, amount=Decimal('5000'), date=self.today)
+        ])[0]
+
+        self.assertEqual(detect_anomalies(today=self.today), 1)
+        self.assertEqual(Anomaly.objects.get().transaction_id, big.pk)
+        stats = CategoryStats.objects.get(category=self.food)
+        self.assertEqual(stats.count, 21)
+        self.assertEqual(stats.median, 500.0)
+
+        # Повторный запуск не создаёт дублей
+        self.assertEqual(detect_anomalies(today=self.today), 0)
+
+    def assertStatsMatch(self, category):
+        amounts = [float(a) for a in Transaction.objects.filter(category=category).values_list('amount', flat=True)]
+        stats = CategoryStats.objects.get(category=category)
+        self.assertEqual(stats.count, len(amounts))
+        self.assertAlmostEqual(stats.mean, float(np.mean(amounts)) if amounts else 0.0)
+        self.assertAlmostEqual(stats.std, float(np.std(amounts, ddof=1)) if len(amounts) > 1 else 0.0)
+
+    def test_stats_follow_edit_and_delete(self):
+        cafe = Category.objects.create(user=self.user, name='Кафе')
+        operations = list(Transaction.objects.filter(category=self.food).order_by('pk'))
+
+        operations[0].amount = Decimal('700')
+        operations[0].save()
+        self.assertStatsMatch(self.food)
+
+        operations[1].category = cafe
+        operations[1].save()
+        self.assertStatsMatch(self.food)
+        self.assertStatsMatch(cafe)
+
+        operations[2].delete()
+        operations[1].delete()
+        self.assertStatsMatch(self.food)
+        self.assertStatsMatch(cafe)
+
+    def test_stats_follow_batch_api(self):
+        before = CategoryStats.objects.filter(category=self.food).values_list('count', 'mean', 'm2').get()
+        self.client.force_login(self.user)
+        items = [
+            {'amount': str(1000 + index), 'date': self.today.isoformat(), 'category': self.food.pk}
+            for index in range(5)
+        ]
+        response = self.client.post(reverse('api_transactions'), json.dumps({'items': items}),
+                                    content_type='application/json')
+        self.assertStatsMatch(self.food)
+
+        ids = [op['id'] for op in response.json()['results']]
+        self.client.delete(reverse('api_transactions'), json.dumps({'ids': ids}), content_type='application/json')
+        after = CategoryStats.objects.filter(category=self.food).values_list('count', 'mean', 'm2').get()
+        self.assertEqual(after[0], before[0])
+        self.assertAlmostEqual(after[1], before[1])
+        self.assertAlmostEqual(after[2], before[2], places=4)
+
+    def test_nightly_batch_drops_stale_stats(self):
+        old = Category.objects.create(user=self.user, name='Ремонт')
+        Transaction.objects.create(
+            user=self.user, category=old, amount=Decimal('9000'), date=self.today - timedelta(days=400)
+        )
+        self.assertTrue(CategoryStats.objects.filter(category=old).exists())
+
+        detect_anomalies(today=self.today)
+
+        self.assertFalse(CategoryStats.objects.filter(category=old).exists())
+        self.assertTrue(CategoryStats.objects.filter(category=self.food).exists())
+
+
+class RecommendationTests(TestCase):
+    """Сохранённые рекомендации"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='planner', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.today = timezone.now().date()
+
+    def test_batch_writes_rows(self):
+        self.assertEqual(refresh_recommendations(today=self.today), 1)
+
+        stored = Recommendation.objects.get(user=self.user)
+        self.assertEqual(stored.kind, Recommendation.KIND_GENERAL)
+        self.assertEqual(stored.data_version, User.objects.get(pk=self.user.pk).data_version)
+        self.assertEqual(stored.computed_on, self.today)
+
+    def test_refreshed_after_data_change(self):
+        refresh_recommendations(today=self.today)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(get_recommendations(self.user, today=self.today)), 1)
+
+        Transaction.objects.create(user=self.user, category=self.food, amount=Decimal('40000'), date=self.today)
+        MonthlyBudget.objects.create(
+            user=self.user, month=self.today.strftime('%Y-%m'), planned_expense=Decimal('10000')
+        )
+
+        texts = get_recommendations(self.user, today=self.today)
+        self.assertIn("Вы тратите много. Рассмотрите возможность сокращения расходов.", texts)
+        budget = get_recommendations(
+            self.user, kinds=(Recommendation.KIND_BUDGET, Recommendation.KIND_FORECAST), today=self.today
+        )
+        self.assertEqual(len(budget), 2)
+        self.assertTrue(budget[0].startswith("⚠️ Ваши расходы превысили план на 30000.00 ₽"))
+
+
+class FavoriteReportTests(TestCase):
+    """Избранные отчёты"""
+
+    def setUp(self):
+        # id пользователей между тестами могут повторяться, а кэш — нет
+        cache.clear()
+        self.user = User.objects.create_user(username='reporter', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.cafe = Category.objects.create(user=self.user, name='Кафе', parent=self.food)
+        self.taxi = Category.objects.create(user=self.user, name='Такси')
+        self.today = timezone.now().date()
+        for category, amount in ((self.food, '300'), (self.cafe, '700'), (self.cafe, '1500'), (self.taxi, '400')):
+            Transaction.objects.create(user=self.user, category=category, amount=Decimal(amount), date=self.today)
+
+    def test_canonical_hash(self):
+        first = parse_filters({'metric': 'sum', 'categories': [2, 1, 2], 'period': 'month'})
+        second = parse_filters({'categories': [1, 2]})
+        period = resolve_period(first['period'], self.today)
+        self.assertEqual(filters_hash(first, period), filters_hash(second, period))
+
+        with self.assertRaises(ReportFilterError):
+            parse_filters({'metric': 'median'})
+        with self.assertRaises(ReportFilterError):
+            parse_filters({'amount_min': '500', 'amount_max': '100'})
+
+    def test_subcategories_and_amount_range(self):
+        result = run_report(self.user, {'period': 'all', 'categories': [self.food.pk]}, self.today)
+        self.assertEqual(result.rows, [('Кафе', Decimal('2200')), ('Еда', Decimal('300'))])
+        self.assertEqual(result.total, Decimal('2500'))
+
+        result = run_report(
+            self.user, {'period': 'all', 'amount_min': '350', 'amount_max': '1000', 'group_by': 'none', 'metric': 'count'},
+            self.today
+        )
+        self.assertEqual(result.total, 2)
+
+    def test_cached_until_data_changes(self):
+        filters = {'period': 'month', 'metric': 'avg', 'group_by': 'none'}
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(run_report(user, filters, self.today).total, Decimal('725.00'))
+        with self.assertNumQueries(0):
+            run_report(user, filters, self.today)
+
+        Transaction.objects.create(user=self.user, category=self.taxi, amount=Decimal('100'), date=self.today)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(run_report(user, filters, self.today).total, Decimal('600.00'))
+
+    def test_category_rename_invalidates_cache(self):
+        filters = {'period': 'month', 'categories': [self.taxi.pk]}
+        self.assertEqual(run_report(User.objects.get(pk=self.user.pk), filters, self.today).rows[0][0], 'Такси')
+
+        self.taxi.name = 'Такси и каршеринг'
+        self.taxi.save()
+
+        result = run_report(User.objects.get(pk=self.user.pk), filters, self.today)
+        self.assertEqual(result.rows, [('Такси и каршеринг', Decimal('400'))])
+
+    def test_delete_with_bad_id(self):
+        self.client.force_login(self.user)
+        for url in (reverse('reports'), reverse('category_rules')):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url, {'delete': 'abc'}).status_code, 400)
+
+
+class BudgetForecastTests(TestCase):
+    """Прогноз расходов на конец месяца"""
+
+    def test_weekday_seasonality(self):
+        # Траты только по субботам; 15 июня 2025 — воскресенье, впереди ещё две субботы
+        today = date(2025, 6, 15)
+        since = today - timedelta(days=HISTORY_DAYS - 1)
+        matrix = np.array([[
+            100.0 if (since + timedelta(days=n)).weekday() == 5 else 0.0 for n in range(HISTORY_DAYS)
+        ]])
+
+        spent, projections = project(matrix, since, today)
+
+        self.assertEqual(spent[0], 200)
+        self.assertAlmostEqual(projections[BudgetForecast.METHOD_WEEKDAY][0], 400)
+        self.assertAlmostEqual(projections[BudgetForecast.METHOD_MEAN][0], 400)
+        self.assertGreater(projections[BudgetForecast.METHOD_EWMA][0], 200)
+
+    def test_nightly_batch_flags_overspending(self):
+        today = timezone.now().date()
+        month = today.strftime('%Y-%m')
+        category = Category.objects.create(user=User.objects.create_user(username='a', password='p'), name='Еда')
+        careful = User.objects.create_user(username='b', password='p')
+        MonthlyBudget.objects.create(user=category.user, month=month, planned_expense=Decimal('100'))
+        MonthlyBudget.objects.create(user=careful, month=month, planned_expense=Decimal('100000'))
+        Transaction.objects.create(user=category.user, category=category, amount=Decimal('500'), date=today)
+
+        self.assertEqual(forecast_budgets(today=today), 1)
+        self.assertTrue(BudgetForecast.objects.get(user=category.user).will_overspend)
+        self.assertFalse(BudgetForecast.objects.get(user=careful).will_overspend)
+
+
+class CategoryHierarchyTests(TestCase):
+    """Замыкание дерева категорий и итоги по поддеревьям"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tree', password='password')
+        self.food = Category.objects.create(user=self.user, name='Еда')
+        self.cafe = Category.objects.create(user=self.user, name='Кафе', parent=self.food)
+        self.coffee = Category.objects.create(user=self.user, name='Кофейни', parent=self.cafe)
+        self.taxi = Category.objects.create(user=self.user, name='Такси')
+        self.today = timezone.now().date()
+        for category, amount in ((self.food, '100'), (self.cafe, '200'), (self.coffee, '300'), (self.taxi, '50')):
+            Transaction.objects.create(user=self.user, category=category, amount=Decimal(amount), date=self.today)
+
+    def links(self):
+        return set(CategoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_subtree_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            totals = subtree_totals(self.user, ALL_TIME)
+
+        self.assertEqual(totals[self.food.pk].total, Decimal('600'))
+        self.assertEqual(totals[self.cafe.pk].total, Decimal('500'))
+        tree = CategoryTree(totals)
+        self.assertEqual(tree.own(self.food.pk), Decimal('100'))
+        self.assertEqual(tree.rollup(0), {'Еда': Decimal('600'), 'Такси': Decimal('50')})
+        self.assertEqual(tree.rollup(1)['Кафе'], Decimal('500'))
+
+    def test_reparent_and_delete(self):
+        transport = Category.objects.create(user=self.user, name='Транспорт')
+        self.cafe.parent = transport
+        self.cafe.save()
+        self.assertIn((transport.pk, self.coffee.pk, 2), self.links())
+        self.assertNotIn((self.food.pk, self.coffee.pk, 2), self.links())
+
+        transport.parent = self.coffee
+        with self.assertRaises(CategoryCycleError):
+            transport.save()
+        transport.refresh_from_db()
+
+        # Подкатегории удалённой категории становятся корневыми
+        transport.delete()
+        self.cafe.refresh_from_db()
+        self.assertIsNone(self.cafe.parent)
+        self.assertNotIn(self.cafe.pk, CategoryTree(subtree_totals(self.user, ALL_TIME)).children[self.food.pk])
+        expected = self.links()
+        self.assertEqual(rebuild_closure(), len(expected))
+        self.assertEqual(self.links(), expected)
@@ -8,11 +8,21 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('add/', views.add_operation, name='add_operation'),
     path('history/', views.history_view, name='history'),
+    path('history/export/<str:fmt>/', views.export_history, name='export_history'),
     path('analytics/', views.analytics_view, name='analytics'),
     path('categories/', views.category_list, name='category_list'),
     path('categories/add/', views.category_create, name='category_create'),
     path('categories/edit/<int:pk>/', views.category_update, name='category_update'),
     path('telegram-link/', views.generate_telegram_link, name='telegram_link'),
     path('api/categories/create/', views.api_create_category, name='api_create_category'),
+    path('api/transactions/', views.api_transactions, name='api_transactions'),
     path('budget/', views.budget_view, name='budget'),
+    path('charts/status/', views.chart_status_view, name='chart_status'),
+    path('api/charts/income-expense/', views.api_chart_income_expense, name='api_chart_income_expense'),
+    path('api/charts/categories/', views.api_chart_categories, name='api_chart_categories'),
+    path('import/', views.import_view, name='import_statement'),
+    path('import/<int:pk>/status/', views.import_status_view, name='import_status'),
+    path('categories/rules/', views.category_rules_view, name='category_rules'),
+    path('reports/', views.reports_view, name='reports'),
+    path('reports/<int:pk>/', views.report_view, name='report'),
 ]
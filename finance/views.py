@@ -1,26 +1,32 @@
 import uuid
-import os
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
-from datetime import datetime
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
-from django.conf import settings
 from django.contrib import messages
-from .forms import TransactionForm, RegisterForm, CategoryForm
-from .models import Category,Transaction, Anomaly, FavoriteReport
-from pathlib import Path
+from .forms import (
+    TransactionForm, RegisterForm, CategoryForm, CategoryRuleForm, FavoriteReportForm, HistoryFilterForm,
+    StatementImportForm
+)
+from .models import Category,Transaction, Anomaly, FavoriteReport, CategoryRule, ImportJob, Recommendation
 from .models import TelegramLinkToken
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from datetime import timedelta
+from django.views.decorators.http import condition, require_http_methods
 import json
-from .models import MonthlyBudget
+from .models import BudgetForecast, MonthlyBudget
 from .forms import MonthlyBudgetForm
+from .chart_data import DEFAULT_BUCKET, category_distribution, chart_data_etag, time_series
+from .chart_jobs import chart_status, charts_status
+from .charts import CHARTS
+from .batch import BatchError, create_transactions, delete_transactions, serialize, update_transactions
+from .exports import iter_csv, write_xlsx
+from .imports import fail_stale_imports, start_import
+from .pagination import InvalidCursor, keyset_page
+from .recommendations import get_recommendations
+from .reports import METRIC_LABELS, format_period, format_value, run_report
+from .periods import parse_month
+from .summary import ALL_TIME, month_period, summarize_period
 from django.utils import timezone
 
 
@@ -66,29 +72,59 @@ def add_operation(request):
 
 @login_required
 def history_view(request):
-    transactions = Transaction.objects.filter(user=request.user)
+    filters = HistoryFilterForm(request.GET, user=request.user)
+    transactions = filters.filter(
+        Transaction.objects.filter(user=request.user), timezone.now().date()
+    ).select_related('category').only(
+        'date', 'amount', 'description', 'category__name', 'category__is_income'
+    )
+
+    try:
+        page, next_cursor = keyset_page(transactions, request.GET.get('cursor'))
+    except InvalidCursor:
+        return redirect('history')
 
-    # Фильтр по периоду
-    period = request.GET.get('period')
-    if period == 'today':
-        transactions = transactions.filter(date=timezone.now().date())
-    elif period == 'week':
-        start_week = timezone.now().date() - timedelta(days=timezone.now().weekday())
-        transactions = transactions.filter(date__gte=start_week)
-    elif period == 'month':
-        transactions = transactions.filter(date__month=timezone.now().month,
-                                           date__year=timezone.now().year)
+    # Параметры фильтров без курсора — для ссылок на страницы и выгрузку
+    query = request.GET.copy()
+    query.pop('cursor', None)
 
     return render(request, 'finance/history.html', {
-        'transactions': transactions.order_by('-date'),
-        'period': period
+        'transactions': page,
+        'filters': filters,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'query': query.urlencode(),
     })
 
 
+@login_required
+def export_history(request, fmt):
+    """Выгрузка истории в CSV или XLSX с теми же фильтрами, что и на странице"""
+    filters = HistoryFilterForm(request.GET, user=request.user)
+    transactions = filters.filter(Transaction.objects.filter(user=request.user), timezone.now().date())
+    # В имя файла попадает только проверенный формой период, а не сырой параметр
+    period = filters.cleaned_data.get('period') if filters.is_valid() else None
+    filename = f"operations_{period or 'all'}_{timezone.now():%Y-%m-%d}.{fmt}"
+
+    if fmt == 'csv':
+        response = StreamingHttpResponse(iter_csv(transactions), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    if fmt == 'xlsx':
+        return FileResponse(
+            write_xlsx(transactions),
+            as_attachment=True,
+            filename=filename,
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    raise Http404('Неизвестный формат выгрузки')
+
+
 @login_required
 def analytics_view(request):
-    # Здесь будет логика для получения данных
-    recommendations = Recommendation.objects.filter(user=request.user).order_by('-created_at')[:5]
+    # Набор рекомендаций обновляется, если данные изменились с момента расчёта
+    get_recommendations(request.user)
+    recommendations = Recommendation.objects.filter(user=request.user)
     return render(request, 'finance/analytics.html', {'recommendations': recommendations})
 
 @login_required
@@ -99,154 +135,28 @@ def category_list(request):
 @login_required
 def category_create(request):
     if request.method == 'POST':
-        form = CategoryForm(request.POST)
+        form = CategoryForm(request.POST, user=request.user)
         if form.is_valid():
             category = form.save(commit=False)
             category.user = request.user
             category.save()
             return redirect('category_list')
     else:
-        form = CategoryForm()
+        form = CategoryForm(user=request.user)
     return render(request, 'finance/category_form.html', {'form': form, 'title': 'Добавить категорию'})
 
 @login_required
 def category_update(request, pk):
     category = get_object_or_404(Category, pk=pk, user=request.user)
     if request.method == 'POST':
-        form = CategoryForm(request.POST, instance=category)
+        form = CategoryForm(request.POST, instance=category, user=request.user)
         if form.is_valid():
             form.save()
             return redirect('category_list')
     else:
-        form = CategoryForm(instance=category)
+        form = CategoryForm(instance=category, user=request.user)
     return render(request, 'finance/category_form.html', {'form': form, 'title': 'Редактировать категорию'})
 
-@login_required
-def home(request):
-    # Получаем все операции текущего пользователя
-    transactions = Transaction.objects.filter(user=request.user)
-
-    # Считаем доходы и расходы
-    total_income = transactions.filter(category__is_income=True).aggregate(sum=Sum('amount'))['sum'] or 0
-    total_expense = transactions.filter(category__is_income=False).aggregate(sum=Sum('amount'))['sum'] or 0
-    balance = total_income - total_expense
-
-    # Последние 3 операции
-    recent_transactions = transactions.select_related('category')[:3]
-
-    # Рекомендации (пример простых советов)
-    recommendations = []
-    if total_expense > 30000:
-        recommendations.append("Вы тратите много. Рассмотрите возможность сокращения расходов.")
-    if total_income > 0 and total_expense / total_income > 0.7:
-        recommendations.append("Ваши расходы составляют более 70% от дохода — обратите внимание на бюджет.")
-    if not recommendations:
-        recommendations.append("Отличная работа! Вы хорошо управляете своими финансами.")
-
-
-
-    chart1 = create_income_expense_chart(request.user)
-    chart2 = create_category_pie_chart(request.user)
-
-    print("Chart 1 path:", chart1)
-    print("Chart 2 path:", chart2)
-
-    context = {
-        'total_income': total_income,
-        'total_expense': total_expense,
-        'balance': balance,
-        'recent_transactions': recent_transactions,
-        'recommendations': recommendations,
-    }
-    return render(request, 'finance/index.html', context)
-
-
-def create_income_expense_chart(user):
-    transactions = Transaction.objects.filter(user=user)
-    if not transactions.exists():
-        return None
-
-    data = []
-    for t in transactions:
-        data.append({
-            'date': t.date,
-            'amount': float(t.amount),
-            'is_income': t.category.is_income
-        })
-
-    df = pd.DataFrame(data)
-    df['date'] = pd.to_datetime(df['date'])
-    df['year_month'] = df['date'].dt.strftime('%Y-%m')
-
-    income = df[df['is_income']].groupby('year_month')['amount'].sum()
-    expense = df[~df['is_income']].groupby('year_month')['amount'].sum()
-
-    plt.figure(figsize=(10, 5))
-    if not income.empty:
-        plt.plot(income.index, income.values, label='Доходы', color='green', marker='o')
-    if not expense.empty:
-        plt.plot(expense.index, expense.values, label='Расходы', color='red', marker='s')
-
-    plt.title('Доходы и расходы по месяцам')
-    plt.xlabel('Месяц')
-    plt.ylabel('Сумма (₽)')
-    plt.xticks(rotation=45)
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-
-    # Путь к файлу
-    static_dir = settings.STATICFILES_DIRS[0]  # Это Path
-    chart_path = Path(static_dir) / 'images' / 'income_expense.png'
-    chart_path.parent.mkdir(parents=True, exist_ok=True)  # Создаёт папку, если её нет
-
-    try:
-        plt.savefig(chart_path, dpi=100)
-        plt.close()
-        print(f"✅ График сохранён: {chart_path}")
-        return '/static/images/income_expense.png'
-    except Exception as e:
-        print(f"❌ Ошибка сохранения графика: {e}")
-        plt.close()
-        return None
-
-
-def create_category_pie_chart(user):
-    expenses = Transaction.objects.filter(user=user, category__is_income=False)
-    if not expenses.exists():
-        return None
-
-    data = []
-    for t in expenses:
-        data.append({
-            'category': t.category.name,
-            'amount': float(t.amount)
-        })
-
-    df = pd.DataFrame(data)
-    category_totals = df.groupby('category')['amount'].sum()
-
-    plt.figure(figsize=(8, 8))
-    colors = plt.cm.Set3(range(len(category_totals)))
-    plt.pie(category_totals.values, labels=category_totals.index, autopct='%1.1f%%', startangle=90, colors=colors)
-    plt.title('Распределение расходов по категориям')
-    plt.tight_layout()
-
-    static_dir = settings.STATICFILES_DIRS[0]
-    chart_path = Path(static_dir) / 'images' / 'category_pie.png'
-    chart_path.parent.mkdir(parents=True, exist_ok=True)
-
-    try:
-        plt.savefig(chart_path, dpi=100)
-        plt.close()
-        print(f"✅ Диаграмма сохранена: {chart_path}")
-        return '/static/images/category_pie.png'
-    except Exception as e:
-        print(f"❌ Ошибка сохранения диаграммы: {e}")
-        plt.close()
-        return None
-
-
 @login_required
 def generate_telegram_link(request):
     # Удаляем старый токен, если есть
@@ -322,19 +232,13 @@ def budget_view(request):
     else:
         form = MonthlyBudgetForm(instance=budget)
 
-    # Получаем транзакции за текущий месяц
-    # Преобразуем строку "2025-08" в объект даты для фильтрации
-    year, month = map(int, current_month.split('-'))
-
-    transactions = Transaction.objects.filter(
-        user=request.user,
-        date__year=year,
-        date__month=month
-    )
+    # Получаем итоги за текущий месяц
+    # Преобразуем строку "2025-08" в полуинтервал дат, чтобы работал индекс
+    summary = summarize_period(request.user, month_period(parse_month(current_month)))
 
     # Считаем фактические доходы и расходы
-    total_income = transactions.filter(category__is_income=True).aggregate(sum=Sum('amount'))['sum'] or 0
-    total_expense = transactions.filter(category__is_income=False).aggregate(sum=Sum('amount'))['sum'] or 0
+    total_income = summary.income
+    total_expense = summary.expense
 
     # Разница
     income_diff = total_income - budget.planned_income
@@ -363,171 +267,207 @@ def budget_view(request):
 def home(request):
     """Главная страница с аналитикой"""
     transactions = Transaction.objects.filter(user=request.user)
+    today = timezone.now().date()
 
     # Получаем бюджет на текущий месяц
-    current_month = timezone.now().replace(day=1)
     try:
-        budget = MonthlyBudget.objects.get(user=request.user, month=current_month)
+        budget = MonthlyBudget.objects.get(user=request.user, month=today.strftime('%Y-%m'))
     except MonthlyBudget.DoesNotExist:
         budget = None
 
-    # Считаем фактические доходы и расходы
-    total_income = transactions.filter(category__is_income=True).aggregate(sum=Sum('amount'))['sum'] or 0
-    total_expense = transactions.filter(category__is_income=False).aggregate(sum=Sum('amount'))['sum'] or 0
-    balance = total_income - total_expense
-
-    # Генерируем рекомендации
-    recommendations = []
-
-    # 1. Стандартные рекомендации
-    if total_expense > 30000:
-        recommendations.append("Вы тратите много. Рассмотрите возможность сокращения расходов.")
-    if total_income > 0 and total_expense / total_income > 0.7:
-        recommendations.append("Ваши расходы составляют более 70% от дохода — обратите внимание на бюджет.")
-
-    # 2. Рекомендации на основе бюджета
-    if budget:
-        # Анализ доходов
-        if budget.planned_income > 0:
-            income_diff = total_income - budget.planned_income
-            income_percent = (total_income / budget.planned_income * 100) if budget.planned_income else 0
-
-            if income_diff > 0:
-                recommendations.append(
-                    f"✅ Ваши доходы превысили план на {abs(income_diff):.2f} ₽ "
-                    f"({income_percent:.1f}% от запланированного). Отлично!"
-                )
-            elif income_diff < 0:
-                recommendations.append(
-                    f"⚠️ Ваши доходы ниже плана на {abs(income_diff):.2f} ₽ "
-                    f"({income_percent:.1f}% от запланированного). "
-                    "Рассмотрите возможности увеличения доходов."
-                )
-
-        # Анализ расходов
-        if budget.planned_expense > 0:
-            expense_diff = total_expense - budget.planned_expense
-            expense_percent = (total_expense / budget.planned_expense * 100) if budget.planned_expense else 0
-
-            if expense_diff > 0:
-                recommendations.append(
-                    f"⚠️ Ваши расходы превысили план на {abs(expense_diff):.2f} ₽ "
-                    f"({expense_percent:.1f}% от запланированного). "
-                    "Обратите внимание на категории с наибольшими отклонениями."
-                )
-            elif expense_diff < 0:
-                recommendations.append(
-                    f"✅ Ваши расходы ниже плана на {abs(expense_diff):.2f} ₽ "
-                    f"({expense_percent:.1f}% от запланированного). "
-                    "Отлично! Вы укладываетесь в бюджет."
-                )
-
-        # Прогноз на конец месяца
-        days_passed = (timezone.now().date() - current_month.date()).days + 1
-        if days_passed > 0 and budget.planned_expense > 0:
-            daily_expense = total_expense / days_passed
-            days_remaining = (current_month.replace(month=current_month.month % 12 + 1) - timedelta(
-                days=1)).day - days_passed
-            projected_expense = total_expense + (daily_expense * days_remaining)
-
-            if projected_expense > budget.planned_expense:
-                over = projected_expense - budget.planned_expense
-                recommendations.append(
-                    f"⚠️ По текущим тратам вы превысите бюджет на конец месяца на {over:.2f} ₽"
-                )
-            else:
-                remaining = budget.planned_expense - projected_expense
-                recommendations.append(
-                    f"✅ По текущим тратам вы уложитесь в бюджет, остаток составит {remaining:.2f} ₽"
-                )
-
-    # 3. Анализ по категориям
-    if transactions.filter(category__is_income=False).exists():
-        # Получаем топ-3 категории с наибольшими расходами
-        category_expenses = {}
-        for transaction in transactions.filter(category__is_income=False):
-            category_name = transaction.category.name
-            if category_name not in category_expenses:
-                category_expenses[category_name] = 0
-            category_expenses[category_name] += transaction.amount
-
-        # Сортируем и получаем топ-3
-        top_categories = sorted(category_expenses.items(), key=lambda x: x[1], reverse=True)[:3]
-
-        for category, amount in top_categories:
-            if amount > 5000:  # Порог для "больших" расходов
-                recommendations.append(
-                    f"💡 Вы тратите много на '{category}' — {amount:.2f} ₽. "
-                    "Может быть, есть возможности для оптимизации?"
-                )
-
-    # 4. Если нет рекомендаций
-    if not recommendations:
-        recommendations.append("Отличная работа! Вы хорошо управляете своими финансами.")
+    totals = summarize_period(request.user, ALL_TIME)
+
+    # Рекомендации и прогноз считаются заранее и пересчитываются только при изменении данных
+    recommendations = get_recommendations(request.user, today=today)
+    forecast = BudgetForecast.objects.filter(user=request.user, month=budget.month).first() if budget else None
 
     # Остальная логика
     recent_transactions = transactions.select_related('category')[:3]
-    chart1 = create_income_expense_chart(request.user)
-    chart2 = create_category_pie_chart(request.user)
-    chart3 = create_budget_chart(request.user)
+    # Доходы/расходы и категории рисуются в браузере по JSON,
+    # график бюджета — в фоне; страница сразу получает готовый или заглушку
+    charts = charts_status(request.user, ['budget_comparison']) if budget else {}
 
     context = {
-        'total_income': total_income,
-        'total_expense': total_expense,
-        'balance': balance,
+        'total_income': totals.income,
+        'total_expense': totals.expense,
+        'balance': totals.balance,
         'recent_transactions': recent_transactions,
         'recommendations': recommendations,
-        'chart_income_expense': chart1,
-        'chart_category_distribution': chart2,
+        'charts': charts,
         'budget': budget,
-        'chart_budget_comparison': chart3
+        'forecast': forecast,
     }
     return render(request, 'finance/index.html', context)
 
 
-def create_budget_chart(user):
-    """Создает график сравнения плана и факта"""
-    current_month = datetime.now().replace(day=1)
-    next_month = current_month + timedelta(days=31)
-    next_month = next_month.replace(day=1)
+@login_required
+def chart_status_view(request):
+    """Состояние графиков пользователя для опроса со страницы"""
+    kinds = [kind for kind in request.GET.getlist('kind') if kind in CHARTS] or list(CHARTS)
+    return JsonResponse({kind: chart_status(request.user, kind) for kind in kinds})
 
-    # Получаем транзакции за текущий месяц
-    transactions = Transaction.objects.filter(
-        user=user,
-        date__gte=current_month,
-        date__lt=next_month
-    )
 
-    # Считаем фактические доходы и расходы
-    total_income = transactions.filter(category__is_income=True).aggregate(sum=Sum('amount'))['sum'] or 0
-    total_expense = transactions.filter(category__is_income=False).aggregate(sum=Sum('amount'))['sum'] or 0
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=chart_data_etag)
+def api_chart_income_expense(request):
+    """Доходы и расходы по интервалам (?bucket=day|week|month|quarter|year|auto)"""
+    return JsonResponse(time_series(request.user, request.GET.get('bucket', DEFAULT_BUCKET)))
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=chart_data_etag)
+def api_chart_categories(request):
+    """Распределение расходов по категориям для диаграммы на главной.
+
+    ?depth=N сворачивает подкатегории глубже уровня N (0 — только корневые категории).
+    """
+    depth = request.GET.get('depth', '')
+    return JsonResponse(category_distribution(request.user, int(depth) if depth.isdigit() else None))
 
-    # Получаем бюджет
-    try:
-        budget = MonthlyBudget.objects.get(user=user, month=current_month)
-        planned_income = float(budget.planned_income)
-        planned_expense = float(budget.planned_expense)
-    except MonthlyBudget.DoesNotExist:
-        return None
 
-    # Строим график
-    plt.figure(figsize=(10, 6))
+# Сколько последних импортов показывать на странице
+IMPORT_JOBS_SHOWN = 10
 
-    # План
-    plt.bar(['План', 'Факт'], [planned_income, total_income], color=['skyblue', 'green'], alpha=0.7, label='Доходы')
-    plt.bar(['План', 'Факт'], [planned_expense, total_expense], bottom=[planned_income, total_income],
-            color=['salmon', 'red'], alpha=0.7, label='Расходы')
 
-    plt.title(f'Сравнение плана и факта за {current_month.strftime("%B %Y")}')
-    plt.ylabel('Сумма (₽)')
-    plt.legend()
-    plt.grid(True, alpha=0.3)
+@login_required
+def import_view(request):
+    """Загрузка банковской выписки; импорт выполняется в фоне"""
+    if request.method == 'POST':
+        form = StatementImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            start_import(request.user, form.cleaned_data['file'])
+            return redirect('import_statement')
+    else:
+        form = StatementImportForm()
 
-    # Сохраняем график
-    static_dir = settings.STATICFILES_DIRS[0]
-    chart_path = Path(static_dir) / 'images' / 'budget_comparison.png'
-    chart_path.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(chart_path)
-    plt.close()
+    fail_stale_imports(request.user)
+    return render(request, 'finance/import.html', {
+        'form': form,
+        'jobs': ImportJob.objects.filter(user=request.user)[:IMPORT_JOBS_SHOWN],
+        'rules_count': CategoryRule.objects.filter(user=request.user).count(),
+    })
 
-    return '/static/images/budget_comparison.png'
\ No newline at end of file
+
+@login_required
+def import_status_view(request, pk):
+    """Прогресс импорта для опроса со страницы"""
+    fail_stale_imports(request.user)
+    job = get_object_or_404(ImportJob, pk=pk, user=request.user)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'imported_rows': job.imported_rows,
+        'skipped_rows': job.skipped_rows,
+        'error': job.error,
+    })
+
+
+@login_required
+def category_rules_view(request):
+    """Правила, по которым импорт выбирает категорию по описанию операции"""
+    if request.method == 'POST':
+        if 'delete' in request.POST:
+            if not request.POST['delete'].isdigit():
+                return HttpResponseBadRequest('Неверный id')
+            CategoryRule.objects.filter(user=request.user, pk=int(request.POST['delete'])).delete()
+            return redirect('category_rules')
+        form = CategoryRuleForm(request.POST, user=request.user)
+        if form.is_valid():
+            rule = form.save(commit=False)
+            rule.user = request.user
+            rule.save()
+            return redirect('category_rules')
+    else:
+        form = CategoryRuleForm(user=request.user)
+
+    return render(request, 'finance/category_rules.html', {
+        'form': form,
+        'rules': CategoryRule.objects.filter(user=request.user).select_related('category'),
+    })
+
+
+@login_required
+def reports_view(request):
+    """Избранные отчёты пользователя"""
+    if request.method == 'POST':
+        if 'delete' in request.POST:
+            if not request.POST['delete'].isdigit():
+                return HttpResponseBadRequest('Неверный id')
+            FavoriteReport.objects.filter(user=request.user, pk=int(request.POST['delete'])).delete()
+            return redirect('reports')
+        form = FavoriteReportForm(request.POST)
+        if form.is_valid():
+            report = form.save(commit=False)
+            report.user = request.user
+            report.save()
+            return redirect('report', pk=report.pk)
+    else:
+        form = FavoriteReportForm(initial={'filters': {'period': 'month', 'group_by': 'category', 'metric': 'sum'}})
+
+    return render(request, 'finance/reports.html', {
+        'form': form,
+        'reports': FavoriteReport.objects.filter(user=request.user),
+    })
+
+
+@login_required
+def report_view(request, pk):
+    """Результат избранного отчёта; повторные открытия берутся из кэша, пока данные не изменились"""
+    report = get_object_or_404(FavoriteReport, pk=pk, user=request.user)
+    result = run_report(request.user, report.filters, timezone.now().date())
+    return render(request, 'finance/report.html', {
+        'report': report,
+        'result': result,
+        'rows': [(label, format_value(result.metric, value)) for label, value in result.rows],
+        'total': format_value(result.metric, result.total),
+        'metric_label': METRIC_LABELS[result.metric],
+        'period': format_period(result.period),
+    })
+
+
+@login_required
+@require_http_methods(['GET', 'POST', 'PATCH', 'DELETE'])
+def api_transactions(request):
+    """Операции пользователя.
+
+    GET — страница по курсору (?cursor=, те же фильтры, что у истории);
+    POST {"items": [...]} — создать, PATCH {"items": [{"id": ...}, ...]} — изменить,
+    DELETE {"ids": [...]} — удалить. Пакет записывается целиком или не записывается совсем.
+    Изменяющие запросы принимаются только в JSON и с CSRF-токеном (заголовок X-CSRFToken).
+    """
+    if request.method == 'GET':
+        filters = HistoryFilterForm(request.GET, user=request.user)
+        transactions = filters.filter(
+            Transaction.objects.filter(user=request.user), timezone.now().date()
+        ).select_related('category')
+        try:
+            page, next_cursor = keyset_page(transactions, request.GET.get('cursor'))
+        except InvalidCursor:
+            return JsonResponse({'error': 'Неверный курсор'}, status=400)
+        return JsonResponse({'results': [serialize(op) for op in page], 'next_cursor': next_cursor})
+
+    if request.content_type != 'application/json':
+        return JsonResponse({'error': 'Ожидается Content-Type: application/json'}, status=415)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Неверный JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Ожидается объект'}, status=400)
+
+    try:
+        if request.method == 'POST':
+            operations = create_transactions(request.user, data.get('items'))
+            return JsonResponse({'results': [serialize(op) for op in operations]}, status=201)
+        if request.method == 'PATCH':
+            operations = update_transactions(request.user, data.get('items'))
+            return JsonResponse({'results': [serialize(op) for op in operations]})
+        deleted = delete_transactions(request.user, data.get('ids'))
+        return JsonResponse({'deleted': deleted})
+    except BatchError as e:
+        return JsonResponse({'errors': e.errors}, status=400)
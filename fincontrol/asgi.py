@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fincontrol.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после инициализации Django: вебхук бота работает с моделями
+from finance.telegram.webhook import with_webhook  # noqa: E402
+
+application = with_webhook(django_application)
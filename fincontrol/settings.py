@@ -120,5 +120,28 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'finance.User'
 
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN')
-TELEGRAM_WEBHOOK_URL = None
+# Режим вебхука: адрес, на который Telegram присылает обновления, и секретный токен
+TELEGRAM_WEBHOOK_URL = config('TELEGRAM_WEBHOOK_URL', default=None)
+TELEGRAM_WEBHOOK_SECRET = config('TELEGRAM_WEBHOOK_SECRET', default=None)
+TELEGRAM_WEBHOOK_WORKERS = config('TELEGRAM_WEBHOOK_WORKERS', default=16, cast=int)
+TELEGRAM_WEBHOOK_QUEUE_SIZE = config('TELEGRAM_WEBHOOK_QUEUE_SIZE', default=1000, cast=int)
+# Процессы-обработчики обновлений (1 — обработка во входном процессе)
+TELEGRAM_BOT_WORKERS = config('TELEGRAM_BOT_WORKERS', default=1, cast=int)
+TELEGRAM_WORKER_QUEUE_SIZE = config('TELEGRAM_WORKER_QUEUE_SIZE', default=1000, cast=int)
+# Адрес Bot API (например, локального сервера telegram-bot-api или тестового)
+TELEGRAM_API_SERVER = config('TELEGRAM_API_SERVER', default=None)
+# Параметры рассылок: параллельность, ограничения скорости и повторы
+TELEGRAM_SEND_CONCURRENCY = config('TELEGRAM_SEND_CONCURRENCY', default=20, cast=int)
+TELEGRAM_GLOBAL_RATE = config('TELEGRAM_GLOBAL_RATE', default=25, cast=float)
+TELEGRAM_PER_CHAT_RATE = config('TELEGRAM_PER_CHAT_RATE', default=1, cast=float)
+# Сколько раз повторять одно сообщение (retry_after, сетевые ошибки), прежде чем считать его неотправленным
+TELEGRAM_SEND_RETRIES = config('TELEGRAM_SEND_RETRIES', default=3, cast=int)
+# Кэш пользователей в процессе бота: размер и время жизни записи (секунды)
+BOT_USER_CACHE_SIZE = config('BOT_USER_CACHE_SIZE', default=10000, cast=int)
+BOT_USER_CACHE_TTL = config('BOT_USER_CACHE_TTL', default=300, cast=int)
+BOT_CATEGORY_INDEX_SIZE = config('BOT_CATEGORY_INDEX_SIZE', default=10000, cast=int)
+BOT_CATEGORY_INDEX_TTL = config('BOT_CATEGORY_INDEX_TTL', default=300, cast=int)
+# Потоки бота для запросов к БД и время ожидания одного запроса (секунды)
+BOT_DB_WORKERS = config('BOT_DB_WORKERS', default=4, cast=int)
+BOT_DB_TIMEOUT = config('BOT_DB_TIMEOUT', default=30, cast=float)
 